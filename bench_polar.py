@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+
+# Microbenchmarks of the collector hot paths: frame parsing, sample formatting and the
+# orchestrator's forwarding. Runs offline on synthetic frames from polar_sim.py, or on the
+# frames of a recorded journal, and checks that one strap's 130 Hz ECG + 200 Hz ACC fits.
+#   python3 bench_polar.py [--journal=<project>/pmd.journal] [--save=baseline.json]
+#   python3 bench_polar.py --baseline=baseline.json [--tolerance=0.2]
+# Exits with 1 if a benchmark regressed against the baseline or can't keep up with one strap.
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, List, Mapping
+
+import pytz
+
+import polar_iface
+from collector_ipc import OutputChannel, Outgoing
+from polar_iface import (
+    ECG_SAMPLE_RATE,
+    ClockMapper,
+    PMDMeasurmentTypes,
+    PolarOptions,
+    PolarSample,
+    SampleTimestamper,
+    parse_pmd_acc,
+    parse_pmd_ecg,
+    parse_pmd_frame,
+    sample_writer_columns,
+    sample_writer_fmt,
+)
+from pmd_journal import iter_journal
+from polar_sim import SimulatedH10
+import orchestrator
+
+DEFAULT_FRAMES = 2000
+DEFAULT_REPEATS = 5
+DEFAULT_TOLERANCE = 0.2
+# Connected interface clients the forwarding benchmarks send to
+FORWARD_CONNECTIONS = 4
+# Messages forwarded between two drains of the client queues, as if by a UI tick
+FORWARD_DRAIN_EVERY = 256
+ACC_SAMPLE_RATE = 200
+
+
+@dataclass
+class BenchResult:
+    name: str
+    calls: int
+    # Best of the repeats
+    us_per_call: float
+    calls_per_s: float
+    # Most memory in use at once while handling one call, above what was in use before
+    peak_bytes_per_call: float
+    # Memory blocks still allocated after a call, i.e. the objects its result is made of
+    allocs_per_call: float
+    # How many times one strap's live data rate this keeps up with, None if not a frame path
+    realtime_x: float | None
+
+    def as_dict(self) -> Mapping[str, Any]:
+        return {
+            "calls": self.calls,
+            "us_per_call": round(self.us_per_call, 3),
+            "calls_per_s": round(self.calls_per_s, 1),
+            "peak_bytes_per_call": round(self.peak_bytes_per_call, 1),
+            "allocs_per_call": round(self.allocs_per_call, 1),
+            "realtime_x": None if self.realtime_x is None else round(self.realtime_x, 1),
+        }
+
+
+def synthetic_frames(count: int, compressed: bool) -> List[bytes]:
+    """
+    ECG and ACC notifications in the proportion one strap sends them.
+    """
+    h10 = SimulatedH10("BENCH", PolarOptions(sim_compressed=compressed))
+    h10.streams = {
+        PMDMeasurmentTypes.ECG: ECG_SAMPLE_RATE,
+        PMDMeasurmentTypes.ACC: ACC_SAMPLE_RATE,
+    }
+    per_frame = {m: h10.samples_per_frame(m) for m in h10.streams}
+    # Frames per second of each stream
+    rates = {m: h10.streams[m] / per_frame[m] for m in h10.streams}
+    next_due = {m: 0.0 for m in h10.streams}
+    sent = {m: 0 for m in h10.streams}
+
+    frames = []
+    while len(frames) < count:
+        measurement = min(next_due, key=next_due.get)
+        start = sent[measurement]
+        sent[measurement] += per_frame[measurement]
+        timestamp = int(sent[measurement] * 1e9 / h10.streams[measurement])
+        frames.append(h10.frame(measurement, start, per_frame[measurement], timestamp))
+        next_due[measurement] += 1 / rates[measurement]
+    return frames
+
+
+def recorded_frames(path: str, count: int) -> List[bytes]:
+    frames = []
+    for _, data in iter_journal(path):
+        frames.append(bytes(data))
+        if len(frames) >= count:
+            break
+    return frames
+
+
+def frame_samples(frames: List[bytes]) -> int:
+    samples = 0
+    for data in frames:
+        frame = parse_pmd_frame(data)
+        if frame and not isinstance(frame.content, bytes):
+            samples += len(frame.content)
+    return samples
+
+
+def stamped_samples(frames: List[bytes]) -> List[PolarSample]:
+    timestamper = SampleTimestamper(
+        {
+            PMDMeasurmentTypes.ECG: ECG_SAMPLE_RATE,
+            PMDMeasurmentTypes.ACC: ACC_SAMPLE_RATE,
+        }
+    )
+    clock = ClockMapper(time.time_ns() - time.monotonic_ns())
+    samples = []
+    for data in frames:
+        frame = parse_pmd_frame(data)
+        if frame and not isinstance(frame.content, bytes):
+            message = PolarSample(time=time.monotonic_ns(), sample=timestamper.stamp(frame))
+            samples.append(clock.stamp(message))
+    return samples
+
+
+def measure(
+    name: str,
+    func: Callable[[Any], Any],
+    corpus: List[Any],
+    repeats: int,
+    samples: int | None = None,
+) -> BenchResult:
+    """
+    Calls func on every corpus entry, repeats times. samples is the number of sensor samples
+    in the corpus, for comparing against the live data rate.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for item in corpus:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    peak = 0
+    # Results are kept until the end, so their allocations are still there to count
+    results = [None] * len(corpus)
+    before = tracemalloc.take_snapshot()
+    for index, item in enumerate(corpus):
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        results[index] = func(item)
+        _, item_peak = tracemalloc.get_traced_memory()
+        peak += item_peak - baseline
+    allocs = allocations_since(before)
+    tracemalloc.stop()
+
+    return bench_result(
+        name, len(corpus), best, peak / len(corpus), allocs / len(corpus), samples
+    )
+
+
+def allocations_since(before: tracemalloc.Snapshot) -> int:
+    # Blocks allocated and not freed since the snapshot, tracemalloc's own left out
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    after = tracemalloc.take_snapshot().filter_traces(ignore)
+    diffs = after.compare_to(before.filter_traces(ignore), "filename")
+    return max(0, sum(diff.count_diff for diff in diffs))
+
+
+def bench_result(
+    name: str,
+    calls: int,
+    seconds: float,
+    peak_bytes: float,
+    allocs: float,
+    samples: int | None,
+) -> BenchResult:
+    realtime_x = None
+    if samples is not None:
+        realtime_x = samples / seconds / (ECG_SAMPLE_RATE + ACC_SAMPLE_RATE)
+    return BenchResult(
+        name=name,
+        calls=calls,
+        us_per_call=seconds / calls * 1e6,
+        calls_per_s=calls / seconds,
+        peak_bytes_per_call=peak_bytes,
+        allocs_per_call=allocs,
+        realtime_x=realtime_x,
+    )
+
+
+class NullConnection:
+    """
+    A connected interface client that accepts everything instantly.
+    """
+
+    remote_address = ("bench", 0)
+
+    async def send(self, message: str):
+        pass
+
+    async def close(self):
+        pass
+
+
+async def measure_async(
+    name: str, run: Callable[[], Any], calls: int, repeats: int
+) -> BenchResult:
+    # run() handles all calls in one go, the setup it needs is part of the measurement
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await run()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    baseline, _ = tracemalloc.get_traced_memory()
+    await run()
+    _, peak = tracemalloc.get_traced_memory()
+    allocs = allocations_since(before)
+    tracemalloc.stop()
+
+    # The whole batch shares one peak, spread it over the calls
+    return bench_result(name, calls, best, (peak - baseline) / calls, allocs / calls, None)
+
+
+async def forwarding_benchmarks(
+    messages: List[Outgoing], repeats: int
+) -> List[BenchResult]:
+    ctx = orchestrator.OrchestratorContext()
+    connections = [NullConnection() for _ in range(FORWARD_CONNECTIONS)]
+    for conn in connections:
+        await ctx.on_connect(conn)
+    # Every client, they are all subscribed to everything
+    clients = ctx.clients_for("")
+
+    def drain():
+        # What each client's sender does once per UI tick, so the queues stay at the
+        # steady state of a live session instead of filling up
+        for client in clients:
+            pending, _ = client.take_pending()
+            if pending:
+                orchestrator.batch_message(pending)
+
+    # The same messages as JSON lines, the way collectors without the IPC channel print
+    lines = [
+        m.message
+        if isinstance(m.message, str)
+        else json.dumps(m.message, separators=(",", ":"))
+        for m in messages
+    ]
+
+    def chunks(items: List[Any]) -> List[List[Any]]:
+        return [
+            items[i : i + FORWARD_DRAIN_EVERY]
+            for i in range(0, len(items), FORWARD_DRAIN_EVERY)
+        ]
+
+    async def forward_all():
+        for chunk in chunks(list(zip(lines, messages))):
+            for line, m in chunk:
+                await ctx.forward(line, f"polar.{m.channel}", m.key)
+            drain()
+
+    payloads = [
+        "".join(f"{line}\n" for line in chunk).encode("ascii") for chunk in chunks(lines)
+    ]
+
+    async def forward_output():
+        for payload in payloads:
+            stream = asyncio.StreamReader(limit=2**20)
+            stream.feed_data(payload)
+            stream.feed_eof()
+            await orchestrator.forward_output(stream, ctx)
+            drain()
+
+    def forward_frames(compact: bool):
+        channel = OutputChannel("polar", compact)
+        frames = [b"".join(channel.encode(m) for m in chunk) for chunk in chunks(messages)]
+
+        async def run():
+            for data in frames:
+                stream = asyncio.StreamReader(limit=2**24)
+                stream.feed_data(data)
+                stream.feed_eof()
+                await orchestrator.forward_frames(stream, ctx)
+                drain()
+
+        return run
+
+    try:
+        return [
+            await measure_async(
+                f"forward[{FORWARD_CONNECTIONS} clients]",
+                forward_all,
+                len(lines),
+                repeats,
+            ),
+            await measure_async(
+                f"forward_output[{FORWARD_CONNECTIONS} clients]",
+                forward_output,
+                len(lines),
+                repeats,
+            ),
+            await measure_async(
+                f"forward_frames[{FORWARD_CONNECTIONS} clients]",
+                forward_frames(False),
+                len(messages),
+                repeats,
+            ),
+            await measure_async(
+                f"forward_frames[compact, {FORWARD_CONNECTIONS} clients]",
+                forward_frames(True),
+                len(messages),
+                repeats,
+            ),
+        ]
+    finally:
+        # Without their summaries of superseded updates, those are expected here
+        with contextlib.redirect_stdout(io.StringIO()):
+            for conn in connections:
+                await ctx.on_disconnect(conn)
+
+
+def collector_messages(frames: List[bytes]) -> List[Outgoing]:
+    """
+    What the Polar collector sends while streaming: previews (as dicts, for the compact
+    encoding) and logs.
+    """
+    decimator = polar_iface.PreviewDecimator(
+        {
+            PMDMeasurmentTypes.ECG: ECG_SAMPLE_RATE,
+            PMDMeasurmentTypes.ACC: ACC_SAMPLE_RATE,
+        },
+        polar_iface.DEFAULT_PREVIEW_RATE,
+    )
+    messages = []
+    for message in stamped_samples(frames):
+        decimator.add(message.sample)
+        messages.extend(polar_iface.preview_messages("", decimator.flush()))
+        messages.append(
+            Outgoing(
+                "log",
+                json.dumps(
+                    {"component": "polar", "data": {"log": "[+] Connected!", "device": ""}}
+                ),
+            )
+        )
+    return messages
+
+
+def run_benchmarks(frames: List[bytes], compressed: List[bytes], repeats: int):
+    samples = frame_samples(frames)
+    results = [measure("parse_pmd_frame", parse_pmd_frame, frames, repeats, samples)]
+    if compressed:
+        results.append(
+            measure(
+                "parse_pmd_frame[compressed]",
+                parse_pmd_frame,
+                compressed,
+                repeats,
+                frame_samples(compressed),
+            )
+        )
+
+    ecg = [data[10:] for data in frames if data[0] == PMDMeasurmentTypes.ECG]
+    acc = [data[10:] for data in frames if data[0] == PMDMeasurmentTypes.ACC]
+    if ecg:
+        results.append(
+            measure("parse_pmd_ecg", parse_pmd_ecg, ecg, repeats, sum(len(d) // 3 for d in ecg))
+        )
+    if acc:
+        results.append(
+            measure("parse_pmd_acc", parse_pmd_acc, acc, repeats, sum(len(d) // 6 for d in acc))
+        )
+
+    stamped = stamped_samples(frames)
+    stamped_count = sum(len(message.sample.content) for message in stamped)
+    results.append(
+        measure("sample_writer_fmt", sample_writer_fmt, stamped, repeats, stamped_count)
+    )
+    results.append(
+        measure(
+            "sample_writer_columns",
+            sample_writer_columns,
+            stamped,
+            repeats,
+            stamped_count,
+        )
+    )
+
+    results += asyncio.run(forwarding_benchmarks(collector_messages(frames), repeats))
+    return results
+
+
+def compare(
+    results: List[BenchResult], baseline: Mapping[str, Any], tolerance: float
+) -> List[str]:
+    problems = []
+    for result in results:
+        if result.realtime_x is not None and result.realtime_x < 1:
+            problems.append(f"{result.name} can't keep up with one strap")
+        if result.name not in baseline:
+            continue
+        previous = baseline[result.name]["us_per_call"]
+        if result.us_per_call > previous * (1 + tolerance):
+            problems.append(
+                f"{result.name} regressed: {previous:.2f} -> {result.us_per_call:.2f} us"
+            )
+    return problems
+
+
+def print_results(results: List[BenchResult], baseline: Mapping[str, Any]):
+    print(
+        f"{'benchmark':32} {'calls':>6} {'us/call':>10} {'calls/s':>11} "
+        f"{'peak B/call':>12} {'allocs/call':>12} {'realtime':>9} {'vs base':>8}"
+    )
+    for result in results:
+        realtime = "" if result.realtime_x is None else f"{result.realtime_x:.0f}x"
+        change = ""
+        if result.name in baseline:
+            previous = baseline[result.name]["us_per_call"]
+            change = f"{(result.us_per_call / previous - 1) * 100:+.0f}%"
+        print(
+            f"{result.name:32} {result.calls:>6} {result.us_per_call:>10.2f} "
+            f"{result.calls_per_s:>11.0f} {result.peak_bytes_per_call:>12.0f} "
+            f"{result.allocs_per_call:>12.1f} {realtime:>9} {change:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--journal", default=None, help="Benchmark on recorded frames")
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--save", default=None, help="Store the results as a baseline")
+    args = parser.parse_args()
+
+    if args.journal:
+        frames = recorded_frames(args.journal, args.frames)
+        compressed = []
+    else:
+        frames = synthetic_frames(args.frames, compressed=False)
+        compressed = synthetic_frames(args.frames, compressed=True)
+    if not frames:
+        sys.exit("No frames to benchmark")
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)["results"]
+
+    results = run_benchmarks(frames, compressed, args.repeats)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as fd:
+            json.dump(
+                {
+                    "created": datetime.datetime.now(tz=pytz.utc).isoformat(),
+                    "corpus": args.journal or "synthetic",
+                    "results": {result.name: result.as_dict() for result in results},
+                },
+                fd,
+                indent=2,
+            )
+
+    if problems := compare(results, baseline, args.tolerance):
+        for problem in problems:
+            print(f"[!] {problem}", file=sys.stderr)
+        sys.exit(1)
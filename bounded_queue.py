@@ -0,0 +1,93 @@
+# A size-limited asyncio queue with an explicit overload policy and drop accounting,
+# shared by the collectors for their sample and print queues.
+
+import asyncio
+from typing import Any, Mapping
+
+# Wait for room, the producer slows down but nothing is lost. Only for producers that can
+# wait, offer() refuses it.
+POLICY_BLOCK = "block"
+# Throw away the oldest entry to make room, for previews and status messages
+POLICY_DROP_OLDEST = "drop_oldest"
+# Refuse the new entry, what is queued already stays in order
+POLICY_DROP_NEWEST = "drop_newest"
+
+QUEUE_POLICIES = [POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_NEWEST]
+# What can happen to an offered item that doesn't fit
+DROP_POLICIES = [POLICY_DROP_NEWEST, POLICY_DROP_OLDEST]
+
+
+class BoundedQueue:
+    def __init__(self, maxsize: int, policy: str = POLICY_BLOCK):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}")
+
+        self._queue = asyncio.Queue(maxsize)
+        self._policy = policy
+        self._dropped = 0
+        self._high_water = 0
+
+    async def put(self, item: Any):
+        if self._policy != POLICY_BLOCK:
+            self.offer(item)
+        else:
+            await self.put_waiting(item)
+
+    async def put_waiting(self, item: Any):
+        """
+        Waits for room whatever the policy, for a producer that can slow down.
+        """
+        await self._queue.put(item)
+        self._high_water = max(self._high_water, self._queue.qsize())
+
+    def offer(self, item: Any) -> bool:
+        """
+        Never waits, for producers that can't. A full queue drops by the policy.
+        """
+        if self._policy == POLICY_BLOCK:
+            raise ValueError("A blocking queue can't drop, put() into it instead")
+        if self._queue.full():
+            if self._policy != POLICY_DROP_OLDEST:
+                self._dropped += 1
+                return False
+            self._queue.get_nowait()
+            self._queue.task_done()
+            self._dropped += 1
+        self._queue.put_nowait(item)
+        self._high_water = max(self._high_water, self._queue.qsize())
+        return True
+
+    def dropped(self) -> int:
+        return self._dropped
+
+    async def get(self) -> Any:
+        return await self._queue.get()
+
+    def get_nowait(self) -> Any:
+        return self._queue.get_nowait()
+
+    def empty(self) -> bool:
+        return self._queue.empty()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def task_done(self):
+        self._queue.task_done()
+
+    async def join(self):
+        await self._queue.join()
+
+    def stats(self) -> Mapping[str, Any]:
+        """
+        Returns the queue counters. The high-water mark restarts from the current size.
+        """
+        stats = {
+            "size": self._queue.qsize(),
+            "maxsize": self._queue.maxsize,
+            "policy": self._policy,
+            "dropped": self._dropped,
+            "high_water": self._high_water,
+        }
+        self._high_water = self._queue.qsize()
+        return stats
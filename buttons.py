@@ -8,8 +8,16 @@ import asyncio
 import json
 import argparse
 import signal
-import sys
 import pytz
+from threaded_writer import ThreadedWriter
+from bounded_queue import BoundedQueue, POLICY_BLOCK, POLICY_DROP_OLDEST
+from collector_ipc import (
+    HEARTBEAT_INTERVAL,
+    OutputChannel,
+    Outgoing,
+    heartbeat_message,
+    MAX_BATCH as MAX_PRINT_BATCH,
+)
 
 
 class LEDState(IntEnum):
@@ -20,15 +28,25 @@ class LEDState(IntEnum):
     LOOP = 2
 
 
+DEFAULT_PRINT_QUEUE_SIZE = 256
+DEFAULT_PRESS_QUEUE_SIZE = 256
+
+
 class ButtonContext:
     _shutdown_event = asyncio.Event()
-    _print_queue = asyncio.Queue()
-
-    _button_press_queue = asyncio.Queue()
 
-    def __init__(self, project, loop):
+    def __init__(
+        self,
+        project,
+        loop,
+        print_queue_size: int = DEFAULT_PRINT_QUEUE_SIZE,
+        press_queue_size: int = DEFAULT_PRESS_QUEUE_SIZE,
+    ):
         self._project = project
         self._loop = loop
+        # Status messages may be dropped under load, button presses never are
+        self._print_queue = BoundedQueue(print_queue_size, POLICY_DROP_OLDEST)
+        self._button_press_queue = BoundedQueue(press_queue_size, POLICY_BLOCK)
 
     def get_loop(self):
         return self._loop
@@ -38,17 +56,21 @@ class ButtonContext:
 
     async def submit_print(self, msg: str):
         await self._print_queue.put(
-            json.dumps({"component": "buttons", "data": {"log": msg}})
+            Outgoing("log", json.dumps({"component": "buttons", "data": {"log": msg}}))
         )
 
-    async def submit_print_preformatted(self, msg: str):
-        await self._print_queue.put(msg)
+    async def submit_print_preformatted(self, msg: str, channel: str):
+        await self._print_queue.put(Outgoing(channel, msg))
 
-    async def wait_for_print(self) -> str:
-        return await self._print_queue.get()
+    async def wait_for_prints(self, max_count: int) -> List[Outgoing]:
+        messages = [await self._print_queue.get()]
+        while len(messages) < max_count and not self._print_queue.empty():
+            messages.append(self._print_queue.get_nowait())
+        return messages
 
-    def print_done(self):
-        self._print_queue.task_done()
+    def print_done(self, count: int = 1):
+        for _ in range(count):
+            self._print_queue.task_done()
 
     async def submit_button_press(self, button: "ButtonDescription"):
         await self._button_press_queue.put(button)
@@ -59,6 +81,19 @@ class ButtonContext:
     def button_press_done(self):
         self._button_press_queue.task_done()
 
+    def heartbeat_status(self) -> dict:
+        # Unlike queue_stats this resets nothing, heartbeats come every second
+        return {
+            "presses_pending": self._button_press_queue.qsize(),
+            "prints_dropped": self._print_queue.dropped(),
+        }
+
+    def queue_stats(self) -> dict:
+        return {
+            "print": self._print_queue.stats(),
+            "presses": self._button_press_queue.stats(),
+        }
+
     async def wait_for_shutdown(self):
         await self._shutdown_event.wait()
 
@@ -132,29 +167,59 @@ def get_button(pin: int) -> Optional[ButtonDescription]:
     return btn[0] if btn else None
 
 
-async def print_handler(ctx: ButtonContext):
+async def print_handler(ctx: ButtonContext, channel: OutputChannel):
     while True:
-        if msg := await ctx.wait_for_print():
-            sys.stdout.write(f"{msg}\n")
-            sys.stdout.flush()
-        ctx.print_done()
+        messages = await ctx.wait_for_prints(MAX_PRINT_BATCH)
+        await channel.write(messages)
+        ctx.print_done(len(messages))
+
+
+async def heartbeat_handler(ctx: ButtonContext):
+    while True:
+        heartbeat = heartbeat_message("buttons", ctx.heartbeat_status())
+        await ctx.submit_print_preformatted(heartbeat.message, heartbeat.channel)
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def write_entry(fd, entry: str):
+    """
+    Runs on the writer thread. Every press is flushed right away so it survives a crash.
+    """
+    fd.write(entry)
+    fd.flush()
 
 
 async def write_handler(ctx: ButtonContext):
-    with open(f"{ctx.get_project()}buttons.csv", "w") as fd:
+    writer = ThreadedWriter("buttons-writer")
+    fd = writer.register(open(f"{ctx.get_project()}buttons.csv", "w"))
+    try:
         while True:
             if button := await ctx.wait_for_button_press():
                 await ctx.submit_print_preformatted(
                     json.dumps(
                         {"component": "buttons", "data": {"button": button.slug}}
-                    )
+                    ),
+                    "press",
                 )
                 button_entry = (
                     f"{datetime.datetime.now(tz=pytz.utc).isoformat()},{button.slug}\n"
                 )
-                fd.write(button_entry)
-                fd.flush()
+                writer.submit(write_entry, fd, button_entry)
+                await ctx.submit_print_preformatted(
+                    json.dumps(
+                        {
+                            "component": "buttons",
+                            "data": {
+                                "write_stats": writer.pop_stats(),
+                                "queue_stats": ctx.queue_stats(),
+                            },
+                        }
+                    ),
+                    "stats",
+                )
             ctx.button_press_done()
+    finally:
+        writer.close()
 
 
 def handle_button_press(ctx: ButtonContext, channel):
@@ -208,12 +273,15 @@ def setup(ctx):
     GPIO.setup(GPIO_LED_1, GPIO.OUT)
 
 
-async def main(project):
-    ctx = ButtonContext(project, asyncio.get_event_loop())
+async def main(project, print_queue_size=DEFAULT_PRINT_QUEUE_SIZE):
+    ctx = ButtonContext(project, asyncio.get_event_loop(), print_queue_size)
     ctx.get_loop().add_signal_handler(signal.SIGINT, ctx.shutdown)
     ctx.get_loop().add_signal_handler(signal.SIGTERM, ctx.shutdown)
-    print_task = asyncio.create_task(print_handler(ctx))
+    channel = OutputChannel("buttons")
+    await channel.open()
+    print_task = asyncio.create_task(print_handler(ctx, channel))
     write_task = asyncio.create_task(write_handler(ctx))
+    heartbeat_task = asyncio.create_task(heartbeat_handler(ctx))
 
     try:
         setup(ctx)
@@ -222,6 +290,8 @@ async def main(project):
     finally:
         print_task.cancel()
         write_task.cancel()
+        heartbeat_task.cancel()
+        channel.close()
         GPIO.cleanup()
 
 
@@ -229,5 +299,6 @@ async def main(project):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--project", required=True)
+    parser.add_argument("--print_queue_size", type=int, default=DEFAULT_PRINT_QUEUE_SIZE)
     args, _ = parser.parse_known_args()
-    asyncio.run(main(args.project))
+    asyncio.run(main(args.project, args.print_queue_size))
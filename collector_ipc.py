@@ -0,0 +1,283 @@
+# Framed message channel from a collector to the orchestrator, instead of JSON lines on stdout.
+# The orchestrator opens a pipe per collector and passes the write end's fd in BIKE_IPC_FD,
+# stdout is left for plain logs. A collector started by hand has no pipe and prints JSON lines.
+# Frame: uint32 length of the rest, uint8 encoding, uint8 topic length, uint8 key length,
+# topic, key (both ascii), payload (all little-endian). The topic ("polar.ecg.preview",
+# "buttons.log", ...) routes a message without parsing the payload, the key (e.g. the device)
+# tells apart live updates of the same topic that must not replace each other.
+# Every HEARTBEAT_INTERVAL a collector sends a message on the heartbeat channel, proof for
+# the orchestrator's supervisor that it is still working, with whatever status it has.
+# Encodings:
+#   json:    the complete {"component": ..., "data": ...} message as sent to the interface
+#   compact: uint32 JSON length, the message as JSON with every list of ints replaced by
+#            {"$a": index}, then the lists as numpy arrays, each uint8 dtype code, uint32 count
+#            and the values. Previews come out about a quarter smaller than their JSON, but
+#            the orchestrator has to turn them back into JSON for the interface. Opt-in.
+#   binary:  waveform blocks, passed on to subscribed clients as binary WebSocket frames
+# Waveform block: uint32 length of the rest, uint8 dtype code (as in compact), uint8 number
+# of arrays, uint8 device length, uint8 name length, int64 sensor time of the first sample
+# in ns, float32 sample rate, uint32 samples per array, device, name ("ecg", "acc"), then
+# the arrays one after the other (ecg: mv, acc: x, y, z).
+
+import asyncio
+import json
+import os
+import struct
+import sys
+from typing import Any, AsyncIterator, List, Mapping, NamedTuple, Tuple
+
+import numpy as np
+
+IPC_FD_ENV = "BIKE_IPC_FD"
+
+ENCODING_JSON = 0
+ENCODING_COMPACT = 1
+ENCODING_BINARY = 2
+
+FRAME_HEADER = struct.Struct("<IBBB")
+COMPACT_HEADER = struct.Struct("<I")
+ARRAY_HEADER = struct.Struct("<BI")
+WAVEFORM_HEADER = struct.Struct("<IBBBBqfI")
+# Smallest first, the first that holds every value is used
+ARRAY_DTYPES = [np.dtype("<i1"), np.dtype("<i2"), np.dtype("<i4"), np.dtype("<i8")]
+
+# Largest frame a reader accepts, anything bigger means the stream is out of step
+MAX_FRAME = 2**24
+# Messages gathered into one write
+MAX_BATCH = 64
+
+HEARTBEAT_CHANNEL = "heartbeat"
+HEARTBEAT_INTERVAL = 1.0
+
+
+class Outgoing(NamedTuple):
+    """
+    One interface message on its way out of a collector.
+    """
+
+    # Last part of the topic, the component is the channel's
+    channel: str
+    # JSON text, a dict the compact encoding can be used for, or a binary block
+    message: str | Mapping[str, Any] | bytes
+    key: str = ""
+
+
+def heartbeat_message(component: str, status: Mapping[str, Any]) -> Outgoing:
+    return Outgoing(
+        HEARTBEAT_CHANNEL,
+        json.dumps({"component": component, "data": {"heartbeat": status}}),
+    )
+
+
+def encode_frame(topic: str, key: str, encoding: int, payload: bytes) -> bytes:
+    topic_bytes = topic.encode("ascii")
+    key_bytes = key.encode("ascii")
+    return (
+        FRAME_HEADER.pack(
+            3 + len(topic_bytes) + len(key_bytes) + len(payload),
+            encoding,
+            len(topic_bytes),
+            len(key_bytes),
+        )
+        + topic_bytes
+        + key_bytes
+        + payload
+    )
+
+
+def is_int_list(value: Any) -> bool:
+    return (
+        isinstance(value, list)
+        and bool(value)
+        and all(isinstance(v, int) and not isinstance(v, bool) for v in value)
+    )
+
+
+def pack_compact(message: Mapping[str, Any]) -> bytes:
+    arrays: List[np.ndarray] = []
+
+    def extract(value: Any) -> Any:
+        if isinstance(value, dict):
+            return {key: extract(v) for key, v in value.items()}
+        if is_int_list(value):
+            values = np.asarray(value)
+            low, high = values.min(), values.max()
+            for dtype in ARRAY_DTYPES:
+                info = np.iinfo(dtype)
+                if info.min <= low and high <= info.max:
+                    arrays.append(values.astype(dtype))
+                    break
+            return {"$a": len(arrays) - 1}
+        if isinstance(value, list):
+            return [extract(v) for v in value]
+        return value
+
+    header = json.dumps(extract(message), separators=(",", ":")).encode("utf-8")
+    parts = [COMPACT_HEADER.pack(len(header)), header]
+    for values in arrays:
+        parts.append(ARRAY_HEADER.pack(ARRAY_DTYPES.index(values.dtype), len(values)))
+        parts.append(values.tobytes())
+    return b"".join(parts)
+
+
+def unpack_compact(payload: bytes) -> Mapping[str, Any]:
+    if len(payload) < COMPACT_HEADER.size:
+        raise ValueError("Truncated compact message")
+    (header_len,) = COMPACT_HEADER.unpack_from(payload)
+    offset = COMPACT_HEADER.size
+    message = json.loads(payload[offset : offset + header_len])
+    offset += header_len
+
+    arrays = []
+    while offset < len(payload):
+        if offset + ARRAY_HEADER.size > len(payload):
+            raise ValueError("Truncated compact message")
+        code, count = ARRAY_HEADER.unpack_from(payload, offset)
+        offset += ARRAY_HEADER.size
+        if code >= len(ARRAY_DTYPES):
+            raise ValueError(f"Unknown compact array type {code}")
+        dtype = ARRAY_DTYPES[code]
+        arrays.append(np.frombuffer(payload, dtype, count, offset).tolist())
+        offset += count * dtype.itemsize
+
+    def restore(value: Any) -> Any:
+        if isinstance(value, dict):
+            if value.keys() == {"$a"}:
+                return arrays[value["$a"]]
+            return {key: restore(v) for key, v in value.items()}
+        if isinstance(value, list):
+            return [restore(v) for v in value]
+        return value
+
+    return restore(message)
+
+
+def pack_waveform(
+    device: str, name: str, first_timestamp: int, rate: float, arrays: List[np.ndarray]
+) -> bytes:
+    device_bytes = device.encode("ascii")
+    name_bytes = name.encode("ascii")
+    dtype = arrays[0].dtype.newbyteorder("<")
+    data = b"".join(values.astype(dtype, copy=False).tobytes() for values in arrays)
+    return (
+        WAVEFORM_HEADER.pack(
+            WAVEFORM_HEADER.size - 4 + len(device_bytes) + len(name_bytes) + len(data),
+            ARRAY_DTYPES.index(dtype),
+            len(arrays),
+            len(device_bytes),
+            len(name_bytes),
+            first_timestamp,
+            rate,
+            len(arrays[0]),
+        )
+        + device_bytes
+        + name_bytes
+        + data
+    )
+
+
+def frame_to_json(encoding: int, payload: bytes) -> str:
+    """
+    The interface message of a frame, as JSON text.
+    """
+    if encoding == ENCODING_JSON:
+        return payload.decode("utf-8")
+    if encoding == ENCODING_COMPACT:
+        return json.dumps(unpack_compact(payload), separators=(",", ":"))
+    raise ValueError(f"Unknown IPC encoding {encoding}")
+
+
+async def read_frames(
+    stream: asyncio.StreamReader,
+) -> AsyncIterator[Tuple[str, str, int, bytes]]:
+    """
+    Yields (topic, key, encoding, payload) until the collector closes its end.
+    """
+    while True:
+        try:
+            header = await stream.readexactly(FRAME_HEADER.size)
+        except asyncio.IncompleteReadError:
+            return
+        length, encoding, topic_len, key_len = FRAME_HEADER.unpack(header)
+        if length > MAX_FRAME or topic_len + key_len + 3 > length:
+            raise ValueError(f"Corrupted IPC frame of {length} bytes")
+        try:
+            rest = await stream.readexactly(length - 3)
+        except asyncio.IncompleteReadError:
+            return
+        key_end = topic_len + key_len
+        yield (
+            rest[:topic_len].decode("ascii"),
+            rest[topic_len:key_end].decode("ascii"),
+            encoding,
+            rest[key_end:],
+        )
+
+
+async def open_reader(fd: int) -> asyncio.StreamReader:
+    loop = asyncio.get_running_loop()
+    stream = asyncio.StreamReader(limit=MAX_FRAME)
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(stream), os.fdopen(fd, "rb", buffering=0)
+    )
+    return stream
+
+
+class OutputChannel:
+    """
+    Where a collector's interface messages go: the orchestrator's pipe if it passed one,
+    stdout lines otherwise. Dict messages are sent in the compact encoding if enabled.
+    """
+
+    def __init__(self, component: str, compact: bool = False):
+        self.component = component
+        self._compact = compact
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def open(self):
+        fd = os.getenv(IPC_FD_ENV)
+        if fd is None:
+            return
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, os.fdopen(int(fd), "wb", buffering=0)
+        )
+        self._writer = asyncio.StreamWriter(transport, protocol, None, loop)
+
+    async def write(self, messages: List[Outgoing]):
+        """
+        Sends a batch in one write, waits while the orchestrator falls behind.
+        """
+        if self._writer is None:
+            # Binary blocks can't be printed, heartbeats only matter to the orchestrator
+            lines = [
+                m.message
+                if isinstance(m.message, str)
+                else json.dumps(m.message, separators=(",", ":"))
+                for m in messages
+                if not isinstance(m.message, bytes) and m.channel != HEARTBEAT_CHANNEL
+            ]
+            sys.stdout.write("".join(f"{line}\n" for line in lines))
+            sys.stdout.flush()
+            return
+
+        self._writer.write(b"".join(self.encode(m) for m in messages))
+        await self._writer.drain()
+
+    def encode(self, outgoing: Outgoing) -> bytes:
+        topic = f"{self.component}.{outgoing.channel}"
+        message = outgoing.message
+        if isinstance(message, bytes):
+            payload, encoding = message, ENCODING_BINARY
+        elif isinstance(message, str):
+            payload, encoding = message.encode("utf-8"), ENCODING_JSON
+        elif self._compact:
+            payload, encoding = pack_compact(message), ENCODING_COMPACT
+        else:
+            text = json.dumps(message, separators=(",", ":"))
+            payload, encoding = text.encode("utf-8"), ENCODING_JSON
+        return encode_frame(topic, outgoing.key, encoding, payload)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
@@ -0,0 +1,231 @@
+# Streaming R-peak detection and rolling heart rate variability for the ECG stream.
+# The detector follows Pan-Tompkins: band-pass, derivative, squaring and moving-window
+# integration, run as FIR filters over each frame block plus a short carried-over history,
+# followed by adaptive signal/noise thresholds. Memory use is constant.
+# The derivative peaks on the QRS slope, so every beat is then placed on the R apex, the
+# largest excursion of the band-passed signal nearby.
+
+from collections import deque
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+# Pan-Tompkins pass band for QRS energy
+BAND_LOW_HZ = 5.0
+BAND_HIGH_HZ = 15.0
+BAND_TAPS_SECONDS = 0.25
+# Moving-window integration, roughly the width of a QRS complex
+INTEGRATION_SECONDS = 0.15
+# No two beats closer together than this
+REFRACTORY_SECONDS = 0.2
+# A candidate this soon after a beat whose slope is under half the beat's is its T wave
+T_WAVE_SECONDS = 0.36
+# How far the R apex is looked for around the steepest slope
+APEX_SEARCH_SECONDS = 0.05
+# Thresholds are initialised from this much signal before detection starts
+LEARNING_SECONDS = 2.0
+
+# Physiologically plausible RR range, anything else is treated as an artefact
+MIN_RR_MS = 300
+MAX_RR_MS = 2000
+
+DEFAULT_HRV_WINDOW = 30
+
+
+@dataclass(frozen=True)
+class RPeak:
+    timestamp: int  # Sensor time in ns
+    amplitude: int  # ECG value at the peak
+
+
+def design_bandpass(sample_rate: float) -> np.ndarray:
+    # Windowed-sinc band-pass, difference of two low-pass filters
+    taps = int(BAND_TAPS_SECONDS * sample_rate) | 1
+    n = np.arange(taps) - (taps - 1) / 2
+    high = 2 * BAND_HIGH_HZ / sample_rate * np.sinc(2 * BAND_HIGH_HZ / sample_rate * n)
+    low = 2 * BAND_LOW_HZ / sample_rate * np.sinc(2 * BAND_LOW_HZ / sample_rate * n)
+    return (high - low) * np.hamming(taps)
+
+
+class RPeakDetector:
+    """
+    Feeds on ECG blocks as they arrive and returns the R peaks found in each one.
+    """
+
+    def __init__(self, sample_rate: float):
+        self._sample_rate = sample_rate
+        # Band-pass and the five point derivative folded into one kernel
+        derivative = np.array([1, 2, 0, -2, -1]) * sample_rate / 8
+        self._bandpass = design_bandpass(sample_rate)
+        self._kernel = np.convolve(self._bandpass, derivative)
+        self._integration = np.ones(max(1, round(INTEGRATION_SECONDS * sample_rate)))
+        self._integration /= len(self._integration)
+
+        # Output k of the integrator ends at input k + offset
+        self._offset = len(self._kernel) + len(self._integration) - 2
+        self._history_len = self._offset + 2
+        self._refractory = round(REFRACTORY_SECONDS * sample_rate)
+        self._t_wave = round(T_WAVE_SECONDS * sample_rate)
+        self._apex_search = max(1, round(APEX_SEARCH_SECONDS * sample_rate))
+        self._learning = round(LEARNING_SECONDS * sample_rate)
+
+        self._mv = np.zeros(0, dtype=np.float64)
+        self._timestamps = np.zeros(0, dtype=np.int64)
+        # Absolute sample index of the first sample in the history
+        self._base = 0
+        # First absolute integrator index not examined yet
+        self._next = 0
+        self._last_peak = -self._refractory
+        # Steepest slope of the last beat, for telling T waves apart
+        self._last_slope = 0.0
+
+        self._signal_level = 0.0
+        self._noise_level = 0.0
+        self._learned = False
+
+    def _threshold(self) -> float:
+        return self._noise_level + 0.25 * (self._signal_level - self._noise_level)
+
+    def process(self, mv: np.ndarray, timestamps: np.ndarray) -> List[RPeak]:
+        x = np.concatenate((self._mv, mv.astype(np.float64)))
+        t = np.concatenate((self._timestamps, timestamps))
+        base = self._base
+
+        peaks = []
+        if len(x) >= self._history_len:
+            filtered = np.convolve(x, self._kernel, "valid")
+            integrated = np.convolve(filtered**2, self._integration, "valid")
+            # filtered[k] is centred on input k + kernel_delay, magnitude[j] on j + bandpass_delay
+            kernel_delay = (len(self._kernel) - 1) // 2
+            bandpass_delay = (len(self._bandpass) - 1) // 2
+            magnitude = np.abs(np.convolve(x, self._bandpass, "valid"))
+            offset = self._offset
+
+            if not self._learned and base + len(x) >= self._learning:
+                self._signal_level = 0.25 * integrated.max()
+                self._noise_level = 0.5 * integrated.mean()
+                self._learned = True
+                self._next = base + len(integrated) - 1 + offset
+
+            if self._learned:
+                # Local maxima of the integrated signal, excluding the edges
+                inner = integrated[1:-1]
+                candidates = (
+                    np.flatnonzero(
+                        (inner > integrated[:-2]) & (inner >= integrated[2:])
+                    )
+                    + 1
+                )
+                for k in candidates[candidates + base + offset >= self._next].tolist():
+                    level = integrated[k]
+                    if level > self._threshold():
+                        # Steepest slope of the QRS in the window that fed this output
+                        window = np.abs(filtered[k : k + len(self._integration)])
+                        slope = float(window.max())
+                        # As an index into magnitude
+                        steepest = k + int(window.argmax())
+                        steepest += kernel_delay - bandpass_delay
+                        # The R apex is the largest excursion of the band-passed signal
+                        # around it, before differentiation moved it onto the slope
+                        start = max(steepest - self._apex_search, 0)
+                        apex = start + int(
+                            magnitude[start : steepest + self._apex_search + 1].argmax()
+                        )
+                        # The window can end on the rise when the QRS only began in it
+                        last = len(magnitude) - 1
+                        while apex < last and magnitude[apex + 1] > magnitude[apex]:
+                            apex += 1
+                        while apex > 0 and magnitude[apex - 1] > magnitude[apex]:
+                            apex -= 1
+                        position = apex + bandpass_delay
+                        since = base + position - self._last_peak
+                        if since < self._refractory:
+                            continue
+                        if since < self._t_wave and slope < 0.5 * self._last_slope:
+                            self._noise_level = 0.125 * level + 0.875 * self._noise_level
+                            continue
+                        self._signal_level = 0.125 * level + 0.875 * self._signal_level
+                        self._last_peak = base + position
+                        self._last_slope = slope
+                        peaks.append(
+                            RPeak(timestamp=int(t[position]), amplitude=int(x[position]))
+                        )
+                    else:
+                        self._noise_level = 0.125 * level + 0.875 * self._noise_level
+
+                self._next = base + len(integrated) - 1 + offset
+
+        # Keep only as much history as the filters need to pick up where this block ended
+        keep = min(self._history_len, len(x))
+        self._mv = x[-keep:]
+        self._timestamps = t[-keep:]
+        self._base = base + len(x) - keep
+        return peaks
+
+
+class RollingHRV:
+    """
+    Heart rate, RMSSD and SDNN over the last window of RR intervals, updated in O(1) per beat.
+    """
+
+    def __init__(self, window: int = DEFAULT_HRV_WINDOW):
+        self._window = window
+        self._rr = deque()
+        self._diffs = deque()
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._diff_sum_sq = 0.0
+        self._last_peak = None
+
+    def add_peak(self, timestamp: int) -> float | None:
+        """
+        Registers a beat, returns the RR interval in ms if it was a plausible one.
+        """
+        last, self._last_peak = self._last_peak, timestamp
+        if last is None:
+            return None
+        return self.add_rr((timestamp - last) / 1e6)
+
+    def add_rr(self, rr: float) -> float | None:
+        """
+        Registers an RR interval in ms measured elsewhere, returns it if it was a plausible one.
+        """
+        if not MIN_RR_MS <= rr <= MAX_RR_MS:
+            return None
+
+        if self._rr:
+            diff = rr - self._rr[-1]
+            self._diffs.append(diff)
+            self._diff_sum_sq += diff * diff
+        self._rr.append(rr)
+        self._sum += rr
+        self._sum_sq += rr * rr
+
+        if len(self._rr) > self._window:
+            old = self._rr.popleft()
+            self._sum -= old
+            self._sum_sq -= old * old
+        if len(self._diffs) > self._window - 1:
+            old = self._diffs.popleft()
+            self._diff_sum_sq -= old * old
+
+        return rr
+
+    def hr(self) -> float | None:
+        if not self._rr:
+            return None
+        return 60000 / (self._sum / len(self._rr))
+
+    def rmssd(self) -> float | None:
+        if not self._diffs:
+            return None
+        return float(np.sqrt(max(0.0, self._diff_sum_sq / len(self._diffs))))
+
+    def sdnn(self) -> float | None:
+        count = len(self._rr)
+        if count < 2:
+            return None
+        mean = self._sum / count
+        variance = (self._sum_sq - count * mean * mean) / (count - 1)
+        return float(np.sqrt(max(0.0, variance)))
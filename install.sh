@@ -3,7 +3,7 @@ set -e
 
 # Install Deps
 apt update
-apt install -y nginx python3-websockets python3-bleak
+apt install -y nginx python3-websockets python3-bleak python3-numpy
 
 # https://learn.adafruit.com/adding-a-real-time-clock-to-raspberry-pi/set-rtc-time
 # HW RTC Clock Setup
@@ -23,6 +23,15 @@ mkdir -p /opt/collected_data/
 
 cp buttons.py /opt/bike_data_collection/
 cp polar_iface.py /opt/bike_data_collection/
+cp session_store.py /opt/bike_data_collection/
+cp pmd_journal.py /opt/bike_data_collection/
+cp threaded_writer.py /opt/bike_data_collection/
+cp bounded_queue.py /opt/bike_data_collection/
+cp collector_ipc.py /opt/bike_data_collection/
+cp hrv.py /opt/bike_data_collection/
+cp polar_offline.py /opt/bike_data_collection/
+cp polar_sim.py /opt/bike_data_collection/
+cp bench_polar.py /opt/bike_data_collection/
 cp orchestrator.py /opt/bike_data_collection/
 cp wifi_start.py /opt/bike_data_collection/
 
@@ -1,4 +1,4 @@
-import { Button, Stack, TextField } from '@mui/material';
+import { Button, MenuItem, Stack, TextField } from '@mui/material';
 import React from 'react'
 import { WebSocketConnectionContext, WebSocketConnectionState } from '../utils/WebSocketConnection';
 import { ReadyState } from 'react-use-websocket';
@@ -6,6 +6,8 @@ import { ReadyState } from 'react-use-websocket';
 export default function PolarConfig(props: any) {
     const {sendMessage, lastMessage, readyState} = React.useContext<WebSocketConnectionState>(WebSocketConnectionContext);
     const [address, setAddress] = React.useState("DF:EF:DB:F6:20:16");
+    // raw: ECG + ACC streams, hr: heart rate and RR intervals only, for long rides
+    const [mode, setMode] = React.useState("raw");
     const [needsApply, setNeedsApply] = React.useState(false);
 
     React.useEffect(() => {
@@ -19,12 +21,17 @@ export default function PolarConfig(props: any) {
     }, [lastMessage]);
 
     const handleApply = () => {
-        sendMessage(JSON.stringify({"command": "set_settings", "config": {"mac": address}}))
+        sendMessage(JSON.stringify({"command": "set_settings", "config": {"mac": address, "mode": mode}}))
     }
 
     return (
         <Stack>
             <TextField disabled={props.started} id="polar-h10-address" label="Device MAC" variant="outlined" value={address} onChange={(event) => {setNeedsApply(true);setAddress(event.target.value)}}/>
+            <TextField select disabled={props.started} id="polar-h10-mode" label="Recording" value={mode} onChange={(event) => {setNeedsApply(true);setMode(event.target.value)}}>
+                <MenuItem value="raw">ECG + ACC</MenuItem>
+                <MenuItem value="hr">Heart rate + RR only</MenuItem>
+                <MenuItem value="raw+hr">Both</MenuItem>
+            </TextField>
             <Button onClick={handleApply} disabled={!needsApply || props.started} variant="contained">Apply</Button>
         </Stack>
     );
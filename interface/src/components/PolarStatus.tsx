@@ -5,6 +5,8 @@ import { Chip, Stack, Typography } from '@mui/material';
 export default function PolarStatus() {
     const [accelStatus, setAccelStatus] = React.useState("--");
     const [hrStatus, setHrStatus] = React.useState("--");
+    const [bpmStatus, setBpmStatus] = React.useState("--");
+    const [downloadStatus, setDownloadStatus] = React.useState("--");
     const {lastMessage} = React.useContext(WebSocketConnectionContext);
 
     React.useEffect(() => {
@@ -17,12 +19,31 @@ export default function PolarStatus() {
             return;
         }
 
-        if (msg["data"]["acc"] != null) {
-            setAccelStatus(msg["data"]["acc"]);
+        const heartRate = msg["data"]["heart_rate"];
+        if (heartRate != null) {
+            setBpmStatus(`${heartRate["hr"]} bpm`);
         }
 
-        if (msg["data"]["ecg"] != null) {
-            setHrStatus(msg["data"]["ecg"]);
+        const download = msg["data"]["download"];
+        if (download != null) {
+            setDownloadStatus(`${download["pct"]} %`);
+        }
+
+        const preview = msg["data"]["preview"];
+        if (preview == null) {
+            return;
+        }
+
+        // Every channel carries min/max/mean buckets, show the most recent mean
+        const last = (channel: any) => channel["mean"][channel["mean"].length - 1];
+
+        if (preview["acc"] != null) {
+            const acc = preview["acc"];
+            setAccelStatus(`${last(acc["x"])} mG | ${last(acc["y"])} mG | ${last(acc["z"])} mG`);
+        }
+
+        if (preview["ecg"] != null) {
+            setHrStatus(`${last(preview["ecg"]["mv"])} mV`);
         }
 
     }, [lastMessage]);
@@ -33,9 +54,17 @@ export default function PolarStatus() {
             <Typography variant="h6">HeartRate Data Sample:</Typography>
             <Chip label={hrStatus}/>
         </Stack>
+        <Stack direction="row" spacing={2}>
+            <Typography variant="h6">Heart Rate:</Typography>
+            <Chip label={bpmStatus}/>
+        </Stack>
         <Stack direction="row" spacing={2}>
             <Typography variant="h6">Accelerometer Data Sample:</Typography>
             <Chip label={accelStatus}/>
         </Stack>
+        <Stack direction="row" spacing={2}>
+            <Typography variant="h6">Offline Download:</Typography>
+            <Chip label={downloadStatus}/>
+        </Stack>
     </Stack>);
 }
\ No newline at end of file
@@ -1,4 +1,5 @@
 import React from 'react'
+import { flushSync } from 'react-dom';
 import useWebSocket, { ReadyState } from 'react-use-websocket';
 
 export interface WebSocketConnectionProviderProps {
@@ -13,7 +14,23 @@ export interface WebSocketConnectionState {
 }
 
 export function WebSocketConnectionProvider(props: WebSocketConnectionProviderProps) {
-    const { sendMessage, lastMessage, readyState } = useWebSocket(props.url);
+    const [lastMessage, setLastMessage] = React.useState<any>(null);
+    const { sendMessage, readyState } = useWebSocket(props.url, {
+        onMessage: (event: MessageEvent) => {
+            // Binary waveform blocks only go to clients that subscribe to them, which the
+            // interface doesn't yet; anything that isn't text is not for it.
+            if (typeof event.data !== "string") {
+                return;
+            }
+            // Live updates arrive combined, one {"batch": [...]} per orchestrator tick.
+            // They are handed on one by one, flushSync so no component misses one.
+            const msg = JSON.parse(event.data);
+            const messages = Array.isArray(msg["batch"]) ? msg["batch"].map((m: any) => ({data: JSON.stringify(m)})) : [event];
+            for (const message of messages) {
+                flushSync(() => setLastMessage(message));
+            }
+        },
+    });
 
     return (
         <WebSocketConnectionContext.Provider value={{sendMessage: sendMessage, lastMessage, readyState}}>
@@ -26,4 +43,4 @@ export const WebSocketConnectionContext = React.createContext<WebSocketConnectio
     sendMessage: () => {},
     lastMessage: "",
     readyState: ReadyState.UNINSTANTIATED
-})
\ No newline at end of file
+})
@@ -9,18 +9,47 @@
 # {"command": "get_enabled_collectors"}
 # {"command": "start"}
 # {"command": "stop"}
+# {"command": "subscribe", "topics": ["polar.ecg.preview", "buttons.press", "*.log", ...]}
+# {"command": "subscribe", "topics": ["polar.*.waveform"], "binary_rate": 65536}
+# {"command": "unsubscribe", "topics": [...]}
 # Possible reply:
 # {"command": "...", "result": true | false, "message": ""}
+# get_state also tells whether collectors are still stopping (e.g. downloading an offline
+# session) and reports every collector's health, by slug:
+# {"state": "running", "uptime": 12.3, "restarts": 0, "last_exit": null,
+#  "heartbeat_age": 0.4, "status": {...}}
+# A collector that exits with an error or stops sending heartbeats is restarted with
+# backoff, into the same project directory with its files prefixed restart<n>_.
+# Collector updates, combined once per UI tick. Of state channels (LATEST_CHANNELS) only the
+# latest message per topic and device is sent, everything else arrives exactly once:
+# {"batch": [{"component": "...", "data": {...}}, ...]}
+# Only for the topics the client is subscribed to, all of them ("*") until it says otherwise.
+# A topic is the component and the collector's channel, patterns match it like file names.
+# Waveforms (mode raw+waveform) only go to clients whose patterns end in ".waveform", as
+# binary messages of waveform blocks (see collector_ipc.py), at most binary_rate bytes/s.
 
 import asyncio
+from collections import deque
+from fnmatch import fnmatchcase
 from websockets.server import serve
 import signal
-from typing import Mapping, Set, Collection, List
+import time
+from typing import Any, Mapping, Set, Collection, List, Tuple
 import json
 from dataclasses import dataclass
 import pathlib
 import os
 
+from collector_ipc import (
+    ENCODING_BINARY,
+    HEARTBEAT_CHANNEL,
+    HEARTBEAT_INTERVAL,
+    IPC_FD_ENV,
+    frame_to_json,
+    open_reader,
+    read_frames,
+)
+
 if os.getenv("BIKE_DEBUG"):
     INSTALL_PATH = "/home/dawid/Documents/Workspace/bike_data_collection/"
 else:
@@ -34,6 +63,34 @@ if os.getenv("BIKE_DEBUG"):
 else:
     BASE_PROJECT_PATH = "/opt/collected_data/"
 
+# Live updates reach a client at most this often, combined into one {"batch": [...]} message
+UI_TICK = float(os.getenv("BIKE_UI_TICK", "0.1"))
+# What a client receives until it subscribes to something else
+DEFAULT_TOPICS = {"*"}
+# Channels whose every message holds the whole state, only the latest per topic and key
+# is sent. Messages of any other channel are events that all have to arrive, exactly once.
+LATEST_CHANNELS = {"stats", "heart_rate", "hrv", "quality", "download"}
+# Channels whose messages continue each other (preview buckets), up to MAX_APPENDED of them
+# per topic and key are kept
+APPEND_CHANNELS = {"preview"}
+MAX_APPENDED = 50
+# Channels of binary blocks, sent apart from the JSON batch and never matched by "*"
+BINARY_CHANNELS = {"waveform"}
+# Bytes per second of binary blocks a client gets unless it asks for another limit,
+# blocks past it are dropped. Two straps streaming ECG and ACC take about 4 KiB/s.
+DEFAULT_BINARY_RATE = 64 * 1024
+# Events a client hasn't been sent yet. They can't be dropped, past this it is disconnected.
+MAX_PENDING_EVENTS = 1024
+# A client that takes longer than this to accept one message is disconnected
+SEND_TIMEOUT = 5.0
+# A collector that hasn't sent a heartbeat for this long is restarted
+HEARTBEAT_TIMEOUT = float(os.getenv("BIKE_HEARTBEAT_TIMEOUT", "15"))
+# Seconds before the first restart, doubled for every further one up to the maximum
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 60.0
+# A collector that ran this long before failing starts over from the shortest backoff
+STABLE_RUN = 60.0
+
 
 @dataclass(frozen=True)
 class CollectorDef:
@@ -41,6 +98,17 @@ class CollectorDef:
     slug: str
     description: str
     path: str
+    # Seconds a collector may take to finish after being asked to stop
+    stop_timeout: float = 4.0
+    # Instead of stop_timeout when the mode setting includes offline
+    offline_stop_timeout: float | None = None
+
+    def stop_timeout_for(self, settings: Mapping[str, str]) -> float:
+        if self.offline_stop_timeout is not None and "offline" in str(
+            settings.get("mode", "")
+        ).split("+"):
+            return self.offline_stop_timeout
+        return self.stop_timeout
 
 
 ALL_AVAILABLE_COLLECTORS: List[CollectorDef] = [
@@ -49,6 +117,8 @@ ALL_AVAILABLE_COLLECTORS: List[CollectorDef] = [
         "polar",
         "The Polar H10 HR and ACC tracking module",
         f"{INSTALL_PATH}polar_iface.py",
+        # Offline mode downloads the whole session from the strap on stop
+        offline_stop_timeout=600.0,
     ),
     CollectorDef(
         "Buttons",
@@ -59,6 +129,43 @@ ALL_AVAILABLE_COLLECTORS: List[CollectorDef] = [
 ]
 
 
+@dataclass
+class CollectorHealth:
+    """Supervision state of one collector, as reported by get_state"""
+
+    # starting, running, unresponsive, restarting, stopping, exited or stopped
+    state: str = "starting"
+    # Monotonic time the current run started
+    started: float = 0.0
+    restarts: int = 0
+    last_exit: int | None = None
+    last_heartbeat: float | None = None
+    # What the collector sent with its last heartbeat
+    status: Mapping[str, Any] | None = None
+
+    def beat(self, status: Mapping[str, Any]):
+        self.last_heartbeat = time.monotonic()
+        self.status = status
+
+    def silent_for(self) -> float:
+        return time.monotonic() - (self.last_heartbeat or self.started)
+
+    def report(self) -> Mapping[str, Any]:
+        now = time.monotonic()
+        return {
+            "state": self.state,
+            "uptime": round(now - self.started, 1) if self.state == "running" else None,
+            "restarts": self.restarts,
+            "last_exit": self.last_exit,
+            "heartbeat_age": (
+                round(now - self.last_heartbeat, 1)
+                if self.last_heartbeat is not None
+                else None
+            ),
+            "status": self.status,
+        }
+
+
 class Configuration:
     _settings: Mapping[str, str] = {}
     _collectors: Set[str] = set()
@@ -83,43 +190,240 @@ class Configuration:
         return params
 
 
+def channel_of(topic: str) -> str:
+    return topic.rsplit(".", 1)[-1]
+
+
+def batch_message(messages: List[str]) -> str:
+    # Joined as text, the messages are JSON already
+    return '{"batch":[' + ",".join(messages) + "]}"
+
+
+class ClientConnection:
+    """
+    One interface client with its own sender task, so a slow client only ever holds
+    up itself. Live updates wait in per topic and key slots, events in a buffer of
+    their own, and whatever is pending goes out as one message per UI tick.
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self._slots: Mapping[Tuple[str, str], deque] = {}
+        self._events: List[str] = []
+        self._binary: List[bytes] = []
+        self.binary_rate = DEFAULT_BINARY_RATE
+        self._binary_allowance = float(DEFAULT_BINARY_RATE)
+        self._binary_checked = time.monotonic()
+        self._throttled = 0
+        self._pending = asyncio.Event()
+        self._replaced = 0
+        self._closed = False
+        self.topics: Set[str] = set(DEFAULT_TOPICS)
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def wants(self, topic: str) -> bool:
+        patterns = self.topics
+        if channel_of(topic) in BINARY_CHANNELS:
+            # Opt-in, a client only gets binary messages if it asked for them by name
+            patterns = [p for p in patterns if channel_of(p) in BINARY_CHANNELS]
+        return any(fnmatchcase(topic, pattern) for pattern in patterns)
+
+    def send_nowait(self, msg: str, topic: str = "", key: str = ""):
+        channel = channel_of(topic)
+        # Messages without a topic come from stdout and can't be told apart
+        if channel not in LATEST_CHANNELS and channel not in APPEND_CHANNELS:
+            self._events.append(msg)
+        else:
+            slot = self._slots.get((topic, key))
+            if slot is None:
+                size = MAX_APPENDED if channel in APPEND_CHANNELS else 1
+                slot = self._slots[(topic, key)] = deque(maxlen=size)
+            if len(slot) == slot.maxlen:
+                self._replaced += 1
+            slot.append(msg)
+        self._pending.set()
+
+    def send_binary_nowait(self, block: bytes):
+        # Token bucket holding up to a second's worth of bytes
+        now = time.monotonic()
+        self._binary_allowance = min(
+            self.binary_rate,
+            self._binary_allowance + (now - self._binary_checked) * self.binary_rate,
+        )
+        self._binary_checked = now
+        if len(block) > self._binary_allowance:
+            self._throttled += 1
+            return
+        self._binary_allowance -= len(block)
+        self._binary.append(block)
+        self._pending.set()
+
+    def take_pending(self) -> Tuple[List[str], List[bytes]]:
+        """
+        Everything queued since the last call: events and live updates, and binary blocks.
+        """
+        messages = self._events + [m for slot in self._slots.values() for m in slot]
+        blocks = self._binary
+        self._events = []
+        self._slots = {}
+        self._binary = []
+        return messages, blocks
+
+    async def _send_loop(self):
+        loop = asyncio.get_running_loop()
+        try:
+            # Checked as well as cancelled, wait_for swallows a cancellation that
+            # arrives just as the send completes (Python 3.11)
+            while not self._closed:
+                await self._pending.wait()
+                self._pending.clear()
+                if len(self._events) > MAX_PENDING_EVENTS:
+                    print(f"{self.websocket.remote_address} fell behind, disconnecting")
+                    break
+
+                messages, blocks = self.take_pending()
+                started = loop.time()
+                if messages:
+                    await asyncio.wait_for(
+                        self.websocket.send(batch_message(messages)), SEND_TIMEOUT
+                    )
+                if blocks:
+                    # Blocks carry their own length, a tick's worth go in one message
+                    await asyncio.wait_for(
+                        self.websocket.send(b"".join(blocks)), SEND_TIMEOUT
+                    )
+                # Anything arriving until the next tick joins the next message
+                await asyncio.sleep(UI_TICK - (loop.time() - started))
+        except asyncio.TimeoutError:
+            print(f"{self.websocket.remote_address} is too slow, disconnecting")
+        except Exception as e:
+            print(e)
+            print("Tried forwarding message to closed connection!")
+        # Ends the client's message_handler, which cleans up
+        await self.websocket.close()
+
+    async def close(self):
+        self._closed = True
+        self._sender.cancel()
+        try:
+            await self._sender
+        except asyncio.CancelledError:
+            pass
+        await self.websocket.close()
+        if self._replaced:
+            print(
+                f"{self.websocket.remote_address} skipped {self._replaced} "
+                "superseded live updates"
+            )
+        if self._throttled:
+            print(
+                f"{self.websocket.remote_address} dropped {self._throttled} "
+                "binary blocks over its rate limit"
+            )
+
+
 class OrchestratorContext:
     _shutdown_event = asyncio.Event()
     _connections_lock: asyncio.Lock = asyncio.Lock()
-    _connections: Set[any] = set()
+    _connections: Mapping[any, ClientConnection] = {}
+    # Interested clients per topic, filled in as topics turn up
+    _topic_index: Mapping[str, List[ClientConnection]] = {}
 
     _tasks_lock = asyncio.Lock()
     _tasks = set()
+    # Asked to stop but not finished yet, e.g. still downloading an offline session
+    _stopping = set()
+    # Of the collectors started last, by slug, kept after they stop
+    _health: Mapping[str, CollectorHealth] = {}
 
     settings: Configuration = Configuration()
 
     async def start(self, project: str):
         async with self._tasks_lock:
+            self._health = {}
             for possible_collector in ALL_AVAILABLE_COLLECTORS:
                 if possible_collector.slug in self.settings.get_collectors():
-                    settings_str = self.settings.get_as_params() + [
-                        f"--project={BASE_PROJECT_PATH}{project}/"
-                    ]
                     self._tasks.add(
                         asyncio.create_task(
-                            process_handler(possible_collector, settings_str, self)
+                            self.supervise(
+                                possible_collector,
+                                self.settings.get_as_params(),
+                                f"{BASE_PROJECT_PATH}{project}/",
+                            )
                         )
                     )
 
+    async def supervise(
+        self, collector: CollectorDef, params: List[str], project_path: str
+    ):
+        health = self._health[collector.slug] = CollectorHealth()
+        backoff = RESTART_BACKOFF
+        stop_timeout = collector.stop_timeout_for(self.settings.get_settings())
+        try:
+            while True:
+                # A restart gets files of its own, the ones written so far are kept
+                prefix = f"restart{health.restarts}_" if health.restarts else ""
+                health.state = "starting"
+                health.started = time.monotonic()
+                health.last_heartbeat = None
+                try:
+                    returncode = await process_handler(
+                        collector,
+                        params + [f"--project={project_path}{prefix}"],
+                        self,
+                        health,
+                        stop_timeout,
+                    )
+                except Exception as e:
+                    print(e)
+                    returncode = None
+                health.last_exit = returncode
+
+                if returncode == 0 and health.state == "running":
+                    print(f"{collector.name} finished on its own")
+                    health.state = "exited"
+                    return
+
+                if time.monotonic() - health.started >= STABLE_RUN:
+                    backoff = RESTART_BACKOFF
+                print(f"{collector.name} failed ({returncode}), restarting in {backoff} s")
+                health.state = "restarting"
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_RESTART_BACKOFF)
+                health.restarts += 1
+        finally:
+            if health.state != "exited":
+                health.state = "stopped"
+
+    def health_report(self) -> Mapping[str, Mapping[str, Any]]:
+        return {slug: health.report() for slug, health in self._health.items()}
+
     async def stop(self):
+        # Waited for outside the lock, so state queries keep answering while collectors
+        # take their time to finish
         async with self._tasks_lock:
-            for task in self._tasks:
+            tasks = set(self._tasks)
+            self._tasks.clear()
+            self._stopping |= tasks
+            for task in tasks:
                 task.cancel()
-                try:
-                    await task
-                except asyncio.CancelledError:
-                    print("Stop done")
 
-            self._tasks.clear()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                print("Stop done")
+            finally:
+                self._stopping.discard(task)
 
     async def is_running(self):
         async with self._tasks_lock:
-            return bool(self._tasks)
+            # A collector that finished on its own records nothing any more,
+            # one that is still stopping keeps the collectors busy
+            return any(not task.done() for task in self._tasks | self._stopping)
+
+    def is_stopping(self) -> bool:
+        return bool(self._stopping)
 
     async def wait_for_shutdown(self):
         await self._shutdown_event.wait()
@@ -129,48 +433,157 @@ class OrchestratorContext:
 
     async def on_connect(self, conn):
         async with self._connections_lock:
-            self._connections.add(conn)
+            self._connections[conn] = ClientConnection(conn)
+            self._topic_index.clear()
 
     async def on_disconnect(self, conn):
         async with self._connections_lock:
-            self._connections.remove(conn)
+            client = self._connections.pop(conn)
+            self._topic_index.clear()
 
-        await conn.close()
+        await client.close()
 
-    async def forward(self, msg: str):
+    async def subscribe(
+        self, conn, topics: Collection[str], binary_rate: int | None = None
+    ) -> List[str]:
         async with self._connections_lock:
-            for conn in self._connections:
-                try:
-                    await conn.send(msg)
-                except Exception as e:
-                    print(e)
-                    print("Tried forwarding message to closed connection!")
+            client = self._connections[conn]
+            client.topics |= set(topics)
+            if binary_rate is not None:
+                client.binary_rate = binary_rate
+            self._topic_index.clear()
+            return sorted(client.topics)
+
+    async def unsubscribe(self, conn, topics: Collection[str]) -> List[str]:
+        async with self._connections_lock:
+            client = self._connections[conn]
+            client.topics -= set(topics)
+            self._topic_index.clear()
+            return sorted(client.topics)
+
+    def clients_for(self, topic: str) -> List[ClientConnection]:
+        clients = self._topic_index.get(topic)
+        if clients is None:
+            clients = [c for c in self._connections.values() if c.wants(topic)]
+            self._topic_index[topic] = clients
+        return clients
+
+    async def forward(self, msg: str, topic: str = "", key: str = ""):
+        # Only queues, the collector output readers never wait on a client.
+        # Nothing is awaited, so the connections can't change underneath.
+        for client in self.clients_for(topic):
+            client.send_nowait(msg, topic, key)
+
+    async def forward_binary(self, block: bytes, topic: str):
+        for client in self.clients_for(topic):
+            client.send_binary_nowait(block)
+
+
+async def forward_output(
+    stream: asyncio.StreamReader, ctx: OrchestratorContext, name: str = ""
+):
+    # Plain logs now, only collectors without the IPC channel still print messages here
+    while data := await stream.readline():
+        line = data.decode("utf-8", errors="replace").rstrip()
+        if line.startswith("{"):
+            await ctx.forward(line)
+        elif line:
+            print(f"[{name}] {line}")
+
+
+async def forward_frames(
+    stream: asyncio.StreamReader,
+    ctx: OrchestratorContext,
+    health: CollectorHealth | None = None,
+):
+    # Interface messages from the collector's IPC channel
+    async for topic, key, encoding, payload in read_frames(stream):
+        if channel_of(topic) == HEARTBEAT_CHANNEL:
+            # For the supervisor, not the interface
+            if health is not None:
+                message = json.loads(frame_to_json(encoding, payload))
+                health.beat(message["data"]["heartbeat"])
+        elif encoding == ENCODING_BINARY:
+            await ctx.forward_binary(payload, topic)
+        else:
+            await ctx.forward(frame_to_json(encoding, payload), topic, key)
+
+
+async def watch_heartbeats(health: CollectorHealth):
+    # Returns once the collector has gone quiet for too long
+    while health.silent_for() < HEARTBEAT_TIMEOUT:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
 
 
 async def process_handler(
-    collector: CollectorDef, params: str, ctx: OrchestratorContext
-):
+    collector: CollectorDef,
+    params: str,
+    ctx: OrchestratorContext,
+    health: CollectorHealth | None = None,
+    stop_timeout: float | None = None,
+) -> int:
     print(f"Starting: {collector.path} {params}")
 
-    proc = await asyncio.create_subprocess_exec(
-        "/usr/bin/python3", collector.path, *params, stdout=asyncio.subprocess.PIPE
+    read_fd, write_fd = os.pipe()
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "/usr/bin/python3",
+            collector.path,
+            *params,
+            stdout=asyncio.subprocess.PIPE,
+            pass_fds=(write_fd,),
+            env={**os.environ, IPC_FD_ENV: str(write_fd)},
+        )
+    except BaseException:
+        os.close(read_fd)
+        raise
+    finally:
+        # Only the collector writes, the pipe ends when it exits
+        os.close(write_fd)
+    frames = await open_reader(read_fd)
+    outputs = asyncio.gather(
+        forward_frames(frames, ctx, health),
+        forward_output(proc.stdout, ctx, collector.name),
     )
+    # Waited on, not awaited, so a stop leaves the outputs running
+    waits = [outputs]
+    if health is not None:
+        health.state = "running"
+        waits.append(asyncio.create_task(watch_heartbeats(health)))
+    if stop_timeout is None:
+        stop_timeout = collector.stop_timeout
 
     try:
-        while data := await proc.stdout.readline():
-            line = data.decode("ascii").rstrip()
-            if line:
-                await ctx.forward(line)
+        done, _ = await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        if outputs not in done:
+            print(f"{collector.name} sent no heartbeat for {HEARTBEAT_TIMEOUT} s")
+            health.state = "unresponsive"
+            # It's stuck, no point in waiting long for a clean stop
+            stop_timeout = HEARTBEAT_TIMEOUT
+    except asyncio.CancelledError:
+        if health is not None:
+            health.state = "stopping"
+        raise
     finally:
+        for waiter in waits[1:]:
+            waiter.cancel()
         print(f"Stopping {collector.name}")
-        proc.terminate()
-        # Prevent a deadlock in some cases
-        await proc.stdout.read(4096)
+        if proc.returncode is None:
+            proc.terminate()
         try:
-            await asyncio.wait_for(proc.wait(), timeout=4)
+            # Keep draining the collector's output so it can't block on a full pipe,
+            # and its last messages (e.g. download progress) still reach the interface
+            results = await asyncio.wait_for(
+                asyncio.gather(outputs, proc.wait(), return_exceptions=True),
+                timeout=stop_timeout,
+            )
+            if isinstance(results[0], Exception):
+                print(f"{collector.name} output failed: {results[0]!r}")
         except asyncio.TimeoutError:
             print("Time's up, it's killin time")
             proc.kill()
+            await proc.wait()
+    return proc.returncode
 
 
 async def stop_handler(ctx, msg):
@@ -288,11 +701,35 @@ async def get_state_handler(ctx, msg):
             "message": {
                 "collectors": ctx.settings.get_collectors(),
                 "is_running": await ctx.is_running(),
+                "is_stopping": ctx.is_stopping(),
+                "health": ctx.health_report(),
             },
         }
     )
 
 
+async def subscribe_handler(ctx, msg, websocket, command="subscribe"):
+    topics = msg.get("topics")
+    binary_rate = msg.get("binary_rate")
+    if not isinstance(topics, list) or not all(isinstance(t, str) for t in topics):
+        return json.dumps(
+            {"command": command, "result": False, "message": "Corrupted message"}
+        )
+
+    if binary_rate is not None and (
+        not isinstance(binary_rate, int) or binary_rate <= 0
+    ):
+        return json.dumps(
+            {"command": command, "result": False, "message": "Corrupted message"}
+        )
+
+    if command == "subscribe":
+        subscribed = await ctx.subscribe(websocket, topics, binary_rate)
+    else:
+        subscribed = await ctx.unsubscribe(websocket, topics)
+    return json.dumps({"command": command, "result": True, "message": subscribed})
+
+
 async def comms_handler(ctx, msg):
     return "{}"
 
@@ -307,6 +744,10 @@ async def message_handler(ctx: OrchestratorContext, websocket):
         "set_collectors": set_collectors_handler,
         "get_collectors": get_collectors_handler,
         "comms": comms_handler,
+        "subscribe": lambda ctx, msg: subscribe_handler(ctx, msg, websocket),
+        "unsubscribe": lambda ctx, msg: subscribe_handler(
+            ctx, msg, websocket, "unsubscribe"
+        ),
     }
 
     await ctx.on_connect(websocket)
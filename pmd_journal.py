@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Raw journal of PMD notifications, written straight from the BLE callback and decoded later.
+# File layout: b"PMDJ", uint32 header length, JSON header,
+# then records of int64 monotonic_ns, uint16 payload length, payload (all little-endian).
+# Offline decoding:
+#   python3 pmd_journal.py decode /opt/collected_data/<project>/ [--format=csv|columnar]
+#       [--time_format=iso|ns]
+# Recordings of several straps keep one journal per device, select it with --device=<MAC>.
+
+import argparse
+import json
+import struct
+import time
+from typing import Any, BinaryIO, Iterator, Mapping, Tuple
+
+JOURNAL_NAME = "pmd.journal"
+JOURNAL_MAGIC = b"PMDJ"
+JOURNAL_VERSION = 1
+
+HEADER_LEN = struct.Struct("<I")
+RECORD_HEADER = struct.Struct("<qH")
+
+
+class JournalWriter:
+    """
+    Appends (monotonic_ns, raw notification) records. Nothing is parsed on the way in.
+    """
+
+    def __init__(self, path: str, meta: Mapping[str, Any] = None):
+        self._fd: BinaryIO = open(path, "wb")
+        header = json.dumps(
+            {
+                "version": JOURNAL_VERSION,
+                # Anchors monotonic time to wall time for the decoder
+                "wall_ns": time.time_ns(),
+                "monotonic_ns": time.monotonic_ns(),
+                "meta": dict(meta or {}),
+            }
+        ).encode("utf-8")
+        self._fd.write(JOURNAL_MAGIC + HEADER_LEN.pack(len(header)) + header)
+
+    def append(self, monotonic_ns: int, data: bytes):
+        self._fd.write(RECORD_HEADER.pack(monotonic_ns, len(data)))
+        self._fd.write(data)
+
+    def flush(self):
+        self._fd.flush()
+
+    def close(self):
+        self._fd.flush()
+        self._fd.close()
+
+
+def read_journal_header(fd: BinaryIO) -> Mapping[str, Any]:
+    if fd.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+        raise ValueError("Not a PMD journal")
+    (header_len,) = HEADER_LEN.unpack(fd.read(HEADER_LEN.size))
+    header = json.loads(fd.read(header_len))
+    if header["version"] != JOURNAL_VERSION:
+        raise ValueError(f"Unsupported journal version {header['version']}")
+    return header
+
+
+def iter_journal(path: str) -> Iterator[Tuple[int, bytes]]:
+    """
+    Streams raw (monotonic_ns, payload) records. A record cut short by a crash ends the stream.
+    """
+    with open(path, "rb") as fd:
+        read_journal_header(fd)
+        while len(record_header := fd.read(RECORD_HEADER.size)) == RECORD_HEADER.size:
+            monotonic_ns, length = RECORD_HEADER.unpack(record_header)
+            data = fd.read(length)
+            if len(data) != length:
+                return
+            yield monotonic_ns, data
+
+
+def read_sample_rates(header: Mapping[str, Any]) -> Mapping[Any, int]:
+    # Imported here, polar_iface imports this module for the writer
+    import polar_iface
+
+    return {
+        polar_iface.PMDMeasurmentTypes[name]: rate
+        for name, rate in header["meta"]["sample_rates"].items()
+    }
+
+
+def iter_journal_samples(path: str) -> Iterator[Any]:
+    """
+    Streams decoded polar_iface.PolarSample objects from a journal, with sensor and host
+    times mapped the same way as during a live recording.
+    """
+    import polar_iface
+
+    with open(path, "rb") as fd:
+        header = read_journal_header(fd)
+
+    sample_rates = read_sample_rates(header)
+    timestamper = polar_iface.SampleTimestamper(sample_rates)
+    clock = polar_iface.ClockMapper(header["wall_ns"] - header["monotonic_ns"])
+
+    for monotonic_ns, data in iter_journal(path):
+        frame = polar_iface.parse_pmd_frame(data)
+        if not frame or frame.measurment_type not in sample_rates:
+            continue
+        if isinstance(frame.content, bytes):
+            continue
+        yield clock.stamp(
+            polar_iface.PolarSample(time=monotonic_ns, sample=timestamper.stamp(frame))
+        )
+
+
+def decode_journal(project: str, output_format: str, time_format: str = "iso"):
+    import polar_iface
+
+    path = f"{project}{JOURNAL_NAME}"
+    with open(path, "rb") as fd:
+        sample_rates = read_sample_rates(read_journal_header(fd))
+
+    outputs = polar_iface.open_sample_outputs(project, sample_rates, output_format)
+    count = 0
+    try:
+        for message in iter_journal_samples(path):
+            polar_iface.write_sample_output(
+                outputs[message.sample.measurment_type],
+                message,
+                output_format,
+                time_format,
+            )
+            count += 1
+    finally:
+        for output in outputs.values():
+            output.close()
+
+    print(f"Decoded {count} frames from {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    decode_parser = subparsers.add_parser(
+        "decode", help="Decode a project's journal into ECG/ACC files"
+    )
+    decode_parser.add_argument("project")
+    decode_parser.add_argument("--format", default="csv", choices=["csv", "columnar"])
+    decode_parser.add_argument("--device", default=None)
+    decode_parser.add_argument("--time_format", default="iso", choices=["iso", "ns"])
+    args = parser.parse_args()
+
+    if args.command == "decode":
+        project = args.project if args.project.endswith("/") else f"{args.project}/"
+        if args.device:
+            # Same naming as polar_iface.device_prefix
+            project = f"{project}{args.device.replace(':', '').upper()}_"
+        decode_journal(project, args.format, args.time_format)
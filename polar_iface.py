@@ -1,39 +1,102 @@
 import asyncio
 from bleak import BleakClient, BleakScanner
 from enum import IntEnum
-from dataclasses import dataclass
+from dataclasses import dataclass, replace, fields
 import signal
-from typing import List, Any, Mapping, Set
+from typing import Callable, List, Any, Mapping, Set
 import json
-import sys
 import argparse
-import datetime
-import pytz
 from collections import defaultdict
+from functools import cached_property
+import time
+import random
+import numpy as np
+from session_store import (
+    ColumnarChannelWriter,
+    format_host_times,
+    WriteBehindBuffer,
+    CHANNEL_COLUMNS,
+    DEFAULT_WRITE_BUFFER,
+    DEFAULT_FLUSH_INTERVAL,
+)
+from pmd_journal import JournalWriter, JOURNAL_NAME
+from threaded_writer import ThreadedWriter
+from hrv import RPeakDetector, RollingHRV, DEFAULT_HRV_WINDOW
+from collector_ipc import (
+    HEARTBEAT_INTERVAL,
+    OutputChannel,
+    Outgoing,
+    heartbeat_message,
+    pack_waveform,
+    MAX_BATCH as MAX_PRINT_BATCH,
+)
+from bounded_queue import (
+    BoundedQueue,
+    DROP_POLICIES,
+    POLICY_DROP_NEWEST,
+    POLICY_DROP_OLDEST,
+)
+
+OUTPUT_FORMATS = ["csv", "columnar", "journal"]
+# Host time column of every CSV output (ecg, acc, rr, hr): ISO 8601 or integer ns since the
+# epoch. Sensor times (the second column of ecg, acc and rr, all of gaps) are always integer
+# ns of the strap's clock.
+TIME_FORMATS = ["iso", "ns"]
+# Raw PMD streams (ECG/ACC), the standard Heart Rate Service (HR + RR intervals) or both.
+# offline records ECG/ACC on the strap and downloads them at the end, see polar_offline.py,
+# its recording format is unverified on hardware so the interface doesn't offer it yet
+# +waveform also sends every ECG/ACC frame as a binary waveform block to clients subscribed to
+# polar.*.waveform; the interface has no such consumer yet and does not offer these modes
+COLLECTOR_MODES = ["raw", "hr", "raw+hr", "offline", "raw+waveform", "raw+hr+waveform"]
+# "sim" replaces the straps with simulated ones from polar_sim.py
+TRANSPORTS = ["ble", "sim"]
 
 SERVICE = "fb005c80-02e7-f387-1cad-8acd2d8df0c8"
 SERVICE_NOTIFY_PORT = "fb005c82-02e7-f387-1cad-8acd2d8df0c8"
 SERVICE_CONTROL_PORT = "fb005c81-02e7-f387-1cad-8acd2d8df0c8"
+# PMD timestamps count from 2000-01-01 once the strap's clock is set
+SENSOR_EPOCH_NS = 946684800 * 10**9
+# Heart Rate Measurement of the standard Heart Rate Service
+HEART_RATE_MEASUREMENT = "00002a37-0000-1000-8000-00805f9b34fb"
 
 # Something similar: https://github.com/kbre93/dont-hold-your-breath/blob/master/PolarH10.py
 
 
 @dataclass
 class PolarSample:
-    time: datetime.datetime
+    # time.monotonic_ns() when the notification arrived
+    time: int
     sample: "PMDFrame"
+    # Address of the strap the frame came from
+    device: str = ""
+    # Wall time of every sample in ns since the epoch, filled in by ClockMapper
+    host_times: np.ndarray | None = None
 
 
-class PolarContext:
-    _sample_queue = asyncio.Queue()
+DEFAULT_SAMPLE_QUEUE_SIZE = 1024
+DEFAULT_PRINT_QUEUE_SIZE = 256
+DEFAULT_PREVIEW_RATE = 25.0
+DEFAULT_PREVIEW_INTERVAL = 0.2
+
 
-    _print_queue = asyncio.Queue()
+class PolarContext:
     _shutdown_event: asyncio.Event = asyncio.Event()
 
     _lock: asyncio.Lock = asyncio.Lock()
 
-    def __init__(self, project: str):
+    def __init__(
+        self,
+        project: str,
+        sample_queue_size: int = DEFAULT_SAMPLE_QUEUE_SIZE,
+        sample_queue_policy: str = POLICY_DROP_NEWEST,
+        print_queue_size: int = DEFAULT_PRINT_QUEUE_SIZE,
+    ):
         self._project = project
+        self._sample_queue = BoundedQueue(sample_queue_size, sample_queue_policy)
+        # Status messages are only worth something while fresh
+        self._print_queue = BoundedQueue(print_queue_size, POLICY_DROP_OLDEST)
+        # Frames handled by sample_writer, sent along with the heartbeats
+        self.samples_handled = 0
 
     def get_project(self) -> str:
         return self._project
@@ -41,25 +104,70 @@ class PolarContext:
     async def wait_for_sample(self) -> PolarSample:
         return await self._sample_queue.get()
 
+    async def wait_for_samples(self, max_count: int) -> List[PolarSample]:
+        # Waits for one sample, then takes whatever else is already queued
+        samples = [await self._sample_queue.get()]
+        while len(samples) < max_count and not self._sample_queue.empty():
+            samples.append(self._sample_queue.get_nowait())
+        return samples
+
     async def put_sample(self, sample: PolarSample):
-        await self._sample_queue.put(sample)
+        # For producers that can wait, e.g. the offline download, nothing is dropped
+        await self._sample_queue.put_waiting(sample)
+
+    def offer_sample(self, sample: PolarSample) -> bool:
+        # For notifications: bleak runs every callback as a task of its own, so waiting
+        # wouldn't slow the strap down, only pile up callbacks. A full queue drops by the
+        # policy instead, and the drops are counted.
+        return self._sample_queue.offer(sample)
+
+    def samples_dropped(self) -> int:
+        return self._sample_queue.dropped()
+
+    async def wait_for_samples_written(self):
+        await self._sample_queue.join()
 
     def did_deal_with_sample(self):
+        self.samples_handled += 1
         self._sample_queue.task_done()
 
-    async def print_log(self, message: str):
+    def did_deal_with_samples(self, count: int):
+        self.samples_handled += count
+        for _ in range(count):
+            self._sample_queue.task_done()
+
+    async def print_log(self, message: str, device: str | None = None):
+        data = {"log": message}
+        if device:
+            data["device"] = device
         await self._print_queue.put(
-            json.dumps({"component": "polar", "data": {"log": message}})
+            Outgoing("log", json.dumps({"component": "polar", "data": data}), device or "")
         )
 
-    async def print_preformatted(self, message: str):
-        await self._print_queue.put(message)
-
-    async def get_next_print(self):
-        return await self._print_queue.get()
-
-    def did_print(self):
-        self._print_queue.task_done()
+    async def print_preformatted(
+        self, message: str | Mapping[str, Any] | bytes, channel: str, device: str = ""
+    ):
+        # A dict can be sent in the compact IPC encoding, meant for numeric payloads,
+        # bytes are passed on to the interface as they are.
+        # Of state channels (orchestrator.LATEST_CHANNELS) the orchestrator keeps the
+        # latest message per channel and device, every other message is passed on.
+        await self._print_queue.put(Outgoing(channel, message, device))
+
+    async def get_next_prints(self, max_count: int) -> List[Outgoing]:
+        messages = [await self._print_queue.get()]
+        while len(messages) < max_count and not self._print_queue.empty():
+            messages.append(self._print_queue.get_nowait())
+        return messages
+
+    def did_print(self, count: int = 1):
+        for _ in range(count):
+            self._print_queue.task_done()
+
+    def queue_stats(self) -> Mapping[str, Any]:
+        return {
+            "samples": self._sample_queue.stats(),
+            "print": self._print_queue.stats(),
+        }
 
     def did_shutdown(self):
         return self._shutdown_event.is_set()
@@ -81,21 +189,98 @@ class PMDSetting(IntEnum):
     security = 6
 
 
+# Size in bytes of a single value of every setting, as the Polar BLE SDK reads them
+# (PmdSetting's field sizes, rangeMU and factor are 32 bit)
+PMD_SETTING_SIZES: Mapping[PMDSetting, int] = {
+    PMDSetting.samplerate: 2,
+    PMDSetting.resolution: 2,
+    PMDSetting.range: 2,
+    PMDSetting.rangeMU: 4,
+    PMDSetting.channels: 1,
+    PMDSetting.factor: 4,
+    PMDSetting.security: 16,
+}
+
+
 class PMDConfiguration:
-    # TODO: Implement
-    _settings: Mapping[PMDSetting, int] = dict()
+    """
+    The settings a measurement is started with, serialized as [type, count = 1, value] TLVs.
+    """
 
-    def set():
-        pass
+    def __init__(self, settings: Mapping[PMDSetting, int] | None = None):
+        self._settings: Mapping[PMDSetting, int] = dict(settings or {})
 
-    def get() -> int:
-        return 0
+    def set(self, setting: PMDSetting, value: int):
+        self._settings[setting] = value
 
-    def clear():
-        pass
+    def get(self, setting: PMDSetting) -> int | None:
+        return self._settings.get(setting)
 
-    def serialize() -> bytes:
-        return bytes()
+    def clear(self):
+        self._settings.clear()
+
+    def items(self):
+        return self._settings.items()
+
+    def serialize(self) -> bytes:
+        serialized = bytes()
+        for setting, value in sorted(self._settings.items()):
+            serialized += bytes([setting, 0x01]) + value.to_bytes(
+                PMD_SETTING_SIZES[setting], byteorder="little"
+            )
+        return serialized
+
+    def __repr__(self) -> str:
+        return ", ".join(
+            f"{setting.name}={value}" for setting, value in sorted(self._settings.items())
+        )
+
+
+def parse_pmd_settings(data: bytes) -> Mapping[PMDSetting, List[int]]:
+    """
+    Parses the settings TLVs of a GET_SETTINGS reply into the values each setting supports.
+    """
+    available: Mapping[PMDSetting, List[int]] = {}
+    offset = 0
+    while offset + 2 <= len(data):
+        if data[offset] not in PMD_SETTING_SIZES:
+            # Newer firmware, without its value size the TLVs after it can't be found.
+            # What was read so far is still good.
+            break
+        setting = PMDSetting(data[offset])
+        count = data[offset + 1]
+        size = PMD_SETTING_SIZES[setting]
+        offset += 2
+        if offset + count * size > len(data):
+            raise ValueError(f"Settings truncated in {setting.name}")
+        values = []
+        for _ in range(count):
+            values.append(
+                int.from_bytes(data[offset : offset + size], byteorder="little")
+            )
+            offset += size
+        available[setting] = values
+    return available
+
+
+def choose_pmd_configuration(
+    requested: PMDConfiguration, available: Mapping[PMDSetting, List[int]]
+) -> tuple:
+    """
+    Matches the requested settings against what the sensor supports. Unsupported values are
+    replaced by the nearest supported one. Returns the configuration and a list of warnings.
+    """
+    chosen = PMDConfiguration()
+    warnings = []
+    for setting, value in requested.items():
+        options = available.get(setting)
+        if not options or value in options:
+            chosen.set(setting, value)
+            continue
+        nearest = min(options, key=lambda option: abs(option - value))
+        warnings.append(f"{setting.name}={value} not supported, using {nearest}")
+        chosen.set(setting, nearest)
+    return chosen, warnings
 
 
 class PMDMeasurmentTypes(IntEnum):
@@ -161,9 +346,23 @@ class PMDFrame:
 class PMDCPResponse:
     response: int
     op: int
-    measurement: PMDMeasurmentTypes
-    error: PMDError
+    # Plain ints if the strap sent a value these don't know
+    measurement: PMDMeasurmentTypes | int
+    error: PMDError | int
     rest: bytes
+    # Another reply with more parameters follows
+    more: bool = False
+    parameters: bytes = bytes()
+
+
+class PMDControlPointError(Exception):
+    def __init__(self, reply: PMDCPResponse):
+        super().__init__(
+            f"Control point {PMDCommands(reply.op).name} for "
+            f"{getattr(reply.measurement, 'name', reply.measurement)} failed: "
+            f"{getattr(reply.error, 'name', reply.error)}"
+        )
+        self.reply = reply
 
 
 @dataclass(frozen=True)
@@ -175,12 +374,47 @@ class EcgSample:
 @dataclass(frozen=True)
 class PMDCECGData:
     timestamp: int
-    samples: List[EcgSample]
+    # Columnar view, one int32 entry per sample
+    mv: np.ndarray
+    # Sensor time of every sample in ns, filled in by SampleTimestamper
+    timestamps: np.ndarray | None = None
+
+    @cached_property
+    def samples(self) -> List[EcgSample]:
+        # Object view, only built when someone asks for it
+        timestamps = (
+            self.timestamps.tolist()
+            if self.timestamps is not None
+            else [0] * len(self.mv)
+        )
+        return [
+            EcgSample(timestamp=ts, mv=mv)
+            for ts, mv in zip(timestamps, self.mv.tolist())
+        ]
+
+    def __len__(self) -> int:
+        return len(self.mv)
 
 
 @dataclass(frozen=True)
 class PMDACCData:
-    samples: List["PMDACCSample"]
+    # Columnar views, one int16 entry per sample per axis
+    x: np.ndarray
+    y: np.ndarray
+    z: np.ndarray
+    # Sensor time of every sample in ns, filled in by SampleTimestamper
+    timestamps: np.ndarray | None = None
+
+    @cached_property
+    def samples(self) -> List["PMDACCSample"]:
+        # Object view, only built when someone asks for it
+        return [
+            PMDACCSample(x=x, y=y, z=z)
+            for x, y, z in zip(self.x.tolist(), self.y.tolist(), self.z.tolist())
+        ]
+
+    def __len__(self) -> int:
+        return len(self.x)
 
 
 @dataclass(frozen=True)
@@ -190,22 +424,266 @@ class PMDACCSample:
     z: int
 
 
+STREAMED_MEASUREMENTS = [PMDMeasurmentTypes.ECG, PMDMeasurmentTypes.ACC]
+
+# Sample rates (Hz) and ranges (G) the H10 accepts for ACC
+ECG_SAMPLE_RATE = 130
+ACC_SAMPLE_RATES = [25, 50, 100, 200]
+ACC_RANGES = [2, 4, 8]
+
+# (channels, resolution in bits) of delta compressed frames, per measurement and frame type
+DELTA_FRAME_FORMATS: Mapping[tuple, tuple] = {
+    (PMDMeasurmentTypes.ECG, 0): (1, 24),
+    (PMDMeasurmentTypes.ACC, 0): (3, 16),
+    (PMDMeasurmentTypes.ACC, 1): (3, 16),
+}
+
+
+class SampleTimestamper:
+    """
+    Spreads the samples of a PMD frame over the time between the previous frame and this one.
+    The frame timestamp is the sensor time of its last sample.
+    """
+
+    # How far the derived sample interval may stray from the configured one
+    TOLERANCE = 0.5
+
+    def __init__(self, sample_rates: Mapping[PMDMeasurmentTypes, int]):
+        self._sample_rates = sample_rates
+        self._last_timestamp: Mapping[PMDMeasurmentTypes, int] = {}
+
+    def stamp(self, frame: PMDFrame) -> PMDFrame:
+        content = frame.content
+        if not isinstance(content, (PMDCECGData, PMDACCData)) or not len(content):
+            return frame
+
+        count = len(content)
+        nominal = 1e9 / self._sample_rates[frame.measurment_type]
+        interval = nominal
+        last = self._last_timestamp.get(frame.measurment_type)
+        if last is not None:
+            derived = (frame.timestamp - last) / count
+            if abs(derived - nominal) <= nominal * self.TOLERANCE:
+                interval = derived
+        # Otherwise (first frame, gap, reordering) fall back to the configured rate
+        self._last_timestamp[frame.measurment_type] = frame.timestamp
+
+        offsets = np.arange(count - 1, -1, -1, dtype=np.float64) * interval
+        timestamps = frame.timestamp - offsets.astype(np.int64)
+        return replace(frame, content=replace(content, timestamps=timestamps))
+
+
+@dataclass(frozen=True)
+class StreamEvent:
+    measurement: PMDMeasurmentTypes
+    kind: str  # "gap", "overlap" or "duplicate"
+    previous_timestamp: int
+    timestamp: int
+    missing_samples: int
+
+
+class StreamQualityMonitor:
+    """
+    Checks every frame's sensor timestamp against the previous frame of the same type, in O(1).
+    A frame is expected one frame length (samples / rate) after the previous one.
+    """
+
+    # How much longer than expected the step may be before it counts as a gap
+    GAP_FACTOR = 1.5
+
+    def __init__(self, sample_rates: Mapping[PMDMeasurmentTypes, int]):
+        self._sample_rates = sample_rates
+        self._last_timestamp: Mapping[PMDMeasurmentTypes, int] = {}
+        self._counters: Mapping[PMDMeasurmentTypes, Mapping[str, int]] = defaultdict(
+            lambda: {
+                "samples": 0,
+                "missing": 0,
+                "gaps": 0,
+                "overlaps": 0,
+                "duplicates": 0,
+            }
+        )
+
+    def check(self, frame: PMDFrame) -> StreamEvent | None:
+        measurement = frame.measurment_type
+        count = len(frame.content)
+        counters = self._counters[measurement]
+        last = self._last_timestamp.get(measurement)
+        event = None
+
+        if last is not None:
+            interval = 1e9 / self._sample_rates[measurement]
+            step = frame.timestamp - last
+            if step == 0:
+                event = StreamEvent(measurement, "duplicate", last, frame.timestamp, 0)
+                counters["duplicates"] += 1
+                # The same frame twice, nothing new to count
+                return event
+            elif step < 0:
+                event = StreamEvent(measurement, "overlap", last, frame.timestamp, 0)
+                counters["overlaps"] += 1
+            elif step > count * interval * self.GAP_FACTOR:
+                missing = max(0, round(step / interval) - count)
+                event = StreamEvent(
+                    measurement, "gap", last, frame.timestamp, missing
+                )
+                counters["gaps"] += 1
+                counters["missing"] += missing
+
+        self._last_timestamp[measurement] = max(frame.timestamp, last or 0)
+        counters["samples"] += count
+        return event
+
+    def stats(self) -> Mapping[str, Mapping[str, Any]]:
+        stats = {}
+        for measurement, counters in self._counters.items():
+            expected = counters["samples"] + counters["missing"]
+            stats[measurement.name] = dict(
+                counters,
+                loss_pct=round(counters["missing"] / expected * 100, 3)
+                if expected
+                else 0.0,
+            )
+        return stats
+
+
+class ClockMapper:
+    """
+    Maps sensor time to host wall time with a running least squares fit of frame arrival
+    times against frame timestamps. BLE delivery jitter averages out, clock drift is the slope.
+    Mapped times include the mean delivery latency, a constant offset.
+    """
+
+    # Roughly how many of the latest frames the fit is based on
+    WINDOW = 2000
+    # Until the frames span this much sensor time the drift can't be told from jitter
+    MIN_FIT_SECONDS = 30.0
+    MAX_DRIFT_PPM = 1000.0
+    # Arrivals this far off mean the sensor clock was reset, the fit starts over
+    RESET_SECONDS = 2.0
+
+    def __init__(self, wall_offset_ns: int):
+        # time.time_ns() - time.monotonic_ns() of the run
+        self._wall_offset_ns = wall_offset_ns
+        self._decay = 1 - 1 / self.WINDOW
+        self._resets = 0
+        self.reset()
+
+    def reset(self):
+        # Origin of the fit, keeps the sums small enough for float64
+        self._x0: int | None = None
+        self._y0 = 0
+        self._n = 0.0
+        self._sx = 0.0
+        self._sy = 0.0
+        self._sxx = 0.0
+        self._sxy = 0.0
+        self._slope = 1.0
+        self._intercept = 0.0
+        self._residual_sq = 0.0
+
+    def update(self, sensor_ns: int, monotonic_ns: int):
+        host_ns = monotonic_ns + self._wall_offset_ns
+        if self._x0 is None:
+            self._x0, self._y0 = sensor_ns, host_ns
+        x = (sensor_ns - self._x0) / 1e9
+        y = (host_ns - self._y0) / 1e9
+
+        if self._n:
+            residual = y - (self._intercept + self._slope * x)
+            if abs(residual) > self.RESET_SECONDS:
+                self._resets += 1
+                self.reset()
+                self.update(sensor_ns, monotonic_ns)
+                return
+            # Plain mean over the first frames, exponential once the window is full
+            weight = 1 / (self._decay * self._n + 1)
+            self._residual_sq += weight * (residual**2 - self._residual_sq)
+
+        d = self._decay
+        self._n = d * self._n + 1
+        self._sx = d * self._sx + x
+        self._sy = d * self._sy + y
+        self._sxx = d * self._sxx + x * x
+        self._sxy = d * self._sxy + x * y
+
+        slope = 1.0
+        variance = self._n * self._sxx - self._sx**2
+        if x >= self.MIN_FIT_SECONDS and variance > 0:
+            fitted = (self._n * self._sxy - self._sx * self._sy) / variance
+            if abs(fitted - 1) * 1e6 <= self.MAX_DRIFT_PPM:
+                slope = fitted
+        self._slope = slope
+        self._intercept = (self._sy - slope * self._sx) / self._n
+
+    def map(self, sensor_ns: np.ndarray) -> np.ndarray:
+        x = (sensor_ns - self._x0).astype(np.float64)
+        return self._y0 + np.rint(self._intercept * 1e9 + self._slope * x).astype(
+            np.int64
+        )
+
+    def stamp(self, message: PolarSample) -> PolarSample:
+        """
+        Adds the frame to the fit and gives every sample of it a wall time.
+        """
+        self.update(message.sample.timestamp, message.time)
+        return replace(message, host_times=self.map(message.sample.content.timestamps))
+
+    def stats(self) -> Mapping[str, Any]:
+        return {
+            "drift_ppm": round((self._slope - 1) * 1e6, 2),
+            "jitter_ms": round(float(np.sqrt(self._residual_sq)) * 1e3, 3),
+            "resets": self._resets,
+        }
+
+
+def gap_writer_fmt(event: StreamEvent) -> str:
+    return (
+        f"{event.measurement.name},{event.kind},{event.previous_timestamp},"
+        f"{event.timestamp},{event.timestamp - event.previous_timestamp},"
+        f"{event.missing_samples}\n"
+    )
+
+
+def write_quality_summary(path: str, stats: Mapping[str, Any]):
+    with open(path, "w") as fd:
+        json.dump(stats, fd, indent=2)
+
+
+def default_pmd_configuration(
+    measurement_type: PMDMeasurmentTypes, acc_rate: int = 200, acc_range: int = 8
+) -> PMDConfiguration:
+    if measurement_type == PMDMeasurmentTypes.ECG:
+        return PMDConfiguration(
+            {PMDSetting.samplerate: ECG_SAMPLE_RATE, PMDSetting.resolution: 14}
+        )
+    return PMDConfiguration(
+        {
+            PMDSetting.samplerate: acc_rate,
+            PMDSetting.resolution: 16,
+            PMDSetting.range: acc_range,
+        }
+    )
+
+
 def generate_start_message(
     measurement_type: PMDMeasurmentTypes,
     location: PMDSaveLocation,
-    settings: PMDConfiguration,
+    settings: PMDConfiguration | None,
 ) -> bytes:
-    #  0x00, 0x01, 0x82, 0x00, 0x01, 0x01, 0x0E, 0x00
-    base = bytes(
-        [PMDCommands.START_MEASUREMENT, location.as_bit_field() | measurement_type]
-    )
-    if measurement_type == PMDMeasurmentTypes.ECG:
-        return base + bytes([0x00, 0x01, 0x82, 0x00, 0x01, 0x01, 0x0E, 0x00])
-    else:  # For starting ACC measurments
-        return base + bytes(
-            [0x00, 0x01, 0xC8, 0x00, 0x01, 0x01, 0x10, 0x00, 0x02, 0x01, 0x08, 0x00]
+    # ECG at the defaults: 0x00, 0x01, 0x82, 0x00, 0x01, 0x01, 0x0E, 0x00
+    if settings is None:
+        settings = default_pmd_configuration(measurement_type)
+    return (
+        bytes(
+            [PMDCommands.START_MEASUREMENT, location.as_bit_field() | measurement_type]
         )
-    # return
+        + settings.serialize()
+    )
+
+
+def generate_get_settings_message(measurement_type: PMDMeasurmentTypes) -> bytes:
+    return bytes([PMDCommands.GET_SETTINGS, measurement_type])
 
 
 def generate_stop_message(
@@ -216,13 +694,111 @@ def generate_stop_message(
     )
 
 
+@dataclass(frozen=True)
+class HeartRateMeasurement:
+    heart_rate: int
+    # None if the strap doesn't report skin contact
+    contact: bool | None
+    energy_expended: int | None
+    # RR intervals in ms, oldest first
+    rr: List[float]
+
+
+def parse_heart_rate_measurement(data: bytes) -> HeartRateMeasurement | None:
+    # Flags: bit 0 16 bit HR, bits 1-2 contact status, bit 3 energy, bit 4 RR intervals
+    if len(data) < 2:
+        return None
+    flags = data[0]
+    offset = 1
+    if flags & 0x01:
+        heart_rate = int.from_bytes(data[offset : offset + 2], byteorder="little")
+        offset += 2
+    else:
+        heart_rate = data[offset]
+        offset += 1
+
+    contact = bool(flags & 0x02) if flags & 0x04 else None
+
+    energy_expended = None
+    if flags & 0x08:
+        energy_expended = int.from_bytes(data[offset : offset + 2], byteorder="little")
+        offset += 2
+
+    rr = []
+    if flags & 0x10:
+        # Units of 1/1024 s
+        rr = [
+            int.from_bytes(data[i : i + 2], byteorder="little") * 1000 / 1024
+            for i in range(offset, len(data) - 1, 2)
+        ]
+
+    return HeartRateMeasurement(heart_rate, contact, energy_expended, rr)
+
+
 def parse_pmd_cp_reply(data: bytes) -> Any:
     return PMDCPResponse(
         response=int(data[0]),
         op=data[1],
-        measurement=PMDMeasurmentTypes(int(data[2])),
+        measurement=PMDMeasurmentTypes(int(data[2]) & 0x3F),
         error=PMDError(int(data[3])),
         rest=data[4:],
+        more=len(data) > 4 and data[4] != 0,
+        parameters=data[5:],
+    )
+
+
+def decode_int24(data: bytes) -> np.ndarray:
+    # Little-endian signed 24 bit values -> int32, in one pass over the buffer
+    raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+    values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+    # Shift the sign bit into place and back to sign-extend
+    return (values << 8) >> 8
+
+
+def decode_signed(data: bytes, width: int) -> np.ndarray:
+    # Little-endian signed integers of 1-4 bytes each
+    if width == 3:
+        return decode_int24(data)
+    return np.frombuffer(data, dtype=f"<i{width}")
+
+
+def decode_delta_frames(data: bytes, channels: int, resolution: int) -> np.ndarray | None:
+    # Layout: one reference sample (channels * ceil(resolution / 8) bytes), followed by
+    # blocks of [delta size in bits, sample count, bit-packed deltas LSB first]
+    ref_size = channels * ((resolution + 7) // 8)
+    data_len = len(data)
+    if data_len < ref_size or ref_size == 0:
+        return None
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    blocks = [decode_signed(data[:ref_size], ref_size // channels).astype(np.int64)]
+    offset = ref_size
+    while offset + 2 <= data_len:
+        delta_size = data[offset]
+        sample_count = data[offset + 1]
+        offset += 2
+        bit_len = delta_size * sample_count * channels
+        length = (bit_len + 7) // 8
+        if offset + length > data_len:
+            return None
+
+        if delta_size == 0:
+            blocks.append(np.zeros(sample_count * channels, dtype=np.int64))
+        else:
+            bits = np.unpackbits(buffer[offset : offset + length], bitorder="little")
+            bits = bits[:bit_len].reshape(-1, delta_size).astype(np.int64)
+            deltas = bits @ (1 << np.arange(delta_size, dtype=np.int64))
+            # Two's complement: the top bit counts negative
+            deltas -= bits[:, -1] << delta_size
+            blocks.append(deltas)
+        offset += length
+
+    if offset != data_len:
+        return None
+
+    # Every sample is the previous one plus its delta
+    return np.cumsum(np.concatenate(blocks).reshape(-1, channels), axis=0).astype(
+        np.int32
     )
 
 
@@ -233,52 +809,50 @@ def parse_pmd_ecg(data: bytes) -> PMDCECGData | bytes:
         # print("[-] Malformed ECG packet!")
         return data
 
-    parsed_samples = []
-    for i in range(0, data_len, SAMPLE_SIZE):
-        parsed_samples.append(
-            EcgSample(
-                timestamp=0,
-                mv=int.from_bytes(
-                    data[i : i + SAMPLE_SIZE], byteorder="little", signed=True
-                ),
-            )
-        )
-
-    return PMDCECGData(timestamp=0, samples=parsed_samples)
+    return PMDCECGData(timestamp=0, mv=decode_int24(data))
 
 
-def parse_pmd_acc(data: bytes):
-    SAMPLE_SIZE = 2
+def parse_pmd_acc(data: bytes, frame_type: int = 1) -> PMDACCData | bytes:
+    # Frame type 0, 1, 2 carry 8, 16 and 24 bit samples
+    SAMPLE_SIZE = frame_type + 1
     data_len = len(data)
-    if (data_len % (SAMPLE_SIZE * 3)) != 0 or data_len == 0:
+    if SAMPLE_SIZE > 3 or (data_len % (SAMPLE_SIZE * 3)) != 0 or data_len == 0:
         # print("Malformed!")
         return data
 
-    parsed_samples = []
-
-    for i in range(0, data_len, SAMPLE_SIZE * 3):
-        parsed_samples.append(
-            PMDACCSample(
-                x=int.from_bytes(
-                    data[i : i + SAMPLE_SIZE], byteorder="little", signed=True
-                ),
-                y=int.from_bytes(
-                    data[i + SAMPLE_SIZE : i + (SAMPLE_SIZE * 2)],
-                    byteorder="little",
-                    signed=True,
-                ),
-                z=int.from_bytes(
-                    data[i + (SAMPLE_SIZE * 2) : i + (SAMPLE_SIZE * 3)],
-                    byteorder="little",
-                    signed=True,
-                ),
-            )
-        )
+    # Interleaved x/y/z, columns are views into the same buffer
+    xyz = decode_signed(data, SAMPLE_SIZE).reshape(-1, 3)
+    return PMDACCData(x=xyz[:, 0], y=xyz[:, 1], z=xyz[:, 2])
 
-    return PMDACCData(parsed_samples)
+
+def parse_pmd_compressed(
+    measurement_type: PMDMeasurmentTypes, frame_type: int, data: bytes
+) -> PMDCECGData | PMDACCData | bytes:
+    if (measurement_type, frame_type) not in DELTA_FRAME_FORMATS:
+        return data
+
+    channels, resolution = DELTA_FRAME_FORMATS[(measurement_type, frame_type)]
+    samples = decode_delta_frames(data, channels, resolution)
+    if samples is None:
+        return data
+
+    match measurement_type:
+        case PMDMeasurmentTypes.ECG:
+            return PMDCECGData(timestamp=0, mv=samples[:, 0])
+        case PMDMeasurmentTypes.ACC:
+            return PMDACCData(x=samples[:, 0], y=samples[:, 1], z=samples[:, 2])
 
 
 def parse_pmd_content(data: PMDFrame) -> PMDFrame:
+    if data.is_compressed:
+        return PMDFrame(
+            data.measurment_type,
+            data.timestamp,
+            data.frame_type,
+            data.is_compressed,
+            parse_pmd_compressed(data.measurment_type, data.frame_type, data.content),
+        )
+
     match data.measurment_type:
         case PMDMeasurmentTypes.ECG:
             return PMDFrame(
@@ -294,7 +868,7 @@ def parse_pmd_content(data: PMDFrame) -> PMDFrame:
                 data.timestamp,
                 data.frame_type,
                 data.is_compressed,
-                parse_pmd_acc(data.content),
+                parse_pmd_acc(data.content, data.frame_type),
             )
         case _:
             return data
@@ -303,9 +877,14 @@ def parse_pmd_content(data: PMDFrame) -> PMDFrame:
 def parse_pmd_frame(data: bytes) -> PMDFrame | None:
     if len(data) < 11:
         return None
+    try:
+        measurement_type = PMDMeasurmentTypes(int(data[0]) & 0x3F)
+    except ValueError:
+        # Corrupted, or a measurement this doesn't know
+        return None
 
     frame = PMDFrame(
-        measurment_type=PMDMeasurmentTypes(int(data[0]) & 0x3F),
+        measurment_type=measurement_type,
         timestamp=int.from_bytes(data[1:9], byteorder="little", signed=False),
         frame_type=int(data[9] & 0x7F),
         is_compressed=(int(data[9]) & 0x80) > 0,
@@ -315,167 +894,1068 @@ def parse_pmd_frame(data: bytes) -> PMDFrame | None:
     return parse_pmd_content(frame)
 
 
-async def pmd_message_handler(ctx: PolarContext, data: bytes):
+async def pmd_message_handler(ctx: PolarContext, data: bytes, device: str = ""):
     frame = parse_pmd_frame(data)
     if not frame:
-        await ctx.print_log("Invalid frame!")
+        await ctx.print_log("Invalid frame!", device)
         return
-    await ctx.put_sample(
-        PolarSample(time=datetime.datetime.now(tz=pytz.utc), sample=frame)
-    )
+    ctx.offer_sample(PolarSample(time=time.monotonic_ns(), sample=frame, device=device))
 
 
-async def pmd_control_handler(_, data: bytes):
-    parse_pmd_cp_reply(data)
+class PMDControlPoint:
+    """
+    Sends control point commands to one strap and waits for the matching, successful reply.
+    """
 
+    REPLY_TIMEOUT = 5
 
-async def stdout_writer(ctx: PolarContext):
+    def __init__(self, client: BleakClient):
+        self._client = client
+        self._replies = asyncio.Queue()
+
+    async def on_reply(self, _, data: bytes):
+        if len(data) < 4:
+            return
+        try:
+            reply = parse_pmd_cp_reply(data)
+        except ValueError:
+            # A measurement or error code this doesn't know. Still the reply, the request
+            # has to fail with it rather than time out.
+            reply = PMDCPResponse(
+                response=int(data[0]),
+                op=data[1],
+                measurement=int(data[2]) & 0x3F,
+                error=int(data[3]),
+                rest=bytes(data[4:]),
+            )
+        await self._replies.put(reply)
+
+    async def request(
+        self, message: bytes, accept: Set[PMDError] = frozenset()
+    ) -> PMDCPResponse:
+        # Anything left over belongs to an earlier command
+        while not self._replies.empty():
+            self._replies.get_nowait()
+
+        await self._client.write_gatt_char(SERVICE_CONTROL_PORT, message, response=True)
+        while True:
+            reply = await asyncio.wait_for(self._replies.get(), self.REPLY_TIMEOUT)
+            # A late reply to an earlier command for another measurement isn't this one's
+            if reply.op == message[0] and reply.measurement == message[1] & 0x3F:
+                break
+
+        if reply.error != PMDError.success and reply.error not in accept:
+            raise PMDControlPointError(reply)
+
+        # Long replies are split, gather all their parameters
+        parameters = reply.parameters
+        while reply.more:
+            reply = await asyncio.wait_for(self._replies.get(), self.REPLY_TIMEOUT)
+            parameters += reply.parameters
+        return replace(reply, parameters=parameters)
+
+    async def get_settings(
+        self, measurement_type: PMDMeasurmentTypes
+    ) -> Mapping[PMDSetting, List[int]]:
+        reply = await self.request(generate_get_settings_message(measurement_type))
+        return parse_pmd_settings(reply.parameters)
+
+    async def start(
+        self,
+        measurement_type: PMDMeasurmentTypes,
+        settings: PMDConfiguration,
+        location: PMDSaveLocation = PMDSaveLocation.ONLINE,
+    ) -> PMDCPResponse:
+        # Still streaming from before a reconnect is fine
+        return await self.request(
+            generate_start_message(measurement_type, location, settings),
+            accept={PMDError.already_in_state},
+        )
+
+    async def stop(
+        self,
+        measurement_type: PMDMeasurmentTypes,
+        location: PMDSaveLocation = PMDSaveLocation.ONLINE,
+    ) -> PMDCPResponse:
+        return await self.request(
+            generate_stop_message(measurement_type, location),
+            accept={PMDError.already_in_state},
+        )
+
+
+async def stdout_writer(ctx: PolarContext, channel: OutputChannel):
+    # Whatever queued up while the last batch was written goes out in one write
     while True:
-        if msg := await ctx.get_next_print():
-            sys.stdout.write(msg + "\n")
-            sys.stdout.flush()
-        ctx.did_print()
+        messages = await ctx.get_next_prints(MAX_PRINT_BATCH)
+        await channel.write(messages)
+        ctx.did_print(len(messages))
 
 
-def sample_writer_fmt(message: PolarSample) -> str:
-    formatted_str = ""
+async def heartbeat_writer(ctx: PolarContext, writer: ThreadedWriter):
+    while True:
+        heartbeat = heartbeat_message(
+            "polar",
+            {
+                "samples": ctx.samples_handled,
+                "samples_dropped": ctx.samples_dropped(),
+                "writer": writer.backlog(),
+            },
+        )
+        await ctx.print_preformatted(heartbeat.message, heartbeat.channel)
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def sample_writer_fmt(message: PolarSample, time_format: str = "iso") -> str:
+    content = message.sample.content
+    # Host times of the whole frame are formatted in one go
+    if time_format == "iso":
+        host_times = format_host_times(message.host_times).tolist()
+    else:
+        host_times = message.host_times.tolist()
     match message.sample.measurment_type:
         case PMDMeasurmentTypes.ECG:
-            for sample in message.sample.content.samples:
-                formatted_str += f"{message.time.isoformat()},{message.sample.timestamp},{sample.mv}\n"
+            rows = [
+                f"{host},{ts},{mv}\n"
+                for host, ts, mv in zip(
+                    host_times, content.timestamps.tolist(), content.mv.tolist()
+                )
+            ]
         case PMDMeasurmentTypes.ACC:
-            for sample in message.sample.content.samples:
-                formatted_str += f"{message.time.isoformat()},{message.sample.timestamp},{sample.x},{sample.y},{sample.z}\n"
+            rows = [
+                f"{host},{ts},{x},{y},{z}\n"
+                for host, ts, x, y, z in zip(
+                    host_times,
+                    content.timestamps.tolist(),
+                    content.x.tolist(),
+                    content.y.tolist(),
+                    content.z.tolist(),
+                )
+            ]
+        case _:
+            return ""
 
-    return formatted_str
+    return "".join(rows)
 
 
-async def sample_writer_caller(ctx: PolarContext, message: PolarSample):
+def sample_writer_columns(message: PolarSample) -> Mapping[str, np.ndarray]:
+    content = message.sample.content
+    columns = {
+        "host_time": message.host_times,
+        "sensor_time": content.timestamps,
+    }
     match message.sample.measurment_type:
         case PMDMeasurmentTypes.ECG:
-            await ctx.print_preformatted(
-                json.dumps(
-                    {
-                        "component": "polar",
-                        "data": {"ecg": f"{message.sample.content.samples[0].mv} mV"},
-                    }
-                )
-            )
+            columns["mv"] = content.mv
         case PMDMeasurmentTypes.ACC:
-            await ctx.print_preformatted(
-                json.dumps(
-                    {
-                        "component": "polar",
-                        "data": {
-                            "acc": f"{message.sample.content.samples[0].x} mG | {message.sample.content.samples[0].y} mG | {message.sample.content.samples[0].z} mG"
-                        },
-                    }
-                )
+            columns["x"] = content.x
+            columns["y"] = content.y
+            columns["z"] = content.z
+
+    return columns
+
+
+# Preview name and channels of every measurement that gets a live preview
+PREVIEW_CHANNELS: Mapping[PMDMeasurmentTypes, tuple] = {
+    PMDMeasurmentTypes.ECG: ("ecg", ["mv"]),
+    PMDMeasurmentTypes.ACC: ("acc", ["x", "y", "z"]),
+}
+
+
+class PreviewDecimator:
+    """
+    Reduces the full-rate channels to min/max/mean buckets at the preview rate.
+    Samples that don't fill a whole bucket yet are carried over to the next flush.
+    """
+
+    def __init__(
+        self, sample_rates: Mapping[PMDMeasurmentTypes, int], preview_rate: float
+    ):
+        self._preview_rate = preview_rate
+        self._bucket_sizes = {
+            measurement: max(1, round(rate / preview_rate))
+            for measurement, rate in sample_rates.items()
+            if measurement in PREVIEW_CHANNELS
+        }
+        self._pending: Mapping[PMDMeasurmentTypes, Mapping[str, List[np.ndarray]]] = (
+            defaultdict(lambda: defaultdict(list))
+        )
+
+    def add(self, frame: PMDFrame):
+        if frame.measurment_type not in self._bucket_sizes:
+            return
+
+        pending = self._pending[frame.measurment_type]
+        pending["timestamps"].append(frame.content.timestamps)
+        for channel in PREVIEW_CHANNELS[frame.measurment_type][1]:
+            pending[channel].append(getattr(frame.content, channel))
+
+    def flush(self) -> Mapping[str, Any]:
+        preview = {}
+        for measurement, pending in self._pending.items():
+            if not pending["timestamps"]:
+                continue
+
+            name, channels = PREVIEW_CHANNELS[measurement]
+            size = self._bucket_sizes[measurement]
+            timestamps = np.concatenate(pending["timestamps"])
+            usable = len(timestamps) // size * size
+            if not usable:
+                pending["timestamps"] = [timestamps]
+                continue
+
+            entry = {"t0": int(timestamps[0]), "buckets": usable // size}
+            pending["timestamps"] = [timestamps[usable:]]
+            for channel in channels:
+                values = np.concatenate(pending[channel])
+                buckets = values[:usable].reshape(-1, size)
+                entry[channel] = {
+                    "min": buckets.min(axis=1).tolist(),
+                    "max": buckets.max(axis=1).tolist(),
+                    "mean": np.rint(buckets.mean(axis=1)).astype(np.int32).tolist(),
+                }
+                pending[channel] = [values[usable:]]
+            preview[name] = entry
+
+        if preview:
+            preview["rate"] = self._preview_rate
+        return preview
+
+
+def open_sample_outputs(
+    project: str,
+    sample_rates: Mapping[PMDMeasurmentTypes, int],
+    output_format: str,
+    buffer_size: int = DEFAULT_WRITE_BUFFER,
+    flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+) -> Mapping[PMDMeasurmentTypes, Any]:
+    outputs = {}
+    for name, value in [
+        ("ecg", PMDMeasurmentTypes.ECG),
+        ("acc", PMDMeasurmentTypes.ACC),
+    ]:
+        if output_format == "columnar":
+            outputs[value] = ColumnarChannelWriter(
+                f"{project}{name}",
+                CHANNEL_COLUMNS[name],
+                {"sample_rate": sample_rates[value]},
+                buffer_size,
+                flush_interval,
+            )
+        else:
+            outputs[value] = WriteBehindBuffer(
+                open(f"{project}{name}.csv", "w"), buffer_size, flush_interval
             )
 
+    return outputs
+
+
+def write_sample_output(
+    output: Any, message: PolarSample, output_format: str, time_format: str = "iso"
+):
+    if output_format == "columnar":
+        output.append(**sample_writer_columns(message))
+    else:
+        output.write(sample_writer_fmt(message, time_format))
+
+
+def format_metric(value: float | None) -> str:
+    return "" if value is None else f"{value:.1f}"
+
+
+def hrv_metrics(hrv: RollingHRV) -> Mapping[str, float | None]:
+    return {
+        "hr": hrv.hr(),
+        "rmssd": hrv.rmssd(),
+        "sdnn": hrv.sdnn(),
+    }
+
+
+def format_host_time(host_ns: int, time_format: str = "iso") -> str:
+    if time_format == "iso":
+        return str(format_host_times(np.array([host_ns], dtype=np.int64))[0])
+    return str(host_ns)
+
+
+def rr_writer_fmt(
+    host_ns: int, timestamp: int, rr: float, hrv: RollingHRV, time_format: str = "iso"
+) -> str:
+    return ",".join(
+        [
+            format_host_time(host_ns, time_format),
+            str(timestamp),
+            format_metric(rr),
+            format_metric(hrv.hr()),
+            format_metric(hrv.rmssd()),
+            format_metric(hrv.sdnn()),
+        ]
+    ) + "\n"
+
+
+async def print_write_stats(ctx: PolarContext, writer: ThreadedWriter):
+    await ctx.print_preformatted(
+        json.dumps(
+            {
+                "component": "polar",
+                "data": {
+                    "write_stats": writer.pop_stats(),
+                    "queue_stats": ctx.queue_stats(),
+                },
+            }
+        ),
+        "stats",
+    )
+
 
-async def sample_writer(ctx: PolarContext):
-    SAMPLE_FREQ = 10
-    elapsed_per_feature: Mapping[PMDMeasurmentTypes, int] = defaultdict(int)
-    fd_per_feature: Mapping[PMDMeasurmentTypes, Any] = defaultdict(
-        lambda: int(SAMPLE_FREQ)
+@dataclass
+class PolarOptions:
+    """Tunables of a collector run, mirrors the command line"""
+
+    acc_rate: int = 200
+    acc_range: int = 8
+    output_format: str = "csv"
+    write_buffer: int = DEFAULT_WRITE_BUFFER
+    flush_interval: float = DEFAULT_FLUSH_INTERVAL
+    sample_queue_size: int = DEFAULT_SAMPLE_QUEUE_SIZE
+    # Live notifications can't wait, a full sample queue drops the newest or the oldest
+    # frame and counts it in stats and heartbeats. The offline download waits instead.
+    sample_queue_policy: str = POLICY_DROP_NEWEST
+    print_queue_size: int = DEFAULT_PRINT_QUEUE_SIZE
+    preview_rate: float = DEFAULT_PREVIEW_RATE
+    preview_interval: float = DEFAULT_PREVIEW_INTERVAL
+    hrv_window: int = DEFAULT_HRV_WINDOW
+    mode: str = "raw"
+    time_format: str = "iso"
+    transport: str = "ble"
+    # Previews in the compact IPC encoding, smaller on the pipe, decoded by the orchestrator
+    ipc_compact: bool = False
+    # Only used by the simulated transport
+    sim_speed: float = 1.0
+    sim_jitter: float = 0.0
+    sim_drop: float = 0.0
+    sim_disconnect: float = 0.0
+    sim_compressed: bool = False
+
+
+def collector_streams(mode: str) -> Set[str]:
+    return set(mode.split("+"))
+
+
+def hr_writer_fmt(
+    host_ns: int, measurement: HeartRateMeasurement, time_format: str = "iso"
+) -> str:
+    # One row per RR interval, or a single one without if the notification carried none
+    host_time = format_host_time(host_ns, time_format)
+    return "".join(
+        f"{host_time},{measurement.heart_rate},{format_metric(rr)}\n"
+        for rr in measurement.rr or [None]
     )
 
-    try:
-        for name, value in [
-            ("ecg", PMDMeasurmentTypes.ECG),
-            ("acc", PMDMeasurmentTypes.ACC),
-        ]:
-            fd_per_feature[value] = open(f"{ctx.get_project()}{name}.csv", "w")
 
+class HeartRateRecorder:
+    """
+    Records the strap's own heart rate and RR intervals from the Heart Rate Service.
+    About one notification a second, so they are handled straight from the callback.
+    """
+
+    def __init__(
+        self, device: str, prefix: str, options: PolarOptions, writer: ThreadedWriter
+    ):
+        self.device = device
+        self._writer = writer
+        self._output = writer.register(
+            WriteBehindBuffer(
+                open(f"{prefix}hr.csv", "w"),
+                options.write_buffer,
+                options.flush_interval,
+            )
+        )
+        self._wall_offset_ns = time.time_ns() - time.monotonic_ns()
+        self._time_format = options.time_format
+        self.hrv = RollingHRV(options.hrv_window)
+
+    async def on_notify(self, ctx: PolarContext, data: bytes):
+        host_ns = time.monotonic_ns() + self._wall_offset_ns
+        measurement = parse_heart_rate_measurement(data)
+        if measurement is None:
+            await ctx.print_log("Invalid heart rate measurement!", self.device)
+            return
+
+        # From the notification callback, can't wait for the writer
+        self._writer.try_submit(
+            self._output.write, hr_writer_fmt(host_ns, measurement, self._time_format)
+        )
+        for rr in measurement.rr:
+            self.hrv.add_rr(rr)
+        await ctx.print_preformatted(
+            json.dumps(
+                {
+                    "component": "polar",
+                    "data": {
+                        "device": self.device,
+                        "heart_rate": {
+                            "hr": measurement.heart_rate,
+                            "rr": measurement.rr,
+                            "contact": measurement.contact,
+                            "hrv": hrv_metrics(self.hrv),
+                        },
+                    },
+                }
+            ),
+            "heart_rate",
+            self.device,
+        )
+
+
+def device_prefix(project: str, address: str, devices: int) -> str:
+    # A lone strap keeps the plain file names, several get one set of files each
+    if devices == 1:
+        return project
+    return f"{project}{address.replace(':', '').upper()}_"
+
+
+class DevicePipeline:
+    """
+    Per-strap state of the shared writer: outputs, timestamps, preview and beat detection.
+    """
+
+    def __init__(
+        self,
+        device: str,
+        prefix: str,
+        sample_rates: Mapping[PMDMeasurmentTypes, int],
+        options: PolarOptions,
+        writer: ThreadedWriter,
+    ):
+        self.device = device
+        # Shared with the timestamper and quality monitor, configure() updates it in place
+        self.sample_rates = dict(sample_rates)
+        self.timestamper = SampleTimestamper(self.sample_rates)
+        self.clock = ClockMapper(time.time_ns() - time.monotonic_ns())
+        self.outputs = open_sample_outputs(
+            prefix,
+            sample_rates,
+            options.output_format,
+            options.write_buffer,
+            options.flush_interval,
+        )
+        for output in self.outputs.values():
+            writer.register(output)
+        self.rr_output = writer.register(
+            WriteBehindBuffer(
+                open(f"{prefix}rr.csv", "w"),
+                options.write_buffer,
+                options.flush_interval,
+            )
+        )
+        self.prefix = prefix
+        self.quality = StreamQualityMonitor(self.sample_rates)
+        self.gaps_output = writer.register(
+            WriteBehindBuffer(
+                open(f"{prefix}gaps.csv", "w"),
+                options.write_buffer,
+                options.flush_interval,
+            )
+        )
+        self.decimator = PreviewDecimator(self.sample_rates, options.preview_rate)
+        # Beats are detected as the ECG comes in, so RR/HRV is ready when the session ends
+        self.detector = RPeakDetector(self.sample_rates[PMDMeasurmentTypes.ECG])
+        self.hrv = RollingHRV(options.hrv_window)
+        self.new_beats = False
+        self._preview_rate = options.preview_rate
+        self._writer = writer
+
+    def configure(self, measurement: PMDMeasurmentTypes, settings: PMDConfiguration):
+        """
+        Takes over the sample rate the strap was started with, a substitute if it doesn't
+        offer the requested one.
+        """
+        # Plain ints, the settings can come from polar_offline's copy of this module
+        measurement = PMDMeasurmentTypes(int(measurement))
+        rate = settings.get(PMDSetting.samplerate)
+        if rate is None or self.sample_rates.get(measurement) == rate:
+            return
+        self.sample_rates[measurement] = rate
+        self.decimator = PreviewDecimator(self.sample_rates, self._preview_rate)
+        if measurement == PMDMeasurmentTypes.ECG:
+            self.detector = RPeakDetector(rate)
+        output = self.outputs.get(measurement)
+        if isinstance(output, ColumnarChannelWriter):
+            self._writer.submit(output.update_meta, {"sample_rate": rate})
+
+
+def preview_messages(device: str, preview: Mapping[str, Any]) -> List[Outgoing]:
+    # One message per measurement, so a client can subscribe to e.g. polar.ecg.preview alone
+    return [
+        Outgoing(
+            f"{name}.preview",
+            {
+                "component": "polar",
+                "data": {
+                    "device": device,
+                    "preview": {name: entry, "rate": preview["rate"]},
+                },
+            },
+            device,
+        )
+        for name, entry in preview.items()
+        if name != "rate"
+    ]
+
+
+def waveform_message(device: str, frame: PMDFrame, rate: int) -> Outgoing:
+    # The full-rate samples of one frame, kept out of JSON all the way to the client
+    name, channels = PREVIEW_CHANNELS[frame.measurment_type]
+    content = frame.content
+    return Outgoing(
+        f"{name}.waveform",
+        pack_waveform(
+            device,
+            name,
+            int(content.timestamps[0]),
+            rate,
+            [getattr(content, channel) for channel in channels],
+        ),
+        device,
+    )
+
+
+async def preview_writer(
+    ctx: PolarContext, pipelines: Mapping[str, DevicePipeline], interval: float
+):
+    # One batched message per device and tick, however many frames arrived in between
+    while True:
+        await asyncio.sleep(interval)
+        for device, pipeline in pipelines.items():
+            for outgoing in preview_messages(device, pipeline.decimator.flush()):
+                await ctx.print_preformatted(
+                    outgoing.message, outgoing.channel, outgoing.key
+                )
+
+
+async def sample_writer(
+    ctx: PolarContext,
+    pipelines: Mapping[str, DevicePipeline],
+    writer: ThreadedWriter,
+    sample_rates: Mapping[PMDMeasurmentTypes, int],
+    output_format: str = "csv",
+    time_format: str = "iso",
+    waveform: bool = False,
+):
+    MAX_BATCH = 32
+    STATS_INTERVAL = 5
+    HRV_INTERVAL = 1
+    last_stats = time.monotonic()
+    last_hrv = time.monotonic()
+
+    try:
         while True:
-            if msg := await ctx.wait_for_sample():
-                fd_per_feature[msg.sample.measurment_type].write(sample_writer_fmt(msg))
-                elapsed_per_feature[msg.sample.measurment_type] += 1
-                if elapsed_per_feature[msg.sample.measurment_type] >= SAMPLE_FREQ:
-                    await sample_writer_caller(ctx, msg)
-                    elapsed_per_feature[msg.sample.measurment_type] = 0
-            ctx.did_deal_with_sample()
+            # A stalled card holds the samples back here, in the bounded sample queue,
+            # rather than in the writer's
+            await writer.wait_for_room()
+            # Everything queued up since the last round, from all devices, is handled in one go
+            batch = await ctx.wait_for_samples(MAX_BATCH)
+            for msg in batch:
+                pipeline = pipelines.get(msg.device)
+                if not pipeline or msg.sample.measurment_type not in sample_rates:
+                    continue
+                if isinstance(msg.sample.content, bytes):
+                    await ctx.print_log("Malformed frame content, skipping!", msg.device)
+                    continue
+                if event := pipeline.quality.check(msg.sample):
+                    writer.submit(pipeline.gaps_output.write, gap_writer_fmt(event))
+                    if event.kind == "duplicate":
+                        continue
+                msg.sample = pipeline.timestamper.stamp(msg.sample)
+                msg = pipeline.clock.stamp(msg)
+                writer.submit(
+                    write_sample_output,
+                    pipeline.outputs[msg.sample.measurment_type],
+                    msg,
+                    output_format,
+                    time_format,
+                )
+                pipeline.decimator.add(msg.sample)
+                if waveform and msg.sample.measurment_type in PREVIEW_CHANNELS:
+                    outgoing = waveform_message(
+                        msg.device,
+                        msg.sample,
+                        pipeline.sample_rates[msg.sample.measurment_type],
+                    )
+                    await ctx.print_preformatted(
+                        outgoing.message, outgoing.channel, outgoing.key
+                    )
+                if msg.sample.measurment_type == PMDMeasurmentTypes.ECG:
+                    content = msg.sample.content
+                    hrv = pipeline.hrv
+                    for peak in pipeline.detector.process(
+                        content.mv, content.timestamps
+                    ):
+                        if (rr := hrv.add_peak(peak.timestamp)) is not None:
+                            peak_ns = np.array([peak.timestamp])
+                            host_ns = int(pipeline.clock.map(peak_ns)[0])
+                            writer.submit(
+                                pipeline.rr_output.write,
+                                rr_writer_fmt(
+                                    host_ns, peak.timestamp, rr, hrv, time_format
+                                ),
+                            )
+                            pipeline.new_beats = True
+            ctx.did_deal_with_samples(len(batch))
+
+            if time.monotonic() - last_hrv >= HRV_INTERVAL:
+                for device, pipeline in pipelines.items():
+                    if not pipeline.new_beats:
+                        continue
+                    await ctx.print_preformatted(
+                        json.dumps(
+                            {
+                                "component": "polar",
+                                "data": {
+                                    "device": device,
+                                    "hrv": hrv_metrics(pipeline.hrv),
+                                },
+                            }
+                        ),
+                        "hrv",
+                        device,
+                    )
+                    pipeline.new_beats = False
+                last_hrv = time.monotonic()
+
+            if time.monotonic() - last_stats >= STATS_INTERVAL:
+                await print_write_stats(ctx, writer)
+                for device, pipeline in pipelines.items():
+                    await ctx.print_preformatted(
+                        json.dumps(
+                            {
+                                "component": "polar",
+                                "data": {
+                                    "device": device,
+                                    "quality": pipeline.quality.stats(),
+                                    "clock": pipeline.clock.stats(),
+                                },
+                            }
+                        ),
+                        "quality",
+                        device,
+                    )
+                last_stats = time.monotonic()
 
     finally:
-        for v in fd_per_feature.values():
-            v.flush()
-            v.close()
+        for pipeline in pipelines.values():
+            writer.submit(
+                write_quality_summary,
+                f"{pipeline.prefix}gaps_summary.json",
+                pipeline.quality.stats(),
+            )
+        # Drains pending writes, then flushes and closes every output
+        writer.close()
 
 
-async def main(address, project):
-    ctx = PolarContext(project)
-    loop = asyncio.get_running_loop()
-    loop.add_signal_handler(signal.SIGINT, ctx.shutdown)
-    loop.add_signal_handler(signal.SIGTERM, ctx.shutdown)
+class BleakTransport:
+    """
+    Finds and connects to real straps. polar_sim.SimulatedTransport provides the same calls.
+    """
 
-    write_task = asyncio.create_task(stdout_writer(ctx))
-    sample_task = asyncio.create_task(sample_writer(ctx))
-    await ctx.print_log(f"Connecting to {address}")
+    async def find_device(self, address: str, timeout: float) -> Any:
+        return await BleakScanner.find_device_by_address(address, timeout=timeout)
 
-    async def pmd_message_handler_wrapper(_, data: bytes):
-        return await pmd_message_handler(ctx, data)
+    def client(self, device: Any, disconnected_callback, timeout: float) -> Any:
+        return BleakClient(
+            device, disconnected_callback=disconnected_callback, timeout=timeout
+        )
 
-    running = True
-    while running and not ctx.did_shutdown():
+
+def open_transport(options: PolarOptions) -> Any:
+    if options.transport == "sim":
+        # Imported here, polar_sim builds on this module
+        from polar_sim import SimulatedTransport
+
+        return SimulatedTransport(options)
+    return BleakTransport()
+
+
+# Reconnect tuning: a cached device is connected to directly, scanning only happens after that
+# fails, with jittered exponential backoff between the failed attempts
+DIRECT_CONNECT_TIMEOUT = 5.0
+SCAN_TIMEOUT = 10.0
+RECONNECT_BACKOFF_MIN = 0.5
+RECONNECT_BACKOFF_MAX = 30.0
+
+
+def reconnect_delay(failures: int) -> float:
+    delay = min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_MIN * 2 ** (failures - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+
+async def start_streams(
+    ctx: PolarContext,
+    control: PMDControlPoint,
+    address: str,
+    options: PolarOptions,
+    location: PMDSaveLocation = PMDSaveLocation.ONLINE,
+    on_configured: Callable[[PMDMeasurmentTypes, PMDConfiguration], None] | None = None,
+    skip_refused: bool = False,
+) -> List[PMDMeasurmentTypes]:
+    """
+    Starts ECG and ACC with the settings the strap offers closest to the options. on_configured
+    gets the settings each measurement was started with. A measurement the strap refuses
+    raises, unless skip_refused, then it is logged and left out. Returns the ones started.
+    """
+    started = []
+    for measurement in STREAMED_MEASUREMENTS:
+        try:
+            available = await control.get_settings(measurement)
+            settings, warnings = choose_pmd_configuration(
+                default_pmd_configuration(measurement, options.acc_rate, options.acc_range),
+                available,
+            )
+            for warning in warnings:
+                await ctx.print_log(f"[!] {measurement.name}: {warning}", address)
+            # Raises, and so reconnects, if the strap refuses to start
+            await control.start(measurement, settings, location)
+        except PMDControlPointError as e:
+            if not skip_refused:
+                raise
+            await ctx.print_log(f"[!] {measurement.name} refused, skipped: {e}", address)
+            continue
+        if on_configured is not None:
+            on_configured(measurement, settings)
+        started.append(measurement)
+        await ctx.print_log(
+            f"[+] Started {measurement.name} {location.name.lower()} ({settings})", address
+        )
+    return started
+
+
+async def device_handler(
+    ctx: PolarContext,
+    address: str,
+    options: PolarOptions,
+    on_notify,
+    transport: Any,
+    on_heart_rate=None,
+    on_configured=None,
+):
+    """
+    Keeps one strap connected and streaming until shutdown. Runs alongside the other devices.
+    PMD streams run if on_notify is set, Heart Rate Service notifications if on_heart_rate is.
+    on_configured is passed on to start_streams.
+    """
+    device = None
+    failures = 0
+    reconnects = 0
+    # Set once a running stream is lost, the gap lasts until streaming again
+    lost_at = None
+
+    while not ctx.did_shutdown():
+        if failures:
+            # Sleeps, unless a shutdown comes in first
+            try:
+                await asyncio.wait_for(ctx.wait_for_shutdown(), reconnect_delay(failures))
+                break
+            except asyncio.TimeoutError:
+                pass
+
+        disconnected = asyncio.Event()
+        streaming = False
         try:
-            device = await BleakScanner.find_device_by_address(address)
-            async with BleakClient(device) as client:
-                await ctx.print_log("[+] Connected!")
+            if device is None:
+                device = await transport.find_device(address, SCAN_TIMEOUT)
+                if device is None:
+                    raise ConnectionError(f"{address} not found")
+
+            async with transport.client(
+                device, lambda _: disconnected.set(), DIRECT_CONNECT_TIMEOUT
+            ) as client:
+                await ctx.print_log("[+] Connected!", address)
+                control = PMDControlPoint(client)
                 # This will automatically stop on disconnect
-                await client.start_notify(
-                    SERVICE_NOTIFY_PORT, pmd_message_handler_wrapper
+                if on_notify is not None:
+                    await client.start_notify(SERVICE_NOTIFY_PORT, on_notify)
+                    await client.start_notify(SERVICE_CONTROL_PORT, control.on_reply)
+                    await start_streams(
+                        ctx, control, address, options, on_configured=on_configured
+                    )
+                if on_heart_rate is not None:
+                    await client.start_notify(HEART_RATE_MEASUREMENT, on_heart_rate)
+                    await ctx.print_log("[+] Started heart rate notifications", address)
+                streaming = True
+                failures = 0
+
+                if lost_at is not None:
+                    reconnects += 1
+                    gap = time.monotonic() - lost_at
+                    lost_at = None
+                    await ctx.print_log(f"[+] Reconnected after {gap:.2f}s", address)
+                    await ctx.print_preformatted(
+                        json.dumps(
+                            {
+                                "component": "polar",
+                                "data": {
+                                    "device": address,
+                                    "reconnect": {
+                                        "gap_s": round(gap, 3),
+                                        "count": reconnects,
+                                    },
+                                },
+                            }
+                        ),
+                        "reconnect",
+                        address,
+                    )
+
+                shutdown_wait = asyncio.create_task(ctx.wait_for_shutdown())
+                disconnect_wait = asyncio.create_task(disconnected.wait())
+                await asyncio.wait(
+                    [shutdown_wait, disconnect_wait],
+                    return_when=asyncio.FIRST_COMPLETED,
                 )
-                await client.start_notify(SERVICE_CONTROL_PORT, pmd_control_handler)
-
-                await client.write_gatt_char(
-                    SERVICE_CONTROL_PORT,
-                    generate_start_message(
-                        PMDMeasurmentTypes.ECG, PMDSaveLocation.ONLINE, None
-                    ),
-                    response=True,
+                shutdown_wait.cancel()
+                disconnect_wait.cancel()
+
+                if not ctx.did_shutdown():
+                    lost_at = time.monotonic()
+                    await ctx.print_log("[-] Connection lost, reconnecting...", address)
+                    continue
+
+                await ctx.print_log("[+] Shutting down...", address)
+                if on_notify is not None:
+                    for measurement in STREAMED_MEASUREMENTS:
+                        try:
+                            await control.stop(measurement)
+                        except (PMDControlPointError, asyncio.TimeoutError) as e:
+                            await ctx.print_log(repr(e), address)
+                    await client.stop_notify(SERVICE_NOTIFY_PORT)
+                    await client.stop_notify(SERVICE_CONTROL_PORT)
+                if on_heart_rate is not None:
+                    await client.stop_notify(HEART_RATE_MEASUREMENT)
+                # Disconnect will happen automatically after exit from the with block
+        except Exception as e:
+            failures += 1
+            if streaming and lost_at is None:
+                lost_at = time.monotonic()
+            # The direct connect to the cached handle failed, scan from now on
+            device = None
+            await ctx.print_log(repr(e), address)
+            await ctx.print_log("[-] Connection failed, retrying...", address)
+
+
+async def main(
+    addresses: List[str],
+    project,
+    options: PolarOptions = PolarOptions(),
+    transport: Any = None,
+) -> PolarContext:
+    ctx = PolarContext(
+        project,
+        options.sample_queue_size,
+        options.sample_queue_policy,
+        options.print_queue_size,
+    )
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, ctx.shutdown)
+    loop.add_signal_handler(signal.SIGTERM, ctx.shutdown)
+
+    sample_rates = {
+        PMDMeasurmentTypes.ECG: ECG_SAMPLE_RATE,
+        PMDMeasurmentTypes.ACC: options.acc_rate,
+    }
+    channel = OutputChannel("polar", options.ipc_compact)
+    await channel.open()
+    write_task = asyncio.create_task(stdout_writer(ctx, channel))
+    # One writer thread and one parsing pipeline, however many straps are connected
+    writer = ThreadedWriter("polar-writer")
+    tasks = [write_task, asyncio.create_task(heartbeat_writer(ctx, writer))]
+    streams = collector_streams(options.mode)
+    handlers = {address: None for address in addresses}
+    heart_rate_handlers = {address: None for address in addresses}
+    # The strap may not offer the requested rates, the pipelines follow what it started with
+    configured_handlers = {address: None for address in addresses}
+
+    if "offline" in streams and options.output_format == "journal":
+        await ctx.print_log("[!] Offline recordings are written as csv, not journal")
+        options = replace(options, output_format="csv")
+
+    if "waveform" in streams and options.output_format == "journal":
+        await ctx.print_log("[!] Frames aren't decoded in journal format, no waveforms")
+
+    if "raw" in streams and options.output_format == "journal":
+        # Frames are only recorded here, decoding happens offline via pmd_journal.py
+        for address in addresses:
+            journal = writer.register(
+                JournalWriter(
+                    f"{device_prefix(project, address, len(addresses))}{JOURNAL_NAME}",
+                    {"sample_rates": {k.name: v for k, v in sample_rates.items()}},
                 )
-                await client.write_gatt_char(
-                    SERVICE_CONTROL_PORT,
-                    generate_start_message(
-                        PMDMeasurmentTypes.ACC, PMDSaveLocation.ONLINE, None
-                    ),
-                    response=True,
+            )
+
+            def pmd_journal_handler(_, data: bytes, journal=journal):
+                writer.try_submit(journal.append, time.monotonic_ns(), data)
+
+            handlers[address] = pmd_journal_handler
+    elif streams & {"raw", "offline"}:
+        pipelines = {
+            address: DevicePipeline(
+                address,
+                device_prefix(project, address, len(addresses)),
+                sample_rates,
+                options,
+                writer,
+            )
+            for address in addresses
+        }
+        configured_handlers = {
+            address: pipeline.configure for address, pipeline in pipelines.items()
+        }
+        tasks.append(
+            asyncio.create_task(
+                sample_writer(
+                    ctx,
+                    pipelines,
+                    writer,
+                    sample_rates,
+                    options.output_format,
+                    options.time_format,
+                    "waveform" in streams,
                 )
+            )
+        )
 
-                await ctx.wait_for_shutdown()
+    if "raw" in streams and options.output_format != "journal":
+        tasks.append(
+            asyncio.create_task(
+                preview_writer(ctx, pipelines, options.preview_interval)
+            )
+        )
+        for address in addresses:
 
-                await ctx.print_log("[+] Shutting down...")
-                running = False
-                await client.write_gatt_char(
-                    SERVICE_CONTROL_PORT,
-                    generate_stop_message(
-                        PMDMeasurmentTypes.ECG, PMDSaveLocation.ONLINE
-                    ),
-                    response=True,
+            async def pmd_message_handler_wrapper(_, data: bytes, address=address):
+                return await pmd_message_handler(ctx, data, address)
+
+            handlers[address] = pmd_message_handler_wrapper
+
+    if "offline" in streams:
+        # Imported here, polar_offline builds on this module
+        from polar_offline import offline_device_handler
+
+        for address in addresses:
+
+            async def offline_frame_handler(data: bytes, arrived: int, address=address):
+                # Parsed here, polar_offline's copy of this module has its own classes
+                # when this one runs as __main__
+                if frame := parse_pmd_frame(data):
+                    await ctx.put_sample(
+                        PolarSample(time=arrived, sample=frame, device=address)
+                    )
+
+            handlers[address] = offline_frame_handler
+
+    if "hr" in streams:
+        for address in addresses:
+            recorder = HeartRateRecorder(
+                address,
+                device_prefix(project, address, len(addresses)),
+                options,
+                writer,
+            )
+
+            async def heart_rate_handler(_, data: bytes, recorder=recorder):
+                await recorder.on_notify(ctx, data)
+
+            heart_rate_handlers[address] = heart_rate_handler
+
+    if transport is None:
+        transport = open_transport(options)
+    for address in addresses:
+        await ctx.print_log(f"Connecting to {address}", address)
+
+    try:
+        await asyncio.gather(
+            *(
+                offline_device_handler(
+                    ctx,
+                    address,
+                    options,
+                    transport,
+                    handlers[address],
+                    configured_handlers[address],
                 )
-                await client.write_gatt_char(
-                    SERVICE_CONTROL_PORT,
-                    generate_stop_message(
-                        PMDMeasurmentTypes.ACC, PMDSaveLocation.ONLINE
-                    ),
-                    response=True,
+                if "offline" in streams
+                else device_handler(
+                    ctx,
+                    address,
+                    options,
+                    handlers[address],
+                    transport,
+                    heart_rate_handlers[address],
+                    configured_handlers[address],
                 )
-                await client.stop_notify(SERVICE_NOTIFY_PORT)
-                await client.stop_notify(SERVICE_CONTROL_PORT)
-
-                await write_task.cancel()
-                await sample_task.cancel()
-                # Disconnect will happen automatically after exit from the with block
-        except Exception as e:
-            await ctx.print_log(repr(e))
-            await ctx.print_log("[-] Connection failed, retrying...")
+                for address in addresses
+            )
+        )
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        channel.close()
+        # Otherwise sample_writer closes it once the last samples are written
+        if not streams & {"raw", "offline"} or options.output_format == "journal":
+            writer.close()
+    # For its counters
+    return ctx
+
+
+def str_to_bool(value: str) -> bool:
+    # The orchestrator passes every setting as --key=value
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off", ""):
+        return False
+    raise argparse.ArgumentTypeError(f"Not a boolean: {value}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
+    # One or more straps, comma separated
     parser.add_argument("--mac", required=True)
     parser.add_argument("--project", required=True)
+    parser.add_argument("--acc_rate", type=int, default=200, choices=ACC_SAMPLE_RATES)
+    parser.add_argument("--acc_range", type=int, default=8, choices=ACC_RANGES)
+    parser.add_argument(
+        "--format", dest="output_format", default="csv", choices=OUTPUT_FORMATS
+    )
+    parser.add_argument("--write_buffer", type=int, default=DEFAULT_WRITE_BUFFER)
+    parser.add_argument("--flush_interval", type=float, default=DEFAULT_FLUSH_INTERVAL)
+    parser.add_argument(
+        "--sample_queue_size", type=int, default=DEFAULT_SAMPLE_QUEUE_SIZE
+    )
+    parser.add_argument(
+        "--sample_queue_policy", default=POLICY_DROP_NEWEST, choices=DROP_POLICIES
+    )
+    parser.add_argument("--print_queue_size", type=int, default=DEFAULT_PRINT_QUEUE_SIZE)
+    parser.add_argument("--preview_rate", type=float, default=DEFAULT_PREVIEW_RATE)
+    parser.add_argument(
+        "--preview_interval", type=float, default=DEFAULT_PREVIEW_INTERVAL
+    )
+    parser.add_argument("--hrv_window", type=int, default=DEFAULT_HRV_WINDOW)
+    parser.add_argument("--mode", default="raw", choices=COLLECTOR_MODES)
+    parser.add_argument("--time_format", default="iso", choices=TIME_FORMATS)
+    parser.add_argument("--transport", default="ble", choices=TRANSPORTS)
+    parser.add_argument(
+        "--ipc_compact", type=str_to_bool, nargs="?", const=True, default=False
+    )
+    # Simulated straps: playback speed (0 = as fast as possible), delivery jitter in s,
+    # fraction of frames dropped, mean seconds between disconnects (0 = never)
+    parser.add_argument("--sim_speed", type=float, default=1.0)
+    parser.add_argument("--sim_jitter", type=float, default=0.0)
+    parser.add_argument("--sim_drop", type=float, default=0.0)
+    parser.add_argument("--sim_disconnect", type=float, default=0.0)
+    parser.add_argument(
+        "--sim_compressed", type=str_to_bool, nargs="?", const=True, default=False
+    )
     args, _ = parser.parse_known_args()
 
-    asyncio.run(main(args.mac, args.project))
+    options = PolarOptions(**{f.name: getattr(args, f.name) for f in fields(PolarOptions)})
+    addresses = [mac.strip() for mac in args.mac.split(",") if mac.strip()]
+    asyncio.run(main(addresses, args.project, options))
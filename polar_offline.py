@@ -0,0 +1,676 @@
+#!/usr/bin/env python3
+
+# Offline recording: ECG/ACC are recorded on the strap itself, so no BLE link is needed while
+# riding. When the session stops, the recordings are downloaded over the Polar file transfer
+# service (PSFTP) and decoded into the usual project files.
+# PSFTP requests are RFC60 messages (uint16 header length, protobuf PbPFtpOperation) split into
+# RFC76 frames: one header byte (bit 0 continuation, bits 1-2 status, bits 4-7 sequence).
+# Queries (e.g. SET_LOCAL_TIME) use the same header with bit 15 set and the query id instead
+# of the length, followed by the parameters.
+# Recording files are read as a sequence of uint16 length-prefixed PMD data frames. That layout
+# is this project's assumption and hasn't been checked against a real H10 recording or the
+# Polar SDK's offline recording parser (which expects a header with start time and settings),
+# polar_sim.py writes the same layout, so the simulator can't confirm it either. Every frame is
+# therefore validated, a file that doesn't match fails loudly instead of decoding garbage.
+# Until it has been checked on a strap, the interface doesn't offer this mode, it is only
+# reachable with --mode=offline.
+# Host times are the strap's clock, which is set (UTC) before every recording starts.
+# Used by polar_iface.py --mode=offline.
+
+import asyncio
+import calendar
+import json
+import time
+from typing import Any, Awaitable, Callable, Iterator, List, Mapping, Tuple
+
+from polar_iface import (
+    DIRECT_CONNECT_TIMEOUT,
+    SCAN_TIMEOUT,
+    SENSOR_EPOCH_NS,
+    SERVICE_CONTROL_PORT,
+    PMDControlPoint,
+    PMDControlPointError,
+    PMDMeasurmentTypes,
+    PMDSaveLocation,
+    PolarContext,
+    PolarOptions,
+    reconnect_delay,
+    start_streams,
+)
+
+PSFTP_SERVICE = "0000feee-0000-1000-8000-00805f9b34fb"
+PSFTP_MTU = "fb005c51-02e7-f387-1cad-8acd2d8df0c8"
+
+PSFTP_GET = 0
+PSFTP_REMOVE = 3
+# PbPFtpQuery
+PSFTP_SET_LOCAL_TIME = 3
+
+RFC76_ERROR = 0
+RFC76_LAST = 1
+RFC76_MORE = 3
+
+# Where the strap keeps its recordings, one directory per recording named after its start in
+# the strap's time: OFFLINE_ROOT/YYYYMMDD/R/HHMMSS/
+OFFLINE_ROOT = "/U/0/"
+RECORDING_FILES: Mapping[str, PMDMeasurmentTypes] = {
+    "ECG.REC": PMDMeasurmentTypes.ECG,
+    "ACC.REC": PMDMeasurmentTypes.ACC,
+}
+
+DEFAULT_MTU = 232
+# measurement type, uint64 timestamp, frame type
+PMD_FRAME_HEADER = 10
+# Recorded sensor times outside this range mean the strap's clock wasn't set
+EARLIEST_RECORDING_NS = 1577836800 * 10**9  # 2020-01-01
+CLOCK_SLACK_NS = 60 * 10**9
+REPLY_TIMEOUT = 10
+DOWNLOAD_ATTEMPTS = 5
+PROGRESS_INTERVAL = 0.5
+
+
+class PsftpError(Exception):
+    def __init__(self, code: int, path: str = ""):
+        super().__init__(f"PSFTP error {code} {path}".strip())
+        self.code = code
+
+
+class RecordingFormatError(ValueError):
+    """
+    A recording file isn't the length-prefixed PMD frames it is decoded as, or its times
+    can't be right.
+    """
+
+
+def encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def decode_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+def iter_protobuf_fields(data: bytes) -> Iterator[Tuple[int, Any]]:
+    """
+    Yields (field number, value) of a protobuf message. Only varint and length-delimited
+    fields, which is all PSFTP uses.
+    """
+    offset = 0
+    while offset < len(data):
+        key, offset = decode_varint(data, offset)
+        field, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, offset = decode_varint(data, offset)
+        elif wire_type == 2:
+            length, offset = decode_varint(data, offset)
+            value = data[offset : offset + length]
+            offset += length
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield field, value
+
+
+def encode_request(command: int, path: str) -> bytes:
+    # PbPFtpOperation: command = 1 (enum), path = 2 (string)
+    path_bytes = path.encode("utf-8")
+    operation = (
+        bytes([0x08])
+        + encode_varint(command)
+        + bytes([0x12])
+        + encode_varint(len(path_bytes))
+        + path_bytes
+    )
+    # RFC60: bit 15 of the header length marks a query, operations leave it clear
+    return len(operation).to_bytes(2, byteorder="little") + operation
+
+
+def encode_query(query: int, params: bytes = bytes()) -> bytes:
+    return (0x8000 | query).to_bytes(2, byteorder="little") + params
+
+
+def encode_message(fields: List[Tuple[int, int | bytes]]) -> bytes:
+    # Protobuf, varint fields for ints, length-delimited for bytes
+    encoded = bytes()
+    for field, value in fields:
+        if isinstance(value, bytes):
+            encoded += encode_varint(field << 3 | 2) + encode_varint(len(value)) + value
+        else:
+            encoded += encode_varint(field << 3) + encode_varint(value)
+    return encoded
+
+
+def encode_local_time(wall_ns: int) -> bytes:
+    # PbPFtpSetLocalTimeParams: date = 1 (PbDate: year, month, day), time = 2 (PbTime: hour,
+    # minute, seconds, millis), tz_offset = 3 in minutes. UTC, so PMD times are too.
+    t = time.gmtime(wall_ns // 10**9)
+    millis = wall_ns // 10**6 % 1000
+    return encode_message(
+        [
+            (1, encode_message([(1, t.tm_year), (2, t.tm_mon), (3, t.tm_mday)])),
+            (
+                2,
+                encode_message(
+                    [(1, t.tm_hour), (2, t.tm_min), (3, t.tm_sec), (4, millis)]
+                ),
+            ),
+            (3, 0),
+        ]
+    )
+
+
+def decode_local_time(params: bytes) -> int:
+    fields = dict(iter_protobuf_fields(params))
+    date = dict(iter_protobuf_fields(fields.get(1, bytes())))
+    clock = dict(iter_protobuf_fields(fields.get(2, bytes())))
+    seconds = calendar.timegm(
+        (
+            date.get(1, 2000),
+            date.get(2, 1),
+            date.get(3, 1),
+            clock.get(1, 0),
+            clock.get(2, 0),
+            clock.get(3, 0),
+        )
+    )
+    return seconds * 10**9 + clock.get(4, 0) * 10**6 - fields.get(3, 0) * 60 * 10**9
+
+
+def decode_request(data: bytes) -> Tuple[int, str]:
+    length = int.from_bytes(data[:2], byteorder="little") & 0x7FFF
+    command, path = PSFTP_GET, ""
+    for field, value in iter_protobuf_fields(data[2 : 2 + length]):
+        if field == 1:
+            command = value
+        elif field == 2:
+            path = value.decode("utf-8")
+    return command, path
+
+
+def parse_directory(data: bytes) -> List[Tuple[str, int]]:
+    # PbPFtpDirectory: repeated entries = 1, entry: name = 1, size = 2
+    entries = []
+    for field, value in iter_protobuf_fields(data):
+        if field != 1:
+            continue
+        name, size = "", 0
+        for entry_field, entry_value in iter_protobuf_fields(value):
+            if entry_field == 1:
+                name = entry_value.decode("utf-8")
+            elif entry_field == 2:
+                size = entry_value
+        entries.append((name, size))
+    return entries
+
+
+def encode_directory(entries: List[Tuple[str, int]]) -> bytes:
+    encoded = bytes()
+    for name, size in entries:
+        name_bytes = name.encode("utf-8")
+        entry = (
+            bytes([0x0A])
+            + encode_varint(len(name_bytes))
+            + name_bytes
+            + bytes([0x10])
+            + encode_varint(size)
+        )
+        encoded += bytes([0x0A]) + encode_varint(len(entry)) + entry
+    return encoded
+
+
+def rfc76_frames(payload: bytes, mtu: int = DEFAULT_MTU) -> List[bytes]:
+    size = mtu - 1
+    chunks = [payload[i : i + size] for i in range(0, len(payload), size)] or [bytes()]
+    frames = []
+    for sequence, chunk in enumerate(chunks):
+        status = RFC76_LAST if sequence == len(chunks) - 1 else RFC76_MORE
+        header = (1 if sequence else 0) | status << 1 | (sequence & 0x0F) << 4
+        frames.append(bytes([header]) + chunk)
+    return frames
+
+
+def rfc76_error_frame(code: int) -> bytes:
+    return bytes([RFC76_ERROR << 1]) + code.to_bytes(2, byteorder="little")
+
+
+class Rfc76Reader:
+    """
+    Reassembles one RFC76 response and hands the payload on as it comes in.
+    """
+
+    def __init__(self, on_data: Callable[[bytes], None]):
+        self._on_data = on_data
+        self._sequence = 0
+        self.received = 0
+
+    def feed(self, frame: bytes) -> bool:
+        """
+        Takes the next frame, returns True once the response is complete.
+        """
+        header = frame[0]
+        status = (header >> 1) & 0x03
+        if status == RFC76_ERROR:
+            raise PsftpError(int.from_bytes(frame[1:3], byteorder="little"))
+        if (header >> 4) != self._sequence & 0x0F:
+            # Lost on the way, not refused by the strap, so worth another try
+            raise ConnectionError("PSFTP frame out of sequence")
+        self._sequence += 1
+
+        payload = frame[1:]
+        self.received += len(payload)
+        self._on_data(payload)
+        return status == RFC76_LAST
+
+
+class PolarFileTransfer:
+    """
+    Minimal PSFTP client: directory listings and streamed file downloads.
+    """
+
+    def __init__(self, client: Any):
+        self._client = client
+        self._frames = asyncio.Queue()
+        # Bleak reports the ATT MTU, three bytes of which are ATT header
+        self._mtu = getattr(client, "mtu_size", DEFAULT_MTU + 3) - 3
+
+    async def on_notify(self, _, data: bytes):
+        await self._frames.put(bytes(data))
+
+    async def start(self):
+        await self._client.start_notify(PSFTP_MTU, self.on_notify)
+
+    async def stop(self):
+        await self._client.stop_notify(PSFTP_MTU)
+
+    async def request(
+        self,
+        command: int,
+        path: str,
+        on_data: Callable[[bytes], None],
+        on_progress: Callable[[int], Awaitable[None]] | None = None,
+    ):
+        await self.send(encode_request(command, path), on_data, on_progress, path)
+
+    async def send(
+        self,
+        request: bytes,
+        on_data: Callable[[bytes], None],
+        on_progress: Callable[[int], Awaitable[None]] | None = None,
+        path: str = "",
+    ):
+        while not self._frames.empty():
+            self._frames.get_nowait()
+
+        for frame in rfc76_frames(request, self._mtu):
+            await self._client.write_gatt_char(PSFTP_MTU, frame, response=True)
+
+        reader = Rfc76Reader(on_data)
+        try:
+            while not reader.feed(
+                await asyncio.wait_for(self._frames.get(), REPLY_TIMEOUT)
+            ):
+                if on_progress is not None:
+                    await on_progress(reader.received)
+        except PsftpError as e:
+            raise PsftpError(e.code, path) from None
+
+    async def set_local_time(self, wall_ns: int):
+        await self.send(
+            encode_query(PSFTP_SET_LOCAL_TIME, encode_local_time(wall_ns)),
+            lambda _: None,
+            path="SET_LOCAL_TIME",
+        )
+
+    async def list_dir(self, path: str) -> List[Tuple[str, int]]:
+        data = bytearray()
+        await self.request(PSFTP_GET, path, data.extend)
+        return parse_directory(bytes(data))
+
+    async def get(
+        self,
+        path: str,
+        on_data: Callable[[bytes], None],
+        on_progress: Callable[[int], Awaitable[None]] | None = None,
+    ):
+        await self.request(PSFTP_GET, path, on_data, on_progress)
+
+    async def remove(self, path: str):
+        await self.request(PSFTP_REMOVE, path, lambda _: None)
+
+
+def recording_start_ns(path: str) -> int | None:
+    """
+    Start of the recording a file belongs to, from its directory name. None if the path isn't
+    in a recording directory.
+    """
+    parts = path[len(OFFLINE_ROOT) :].split("/")
+    if not path.startswith(OFFLINE_ROOT) or len(parts) != 4 or parts[1] != "R":
+        return None
+    try:
+        start = time.strptime(parts[0] + parts[2], "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    return calendar.timegm(start) * 10**9
+
+
+async def find_recordings(
+    transfer: PolarFileTransfer, since_ns: int = 0, path: str = OFFLINE_ROOT
+) -> List[Tuple[str, int, PMDMeasurmentTypes]]:
+    """
+    Walks the recording directories, returns (path, size, measurement) of every recording file
+    of the recordings started since_ns or later. Recordings of other sessions are left alone.
+    """
+    recordings = []
+    for name, size in await transfer.list_dir(path):
+        if name.endswith("/"):
+            recordings += await find_recordings(transfer, since_ns, f"{path}{name}")
+        elif name in RECORDING_FILES:
+            start = recording_start_ns(f"{path}{name}")
+            # Directories only have whole seconds
+            if start is not None and start >= since_ns // 10**9 * 10**9:
+                recordings.append((f"{path}{name}", size, RECORDING_FILES[name]))
+    return recordings
+
+
+class RecordingDecoder:
+    """
+    Splits a recording file into PMD frames while it is downloading. Every frame has to be
+    one of the file's measurement, later than the one before, and at least a PMD header long.
+    """
+
+    def __init__(self, measurement: PMDMeasurmentTypes, path: str = ""):
+        self._measurement = measurement
+        self._path = path
+        self._buffer = bytearray()
+        # Offset in the file of the buffer's start, for the error messages
+        self._position = 0
+        self._last_timestamp = -1
+
+    def feed(self, data: bytes) -> List[bytes]:
+        self._buffer.extend(data)
+        frames = []
+        offset = 0
+        while offset + 2 <= len(self._buffer):
+            length = int.from_bytes(self._buffer[offset : offset + 2], byteorder="little")
+            if offset + 2 + length > len(self._buffer):
+                break
+            frame = bytes(self._buffer[offset + 2 : offset + 2 + length])
+            self.check(frame, self._position + offset)
+            frames.append(frame)
+            offset += 2 + length
+        del self._buffer[:offset]
+        self._position += offset
+        return frames
+
+    def check(self, frame: bytes, position: int):
+        where = f"{self._path} at byte {position}"
+        if len(frame) <= PMD_FRAME_HEADER:
+            raise RecordingFormatError(f"{where}: {len(frame)} byte frame, too short")
+        if frame[0] != self._measurement:
+            raise RecordingFormatError(
+                f"{where}: measurement {frame[0]} in a {self._measurement.name} recording"
+            )
+        timestamp = int.from_bytes(frame[1:9], byteorder="little")
+        if timestamp <= self._last_timestamp:
+            raise RecordingFormatError(f"{where}: timestamp goes back")
+        self._last_timestamp = timestamp
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+
+def encode_recording(frames: List[bytes]) -> bytes:
+    return b"".join(len(frame).to_bytes(2, byteorder="little") + frame for frame in frames)
+
+
+async def print_progress(
+    ctx: PolarContext, address: str, path: str, received: int, size: int
+):
+    await ctx.print_preformatted(
+        json.dumps(
+            {
+                "component": "polar",
+                "data": {
+                    "device": address,
+                    "download": {
+                        "file": path,
+                        "bytes": received,
+                        "total": size,
+                        "pct": round(min(received, size) / size * 100, 1) if size else 100.0,
+                    },
+                },
+            }
+        ),
+        "download",
+        address,
+    )
+
+
+async def download_recording(
+    ctx: PolarContext,
+    transfer: PolarFileTransfer,
+    address: str,
+    path: str,
+    size: int,
+    measurement: PMDMeasurmentTypes,
+    wall_offset_ns: int,
+    queued: Mapping[str, int],
+    on_frame: Callable[[bytes, int], Awaitable[None]],
+) -> bool:
+    """
+    Hands every frame of one recording file to on_frame with the monotonic time it would have
+    arrived at live. Host times come from the strap's clock, a time that can't be right
+    raises RecordingFormatError. queued counts the frames of every file already handed on,
+    a retry skips them. False if the file ends in a partial frame.
+    """
+    decoder = RecordingDecoder(measurement, path)
+    frames = []
+    skip = queued.get(path, 0)
+    count = 0
+    last_progress = 0.0
+
+    def on_data(data: bytes):
+        frames.extend(decoder.feed(data))
+
+    async def on_progress(received: int):
+        nonlocal count, last_progress
+        for data in frames:
+            count += 1
+            if count <= skip:
+                continue
+            # Sensor timestamp of the frame's last sample, after the measurement type
+            timestamp = int.from_bytes(data[1:9], byteorder="little")
+            check_clock(path, timestamp)
+            await on_frame(data, timestamp + SENSOR_EPOCH_NS - wall_offset_ns)
+            queued[path] = count
+        frames.clear()
+
+        if time.monotonic() - last_progress >= PROGRESS_INTERVAL or received >= size:
+            last_progress = time.monotonic()
+            await print_progress(ctx, address, path, received, size)
+
+    await transfer.get(path, on_data, on_progress)
+    await on_progress(size)
+    if decoder.pending():
+        await ctx.print_log(f"[!] {path} ends in a partial frame", address)
+        return False
+    return True
+
+
+def check_clock(path: str, timestamp: int):
+    wall_ns = timestamp + SENSOR_EPOCH_NS
+    if not EARLIEST_RECORDING_NS <= wall_ns <= time.time_ns() + CLOCK_SLACK_NS:
+        recorded = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(wall_ns // 10**9))
+        raise RecordingFormatError(
+            f"{path}: recorded at {recorded} UTC, the strap's clock wasn't set"
+        )
+
+
+async def connect(transport: Any, address: str) -> Any:
+    device = await transport.find_device(address, SCAN_TIMEOUT)
+    if device is None:
+        raise ConnectionError(f"{address} not found")
+    return transport.client(device, lambda _: None, DIRECT_CONNECT_TIMEOUT)
+
+
+async def start_recording(
+    ctx: PolarContext,
+    address: str,
+    options: PolarOptions,
+    transport: Any,
+    on_configured: Callable[[PMDMeasurmentTypes, Any], None] | None = None,
+) -> List[PMDMeasurmentTypes]:
+    """
+    Starts ECG/ACC recording on the strap, retrying until it is reachable. A measurement the
+    strap refuses is left out, returns the ones recording, none if shut down first.
+    """
+    failures = 0
+    while not ctx.did_shutdown():
+        if failures:
+            try:
+                await asyncio.wait_for(ctx.wait_for_shutdown(), reconnect_delay(failures))
+                return []
+            except asyncio.TimeoutError:
+                pass
+        try:
+            async with await connect(transport, address) as client:
+                # Recorded frames carry the strap's time, it has to be right before starting
+                transfer = PolarFileTransfer(client)
+                await transfer.start()
+                await transfer.set_local_time(time.time_ns())
+                await transfer.stop()
+
+                control = PMDControlPoint(client)
+                await client.start_notify(SERVICE_CONTROL_PORT, control.on_reply)
+                # Asking again won't change the strap's mind, so a refusal isn't retried
+                started = await start_streams(
+                    ctx,
+                    control,
+                    address,
+                    options,
+                    PMDSaveLocation.OFFLINE,
+                    on_configured,
+                    skip_refused=True,
+                )
+                await client.stop_notify(SERVICE_CONTROL_PORT)
+            return started
+        except Exception as e:
+            failures += 1
+            await ctx.print_log(repr(e), address)
+            await ctx.print_log("[-] Couldn't start recording, retrying...", address)
+    return []
+
+
+async def download_recordings(
+    ctx: PolarContext,
+    address: str,
+    transport: Any,
+    measurements: List[PMDMeasurmentTypes],
+    since_ns: int,
+    wall_offset_ns: int,
+    on_frame: Callable[[bytes, int], Awaitable[None]],
+):
+    """
+    Stops recording the measurements and downloads the recordings started since_ns or later,
+    retrying a few times. A file is removed from the strap once it is decoded entirely and
+    its frames are written, anything else is kept there.
+    """
+    # Frames of every file already queued, a retry carries on after them
+    queued: Mapping[str, int] = {}
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        try:
+            async with await connect(transport, address) as client:
+                control = PMDControlPoint(client)
+                await client.start_notify(SERVICE_CONTROL_PORT, control.on_reply)
+                for measurement in measurements:
+                    await control.stop(measurement, PMDSaveLocation.OFFLINE)
+                await client.stop_notify(SERVICE_CONTROL_PORT)
+
+                transfer = PolarFileTransfer(client)
+                await transfer.start()
+                recordings = await find_recordings(transfer, since_ns)
+                await ctx.print_log(f"[+] {len(recordings)} recordings to download", address)
+                for path, size, measurement in recordings:
+                    try:
+                        complete = await download_recording(
+                            ctx,
+                            transfer,
+                            address,
+                            path,
+                            size,
+                            measurement,
+                            wall_offset_ns,
+                            queued,
+                            on_frame,
+                        )
+                    except RecordingFormatError as e:
+                        # Downloading it again won't help, the other files may still be fine
+                        await ctx.print_log(f"[!] Not decoded: {e}", address)
+                        continue
+                    if not complete:
+                        continue
+                    await ctx.wait_for_samples_written()
+                    try:
+                        await transfer.remove(path)
+                    except PsftpError as e:
+                        await ctx.print_log(f"[!] Not removed from the strap: {e}", address)
+                await transfer.stop()
+            return
+        except (PMDControlPointError, PsftpError) as e:
+            # The strap refused, trying again won't change its mind
+            await ctx.print_log(repr(e), address)
+            return
+        except Exception as e:
+            await ctx.print_log(repr(e), address)
+            await ctx.print_log(
+                f"[-] Download failed ({attempt}/{DOWNLOAD_ATTEMPTS})", address
+            )
+            await asyncio.sleep(reconnect_delay(attempt))
+
+
+async def offline_device_handler(
+    ctx: PolarContext,
+    address: str,
+    options: PolarOptions,
+    transport: Any,
+    on_frame: Callable[[bytes, int], Awaitable[None]],
+    on_configured: Callable[[PMDMeasurmentTypes, Any], None] | None = None,
+):
+    """
+    Starts recording on the strap and lets the link go. Downloads the recording on shutdown,
+    on_frame gets every recorded PMD frame and its would-be monotonic arrival time.
+    on_configured gets the settings each measurement is recorded with.
+    """
+    wall_offset_ns = time.time_ns() - time.monotonic_ns()
+    # The strap's clock is set to this or later before recording, earlier recordings aren't
+    # this session's
+    since_ns = time.time_ns()
+    measurements = await start_recording(ctx, address, options, transport, on_configured)
+    if not measurements:
+        if not ctx.did_shutdown():
+            await ctx.print_log("[-] The strap refused every measurement", address)
+        return
+    await ctx.print_log("[+] Recording on the strap, the link isn't needed now", address)
+
+    await ctx.wait_for_shutdown()
+    await ctx.print_log("[+] Downloading the recording...", address)
+    await download_recordings(
+        ctx, address, transport, measurements, since_ns, wall_offset_ns, on_frame
+    )
+    await ctx.wait_for_samples_written()
+    await ctx.print_log("[+] Download done", address)
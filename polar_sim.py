@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+
+# Simulated Polar H10 for running the collector without hardware. It answers control point
+# commands and streams synthetic ECG/ACC as real PMD notifications, optionally delta
+# compressed, Heart Rate Service notifications and offline recordings over PSFTP, with
+# configurable speed, delivery jitter, dropped frames and disconnects.
+# Live use: python3 polar_iface.py --transport=sim --mac=SIM:01 --project=/tmp/sim/
+# Ingest throughput of this machine:
+#   python3 polar_sim.py throughput /tmp/sim/ [--seconds=10] [--devices=1] [--compressed]
+
+import argparse
+import asyncio
+import inspect
+import os
+import signal
+import sys
+import time
+from typing import Callable, Mapping
+
+import numpy as np
+
+from polar_iface import (
+    HEART_RATE_MEASUREMENT,
+    SERVICE_CONTROL_PORT,
+    SERVICE_NOTIFY_PORT,
+    ACC_RANGES,
+    ACC_SAMPLE_RATES,
+    ECG_SAMPLE_RATE,
+    DELTA_FRAME_FORMATS,
+    SENSOR_EPOCH_NS,
+    PMDCommands,
+    PMDError,
+    PMDMeasurmentTypes,
+    PMDSetting,
+    PMD_SETTING_SIZES,
+    PolarOptions,
+    parse_pmd_settings,
+)
+import polar_iface
+from polar_offline import (
+    DEFAULT_MTU,
+    OFFLINE_ROOT,
+    PSFTP_GET,
+    PSFTP_MTU,
+    PSFTP_REMOVE,
+    PSFTP_SET_LOCAL_TIME,
+    RECORDING_FILES,
+    decode_local_time,
+    decode_request,
+    encode_directory,
+    encode_recording,
+    rfc76_error_frame,
+    rfc76_frames,
+)
+
+# Largest notification payload at the H10's MTU, minus the 10 byte frame header
+MAX_CONTENT = 222
+CONTROL_REPLY = 0xF0
+CONTROL_LATENCY = 0.01
+# PbPFtpError NO_SUCH_FILE_OR_DIRECTORY
+PSFTP_NOT_FOUND = 103
+
+# Values the simulated strap offers per measurement
+SUPPORTED_SETTINGS: Mapping[PMDMeasurmentTypes, Mapping[PMDSetting, list]] = {
+    PMDMeasurmentTypes.ECG: {
+        PMDSetting.samplerate: [ECG_SAMPLE_RATE],
+        PMDSetting.resolution: [14],
+    },
+    PMDMeasurmentTypes.ACC: {
+        PMDSetting.samplerate: ACC_SAMPLE_RATES,
+        PMDSetting.resolution: [16],
+        PMDSetting.range: ACC_RANGES,
+    },
+}
+
+# Frame type of uncompressed and compressed frames, and bytes per uncompressed sample
+FRAME_TYPES = {PMDMeasurmentTypes.ECG: 0, PMDMeasurmentTypes.ACC: 1}
+SAMPLE_SIZES = {PMDMeasurmentTypes.ECG: 3, PMDMeasurmentTypes.ACC: 6}
+
+
+def serialize_settings(settings: Mapping[PMDSetting, list]) -> bytes:
+    serialized = bytes()
+    for setting, values in settings.items():
+        serialized += bytes([setting, len(values)])
+        for value in values:
+            serialized += value.to_bytes(PMD_SETTING_SIZES[setting], byteorder="little")
+    return serialized
+
+
+def encode_signed(values: np.ndarray, width: int) -> bytes:
+    # Little-endian signed integers of 1-4 bytes each, the inverse of decode_signed
+    raw = np.asarray(values, dtype="<i4").view(np.uint8).reshape(-1, 4)
+    return raw[:, :width].tobytes()
+
+
+def delta_bits(deltas: np.ndarray) -> int:
+    # Bits needed to hold every delta in two's complement
+    if not deltas.any():
+        return 0
+    magnitude = int(np.maximum(deltas, -deltas - 1).max())
+    return magnitude.bit_length() + 1
+
+
+def encode_delta_frames(samples: np.ndarray, resolution: int) -> bytes:
+    """
+    Delta compresses (samples, channels) values, the inverse of decode_delta_frames.
+    """
+    samples = np.asarray(samples, dtype=np.int64)
+    channels = samples.shape[1]
+    encoded = encode_signed(samples[0], (resolution + 7) // 8)
+    deltas = np.diff(samples, axis=0)
+    for start in range(0, len(deltas), 255):
+        block = deltas[start : start + 255]
+        size = delta_bits(block)
+        encoded += bytes([size, len(block)])
+        if size:
+            bits = (block.reshape(-1, 1) >> np.arange(size)) & 1
+            encoded += np.packbits(
+                bits.astype(np.uint8).ravel(), bitorder="little"
+            ).tobytes()
+    return encoded
+
+
+def synthetic_ecg(index: np.ndarray, sample_rate: float, heart_rate: float) -> np.ndarray:
+    # A QRS spike and a T wave per beat on top of some noise
+    t = index / sample_rate
+    period = 60 / heart_rate
+    phase = t % period
+    ecg = 1200 * np.exp(-(((phase - 0.2) / 0.012) ** 2))
+    ecg += 250 * np.exp(-(((phase - 0.45) / 0.05) ** 2))
+    ecg += np.random.normal(0, 15, len(index))
+    return ecg.astype(np.int32)
+
+
+def synthetic_acc(index: np.ndarray, sample_rate: float) -> np.ndarray:
+    # Gravity on z plus pedalling motion at about 1.5 Hz
+    t = index / sample_rate
+    motion = 150 * np.sin(2 * np.pi * 1.5 * t)
+    xyz = np.column_stack(
+        (motion, 0.5 * motion, 1000 + 0.2 * motion)
+    ) + np.random.normal(0, 10, (len(index), 3))
+    return xyz.astype(np.int32)
+
+
+class SimulatedH10:
+    """
+    The strap itself: its clock, what is streaming and the frames it produces.
+    """
+
+    def __init__(self, address: str, options: PolarOptions):
+        self.address = address
+        self.name = f"Polar H10 {address}"
+        self._options = options
+        # Like a strap whose clock was never set, it counts from power-up until SET_LOCAL_TIME
+        self._clock_offset = -time.monotonic_ns()
+        # 60-90 bpm, different for every strap
+        self.heart_rate = 60 + sum(address.encode()) % 31
+        self.streams: Mapping[PMDMeasurmentTypes, int] = {}
+        # Recorded on the strap, they keep going without a connection
+        self.recordings: Mapping[PMDMeasurmentTypes, int] = {}
+        self._recording_started: Mapping[PMDMeasurmentTypes, int] = {}
+        self.files: Mapping[str, bytes] = {}
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def sensor_time_ns(self) -> int:
+        return time.monotonic_ns() + self._clock_offset
+
+    def samples_per_frame(self, measurement: PMDMeasurmentTypes) -> int:
+        return MAX_CONTENT // SAMPLE_SIZES[measurement]
+
+    def frame(
+        self,
+        measurement: PMDMeasurmentTypes,
+        start: int,
+        count: int,
+        timestamp: int,
+        rate: int | None = None,
+    ) -> bytes:
+        rate = rate or self.streams[measurement]
+        index = np.arange(start, start + count)
+        frame_type = FRAME_TYPES[measurement]
+
+        if measurement == PMDMeasurmentTypes.ECG:
+            samples = synthetic_ecg(index, rate, self.heart_rate).reshape(-1, 1)
+        else:
+            samples = synthetic_acc(index, rate)
+
+        if self._options.sim_compressed:
+            _, resolution = DELTA_FRAME_FORMATS[(measurement, frame_type)]
+            content = encode_delta_frames(samples, resolution)
+            frame_type |= 0x80
+        else:
+            width = SAMPLE_SIZES[measurement] // samples.shape[1]
+            content = encode_signed(samples.ravel(), width)
+
+        return (
+            bytes([measurement])
+            + timestamp.to_bytes(8, byteorder="little")
+            + bytes([frame_type])
+            + content
+        )
+
+    def heart_rate_measurement(self) -> bytes:
+        # 8 bit HR, contact detected, one RR interval in 1/1024 s
+        rr = np.random.normal(60 / self.heart_rate, 0.03)
+        return bytes([0x16, round(self.heart_rate)]) + round(rr * 1024).to_bytes(
+            2, byteorder="little"
+        )
+
+    def control(self, message: bytes) -> bytes:
+        """
+        Handles a control point write and returns the reply.
+        """
+        op = message[0]
+        measurement = message[1] & 0x3F if len(message) > 1 else 0
+        offline = len(message) > 1 and message[1] & 0x80
+        active = self.recordings if offline else self.streams
+
+        def reply(error: PMDError, parameters: bytes = bytes()) -> bytes:
+            return bytes([CONTROL_REPLY, op, measurement, error, 0]) + parameters
+
+        if op not in (
+            PMDCommands.GET_SETTINGS,
+            PMDCommands.START_MEASUREMENT,
+            PMDCommands.STOP_MEASURMENT,
+        ):
+            return reply(PMDError.invalid_op)
+        if measurement not in SUPPORTED_SETTINGS:
+            return reply(PMDError.not_supported)
+        measurement = PMDMeasurmentTypes(measurement)
+        supported = SUPPORTED_SETTINGS[measurement]
+
+        if op == PMDCommands.GET_SETTINGS:
+            return reply(PMDError.success, serialize_settings(supported))
+
+        if op == PMDCommands.STOP_MEASURMENT:
+            if measurement not in active:
+                return reply(PMDError.already_in_state)
+            rate = active.pop(measurement)
+            if offline:
+                self.save_recording(measurement, rate)
+            return reply(PMDError.success)
+
+        if measurement in active:
+            return reply(PMDError.already_in_state)
+        try:
+            settings = parse_pmd_settings(message[2:])
+        except (ValueError, KeyError):
+            return reply(PMDError.invalid_len)
+        for setting, values in settings.items():
+            if setting not in supported or values[0] not in supported[setting]:
+                return reply(PMDError.invalid_param)
+        active[measurement] = settings.get(
+            PMDSetting.samplerate, supported[PMDSetting.samplerate]
+        )[0]
+        if offline:
+            self._recording_started[measurement] = self.sensor_time_ns()
+        return reply(PMDError.success)
+
+    def save_recording(self, measurement: PMDMeasurmentTypes, rate: int):
+        # Everything since the start, stored the way the strap stores it
+        started = self._recording_started.pop(measurement)
+        total = int((self.sensor_time_ns() - started) * rate / 1e9)
+        count = self.samples_per_frame(measurement)
+        frames = [
+            self.frame(
+                measurement, start, count, started + int((start + count - 1) * 1e9 / rate), rate
+            )
+            for start in range(0, total - count + 1, count)
+        ]
+
+        directory = time.strftime(
+            "%Y%m%d/R/%H%M%S/", time.gmtime((started + SENSOR_EPOCH_NS) / 1e9)
+        )
+        name = next(name for name, m in RECORDING_FILES.items() if m == measurement)
+        self.files[f"{OFFLINE_ROOT}{directory}{name}"] = encode_recording(frames)
+
+    def query(self, query: int, params: bytes) -> tuple:
+        """
+        Answers a PSFTP query with (error code, data).
+        """
+        if query != PSFTP_SET_LOCAL_TIME:
+            return PSFTP_NOT_FOUND, bytes()
+        self._clock_offset = decode_local_time(params) - SENSOR_EPOCH_NS - time.monotonic_ns()
+        return 0, bytes()
+
+    def file_request(self, command: int, path: str) -> tuple:
+        """
+        Answers a PSFTP request with (error code, data), directories end with "/".
+        """
+        if command == PSFTP_REMOVE:
+            if self.files.pop(path, None) is None:
+                return PSFTP_NOT_FOUND, bytes()
+            return 0, bytes()
+        if command != PSFTP_GET:
+            return PSFTP_NOT_FOUND, bytes()
+        if path in self.files:
+            return 0, self.files[path]
+
+        entries = {}
+        for file_path, data in self.files.items():
+            if path.endswith("/") and file_path.startswith(path):
+                child, separator, _ = file_path[len(path) :].partition("/")
+                entries[child + separator] = 0 if separator else len(data)
+        if not entries and path != OFFLINE_ROOT:
+            return PSFTP_NOT_FOUND, bytes()
+        return 0, encode_directory(sorted(entries.items()))
+
+
+async def call_back(callback: Callable, *args):
+    # Bleak accepts plain and async notification callbacks
+    result = callback(*args)
+    if inspect.isawaitable(result):
+        await result
+
+
+class SimulatedClient:
+    """
+    Stands in for BleakClient: notifications, control point writes and the disconnect callback.
+    """
+
+    def __init__(
+        self, h10: SimulatedH10, options: PolarOptions, disconnected_callback: Callable
+    ):
+        self._h10 = h10
+        self._options = options
+        self._disconnected_callback = disconnected_callback
+        self._callbacks: Mapping[str, Callable] = {}
+        self._tasks: Mapping[PMDMeasurmentTypes, asyncio.Task] = {}
+        self._drop_task = None
+        self._heart_rate_task = None
+        self.is_connected = False
+        self.mtu_size = DEFAULT_MTU + 3
+
+    async def __aenter__(self) -> "SimulatedClient":
+        self.is_connected = True
+        if self._options.sim_disconnect > 0:
+            self._drop_task = asyncio.create_task(self._drop_connection())
+        return self
+
+    async def __aexit__(self, *_):
+        self._disconnect()
+
+    def _disconnect(self):
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        if self._heart_rate_task is not None:
+            self._heart_rate_task.cancel()
+        if self._drop_task is not None and self._drop_task is not asyncio.current_task():
+            self._drop_task.cancel()
+        # Like the real strap, a dropped connection ends every measurement
+        self._h10.streams.clear()
+
+    async def _drop_connection(self):
+        await asyncio.sleep(np.random.exponential(self._options.sim_disconnect))
+        self._disconnect()
+        self._disconnected_callback(self)
+
+    async def start_notify(self, uuid: str, callback: Callable):
+        self._callbacks[uuid] = callback
+        if uuid == HEART_RATE_MEASUREMENT and self._heart_rate_task is None:
+            self._heart_rate_task = asyncio.create_task(self._heart_rate())
+
+    async def stop_notify(self, uuid: str):
+        self._callbacks.pop(uuid, None)
+        if uuid == HEART_RATE_MEASUREMENT and self._heart_rate_task is not None:
+            self._heart_rate_task.cancel()
+            self._heart_rate_task = None
+
+    async def _heart_rate(self):
+        # The H10 notifies about once a second
+        while True:
+            await asyncio.sleep(1 / self._options.sim_speed if self._options.sim_speed > 0 else 0)
+            if self._options.sim_drop and np.random.random() < self._options.sim_drop:
+                continue
+            if callback := self._callbacks.get(HEART_RATE_MEASUREMENT):
+                data = self._h10.heart_rate_measurement()
+                await call_back(callback, HEART_RATE_MEASUREMENT, bytearray(data))
+
+    async def write_gatt_char(self, uuid: str, data: bytes, response: bool = False):
+        if not self.is_connected:
+            raise ConnectionError(f"{self._h10.address} is not connected")
+        if uuid == PSFTP_MTU:
+            # Requests fit a single frame, skip its RFC76 header
+            asyncio.create_task(self._file_reply(bytes(data[1:])))
+            return
+        if uuid != SERVICE_CONTROL_PORT:
+            return
+
+        reply = self._h10.control(bytes(data))
+        for measurement in list(self._tasks):
+            if measurement not in self._h10.streams:
+                self._tasks.pop(measurement).cancel()
+        for measurement in self._h10.streams:
+            if measurement not in self._tasks:
+                self._tasks[measurement] = asyncio.create_task(self._stream(measurement))
+        asyncio.create_task(self._reply(reply))
+
+    async def _reply(self, reply: bytes):
+        await asyncio.sleep(CONTROL_LATENCY)
+        if callback := self._callbacks.get(SERVICE_CONTROL_PORT):
+            await call_back(callback, SERVICE_CONTROL_PORT, bytearray(reply))
+
+    async def _file_reply(self, request: bytes):
+        header = int.from_bytes(request[:2], byteorder="little")
+        if header & 0x8000:
+            error, data = self._h10.query(header & 0x7FFF, request[2:])
+        else:
+            error, data = self._h10.file_request(*decode_request(request))
+        frames = [rfc76_error_frame(error)] if error else rfc76_frames(data, DEFAULT_MTU)
+        for frame in frames:
+            await asyncio.sleep(0)
+            if not self.is_connected:
+                return
+            if callback := self._callbacks.get(PSFTP_MTU):
+                await call_back(callback, PSFTP_MTU, bytearray(frame))
+
+    async def _stream(self, measurement: PMDMeasurmentTypes):
+        h10 = self._h10
+        options = self._options
+        rate = h10.streams[measurement]
+        count = h10.samples_per_frame(measurement)
+        interval_ns = 1e9 / rate
+        # Sensor time of the first sample
+        first_ns = h10.sensor_time_ns()
+        started = time.monotonic()
+        sent = 0
+
+        while True:
+            sent += count
+            timestamp = first_ns + int((sent - 1) * interval_ns)
+            data = h10.frame(measurement, sent - count, count, timestamp)
+
+            if options.sim_speed > 0:
+                due = started + sent / rate / options.sim_speed
+                jitter = np.random.exponential(options.sim_jitter) if options.sim_jitter else 0
+                await asyncio.sleep(max(0.0, due - time.monotonic() + jitter))
+            else:
+                # As fast as possible, only give the rest of the loop a turn
+                await asyncio.sleep(0)
+
+            if options.sim_drop and np.random.random() < options.sim_drop:
+                continue
+            if callback := self._callbacks.get(SERVICE_NOTIFY_PORT):
+                await call_back(callback, SERVICE_NOTIFY_PORT, bytearray(data))
+                h10.frames_sent += 1
+                h10.bytes_sent += len(data)
+
+
+class SimulatedTransport:
+    """
+    Drop-in for polar_iface.BleakTransport. Every address is found and keeps its own strap.
+    """
+
+    def __init__(self, options: PolarOptions):
+        self._options = options
+        self.devices: Mapping[str, SimulatedH10] = {}
+
+    async def find_device(self, address: str, timeout: float) -> SimulatedH10:
+        if address not in self.devices:
+            self.devices[address] = SimulatedH10(address, self._options)
+        return self.devices[address]
+
+    def client(
+        self, device: SimulatedH10, disconnected_callback: Callable, timeout: float
+    ) -> SimulatedClient:
+        return SimulatedClient(device, self._options, disconnected_callback)
+
+
+async def measure_throughput(
+    project: str, seconds: float, devices: int, options: PolarOptions
+):
+    """
+    Runs the real collector against simulated straps streaming as fast as possible.
+    Notifications are delivered as soon as the collector takes them, so the frame rate
+    reached is the sustainable ingest rate of this machine. Frames the collector dropped
+    because it fell behind don't count towards it.
+    """
+    os.makedirs(project, exist_ok=True)
+    transport = SimulatedTransport(options)
+    addresses = [f"SIM:{i:02X}" for i in range(devices)]
+
+    loop = asyncio.get_running_loop()
+    loop.call_later(seconds, signal.raise_signal, signal.SIGTERM)
+    started = time.monotonic()
+    ctx = await polar_iface.main(addresses, project, options, transport)
+    elapsed = time.monotonic() - started
+
+    sent = sum(h10.frames_sent for h10 in transport.devices.values())
+    dropped = ctx.samples_dropped()
+    frames = sent - dropped
+    sent_bytes = sum(h10.bytes_sent for h10 in transport.devices.values())
+    print(
+        f"{frames} frames handled in {elapsed:.1f}s: {frames / elapsed:.0f} frames/s, "
+        f"{sent_bytes * frames / max(sent, 1) / elapsed / 1024:.0f} KiB/s over "
+        f"{devices} device(s), {dropped} of {sent} frames sent dropped",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    throughput_parser = subparsers.add_parser(
+        "throughput", help="Measure the sustainable frames/s of the collector"
+    )
+    throughput_parser.add_argument("project")
+    throughput_parser.add_argument("--seconds", type=float, default=10.0)
+    throughput_parser.add_argument("--devices", type=int, default=1)
+    throughput_parser.add_argument(
+        "--format", dest="output_format", default="csv", choices=polar_iface.OUTPUT_FORMATS
+    )
+    throughput_parser.add_argument("--compressed", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "throughput":
+        project = args.project if args.project.endswith("/") else f"{args.project}/"
+        options = PolarOptions(
+            output_format=args.output_format,
+            transport="sim",
+            sim_speed=0.0,
+            sim_compressed=args.compressed,
+        )
+        asyncio.run(measure_throughput(project, args.seconds, args.devices, options))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# Columnar session store: one fixed-width binary file per column plus a small JSON header,
+# so recordings can be opened with numpy.memmap instead of parsing CSV.
+# Layout of a channel: <project>/<channel>/header.json, <project>/<channel>/<column>.bin
+# Offline CSV export:
+#   python3 session_store.py export /opt/collected_data/<project>/
+
+import argparse
+import json
+import os
+import pathlib
+import time
+from typing import Any, Mapping, List
+
+import numpy as np
+
+STORE_VERSION = 1
+HEADER_NAME = "header.json"
+CHUNK_ROWS = 65536
+
+DEFAULT_WRITE_BUFFER = 256 * 1024
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+# Columns of every channel the Polar collector writes, in CSV order
+CHANNEL_COLUMNS: Mapping[str, Mapping[str, str]] = {
+    "ecg": {"host_time": "<i8", "sensor_time": "<i8", "mv": "<i4"},
+    "acc": {
+        "host_time": "<i8",
+        "sensor_time": "<i8",
+        "x": "<i2",
+        "y": "<i2",
+        "z": "<i2",
+    },
+}
+
+
+class WriteBehindBuffer:
+    """
+    Collects writes in memory and hands them to the file in one large sequential write,
+    once the buffer is full or the flush interval has passed.
+    """
+
+    def __init__(
+        self,
+        fd: Any,
+        size: int = DEFAULT_WRITE_BUFFER,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        self._fd = fd
+        self._size = size
+        self._flush_interval = flush_interval
+        self._chunks: List[Any] = []
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, data: Any):
+        self._chunks.append(data)
+        self._pending += len(data)
+        if (
+            self._pending >= self._size
+            or time.monotonic() - self._last_flush >= self._flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            # str for text files, bytes for binary ones
+            self._fd.write(type(self._chunks[0])().join(self._chunks))
+            self._chunks.clear()
+            self._pending = 0
+        self._fd.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self._fd.close()
+
+
+class ColumnarChannelWriter:
+    """
+    Appends rows to the column files of one channel. Row count is implied by the file sizes,
+    so a crash never leaves a header out of sync with the data.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        columns: Mapping[str, str],
+        meta: Mapping = None,
+        buffer_size: int = DEFAULT_WRITE_BUFFER,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        self._path = pathlib.Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._columns = dict(columns)
+        self._meta = dict(meta or {})
+        self._write_header()
+
+        self._fds = {
+            name: WriteBehindBuffer(
+                open(self._path / f"{name}.bin", "wb"), buffer_size, flush_interval
+            )
+            for name in self._columns
+        }
+
+    def _write_header(self):
+        with open(self._path / HEADER_NAME, "w") as fd:
+            json.dump(
+                {
+                    "version": STORE_VERSION,
+                    "columns": self._columns,
+                    "meta": self._meta,
+                },
+                fd,
+            )
+
+    def update_meta(self, meta: Mapping):
+        """
+        Changes meta entries after the fact, e.g. the sample rate the sensor settled on.
+        """
+        self._meta.update(meta)
+        self._write_header()
+
+    def append(self, **columns: np.ndarray):
+        for name, dtype in self._columns.items():
+            self._fds[name].write(np.asarray(columns[name], dtype=dtype).tobytes())
+
+    def flush(self):
+        for fd in self._fds.values():
+            fd.flush()
+
+    def close(self):
+        for fd in self._fds.values():
+            fd.close()
+
+
+class ColumnarChannel:
+    """
+    Read-only view of a channel. Every column is a numpy.memmap, so slicing is zero-copy.
+    """
+
+    def __init__(self, path: str):
+        self._path = pathlib.Path(path)
+        with open(self._path / HEADER_NAME) as fd:
+            header = json.load(fd)
+
+        if header["version"] != STORE_VERSION:
+            raise ValueError(f"Unsupported store version {header['version']}")
+
+        self.meta = header["meta"]
+        self.columns: Mapping[str, np.ndarray] = {}
+
+        # A writer that died mid-row can leave columns of different lengths, trim to the shortest
+        rows = min(
+            os.path.getsize(self._path / f"{name}.bin") // np.dtype(dtype).itemsize
+            for name, dtype in header["columns"].items()
+        )
+        for name, dtype in header["columns"].items():
+            if rows == 0:
+                self.columns[name] = np.empty(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(
+                    self._path / f"{name}.bin", dtype=dtype, mode="r", shape=(rows,)
+                )
+        self._rows = rows
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def column_names(self) -> List[str]:
+        return list(self.columns.keys())
+
+
+def open_session(project: str) -> Mapping[str, ColumnarChannel]:
+    """
+    Opens every columnar channel found in a project directory.
+    """
+    project_path = pathlib.Path(project)
+    return {
+        entry.name: ColumnarChannel(str(entry))
+        for entry in sorted(project_path.iterdir())
+        if (entry / HEADER_NAME).exists()
+    }
+
+
+def format_host_times(host_time: np.ndarray) -> np.ndarray:
+    # Matches datetime.isoformat() of the live CSV writer
+    iso = np.datetime_as_string(host_time.astype("datetime64[ns]"), unit="us")
+    return np.char.add(iso, "+00:00")
+
+
+def export_channel_csv(channel: ColumnarChannel, out_path: str):
+    names = channel.column_names()
+    with open(out_path, "w") as fd:
+        for start in range(0, len(channel), CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, len(channel))
+            fields = [format_host_times(channel["host_time"][start:stop])]
+            fields += [
+                channel[name][start:stop].astype(str)
+                for name in names
+                if name != "host_time"
+            ]
+            rows = fields[0]
+            for field in fields[1:]:
+                rows = np.char.add(np.char.add(rows, ","), field)
+            fd.write("\n".join(rows.tolist()))
+            fd.write("\n")
+
+
+def export_csv(project: str):
+    for name, channel in open_session(project).items():
+        out_path = os.path.join(project, f"{name}.csv")
+        print(f"Exporting {len(channel)} rows to {out_path}")
+        export_channel_csv(channel, out_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export a project to CSV")
+    export_parser.add_argument("project")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_csv(args.project)
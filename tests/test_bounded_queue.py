@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from bounded_queue import (
+    POLICY_BLOCK,
+    POLICY_DROP_NEWEST,
+    POLICY_DROP_OLDEST,
+    BoundedQueue,
+)
+
+
+def drain(queue: BoundedQueue) -> list:
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+        queue.task_done()
+    return items
+
+
+def test_drop_newest_keeps_what_is_queued():
+    async def run():
+        queue = BoundedQueue(2, POLICY_DROP_NEWEST)
+        offered = [queue.offer(i) for i in range(4)]
+        await queue.put(4)
+        return offered, queue.dropped(), drain(queue)
+
+    assert asyncio.run(run()) == ([True, True, False, False], 3, [0, 1])
+
+
+def test_drop_oldest_keeps_the_latest():
+    async def run():
+        queue = BoundedQueue(2, POLICY_DROP_OLDEST)
+        offered = [queue.offer(i) for i in range(4)]
+        await queue.put(4)
+        # The evicted items count as done, join() doesn't wait for them
+        drain(queue)
+        await asyncio.wait_for(queue.join(), 1)
+        return offered, queue.dropped()
+
+    assert asyncio.run(run()) == ([True] * 4, 3)
+
+
+def test_block_waits_for_room():
+    async def run():
+        queue = BoundedQueue(1, POLICY_BLOCK)
+        await queue.put(0)
+        blocked = asyncio.create_task(queue.put(1))
+        await asyncio.sleep(0.01)
+        waited = not blocked.done()
+        first = await queue.get()
+        await asyncio.wait_for(blocked, 1)
+        return waited, first, await queue.get(), queue.dropped()
+
+    assert asyncio.run(run()) == (True, 0, 1, 0)
+
+
+def test_block_refuses_offers():
+    async def run():
+        with pytest.raises(ValueError):
+            BoundedQueue(1, POLICY_BLOCK).offer(0)
+
+    asyncio.run(run())
+
+
+def test_put_waiting_ignores_the_drop_policy():
+    async def run():
+        queue = BoundedQueue(1, POLICY_DROP_NEWEST)
+        queue.offer(0)
+        waiting = asyncio.create_task(queue.put_waiting(1))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        assert await queue.get() == 0
+        await asyncio.wait_for(waiting, 1)
+        return await queue.get(), queue.dropped()
+
+    assert asyncio.run(run()) == (1, 0)
+
+
+def test_stats_high_water_restarts():
+    async def run():
+        queue = BoundedQueue(4, POLICY_DROP_NEWEST)
+        for i in range(3):
+            queue.offer(i)
+        queue.get_nowait()
+        first = queue.stats()
+        return first["high_water"], first["size"], queue.stats()["high_water"]
+
+    assert asyncio.run(run()) == (3, 2, 2)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        BoundedQueue(1, "drop_all")
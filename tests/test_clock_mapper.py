@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from polar_iface import ClockMapper
+
+WALL_OFFSET = 1_700_000_000 * 10**9
+# A frame every 100 ms
+STEP = 10**8
+
+
+def feed(mapper: ClockMapper, seconds: float, drift_ppm: float, latency_ms, start: int = 0):
+    """
+    Frames whose sensor clock runs drift_ppm fast, arriving latency_ms (one per frame) late.
+    Returns sensor times and the monotonic times they were taken at.
+    """
+    monotonic = start + np.arange(0, int(seconds * 1e9), STEP)
+    sensor = 5 * 10**9 + ((monotonic - start) * (1 + drift_ppm * 1e-6)).astype(np.int64)
+    for s, m, latency in zip(sensor, monotonic, latency_ms):
+        mapper.update(int(s), int(m + latency * 1e6))
+    return sensor, monotonic
+
+
+def test_no_drift_before_the_fit_has_enough_time():
+    mapper = ClockMapper(WALL_OFFSET)
+    feed(mapper, ClockMapper.MIN_FIT_SECONDS / 2, 200, np.full(1000, 5.0))
+
+    assert mapper.stats()["drift_ppm"] == 0.0
+
+
+def test_drift_and_jitter():
+    rng = np.random.default_rng(3)
+    latency = rng.uniform(0, 20, 1200)
+    mapper = ClockMapper(WALL_OFFSET)
+    sensor, monotonic = feed(mapper, 120, 100, latency)
+
+    stats = mapper.stats()
+    # Host time per sensor time, slower by the strap's drift
+    assert stats["drift_ppm"] == pytest.approx(-100, abs=10)
+    assert stats["jitter_ms"] == pytest.approx(20 / np.sqrt(12), rel=0.2)
+    assert stats["resets"] == 0
+    # Wall times of the latest frames, off by the mean delivery latency
+    error = mapper.map(sensor[-100:]) - (monotonic[-100:] + WALL_OFFSET)
+    assert np.abs(error / 1e6 - 10).max() < 3
+
+
+def test_implausible_drift_is_ignored():
+    mapper = ClockMapper(WALL_OFFSET)
+    feed(mapper, 60, 5000, np.zeros(600))
+
+    assert mapper.stats()["drift_ppm"] == 0.0
+
+
+def test_sensor_clock_reset_starts_over():
+    mapper = ClockMapper(WALL_OFFSET)
+    feed(mapper, 10, 0, np.zeros(100))
+
+    # The strap restarted, its clock counts from 5 s again while the host's went on
+    sensor, monotonic = feed(mapper, 10, 0, np.zeros(100), start=20 * 10**9)
+    assert mapper.stats()["resets"] == 1
+    assert mapper.map(sensor[-1:])[0] == monotonic[-1] + WALL_OFFSET
@@ -0,0 +1,172 @@
+import asyncio
+import json
+from typing import List
+
+import numpy as np
+import pytest
+
+from collector_ipc import (
+    ENCODING_BINARY,
+    ENCODING_COMPACT,
+    ENCODING_JSON,
+    FRAME_HEADER,
+    MAX_FRAME,
+    WAVEFORM_HEADER,
+    encode_frame,
+    frame_to_json,
+    pack_compact,
+    pack_waveform,
+    read_frames,
+    unpack_compact,
+)
+
+
+def read_all(chunks: List[bytes]) -> list:
+    """
+    Every frame read_frames yields from a stream that receives chunks one at a time.
+    """
+
+    async def run():
+        stream = asyncio.StreamReader()
+
+        async def feed():
+            for chunk in chunks:
+                stream.feed_data(chunk)
+                await asyncio.sleep(0)
+            stream.feed_eof()
+
+        feeder = asyncio.create_task(feed())
+        frames = [frame async for frame in read_frames(stream)]
+        await feeder
+        return frames
+
+    return asyncio.run(run())
+
+
+MESSAGE = {
+    "component": "polar",
+    "data": {
+        "device": "SIM:01",
+        "preview": {"t0": 123, "mv": {"min": [-70000, 5, 0], "max": [1, 2, 300]}},
+        "hrv": {"rmssd": None, "sdnn": 31.5},
+        "flags": [True, False],
+    },
+}
+
+
+def test_json_frame_round_trip():
+    text = json.dumps(MESSAGE)
+    data = encode_frame("polar.log", "SIM:01", ENCODING_JSON, text.encode("utf-8"))
+
+    assert read_all([data]) == [("polar.log", "SIM:01", ENCODING_JSON, text.encode())]
+    assert frame_to_json(ENCODING_JSON, text.encode("utf-8")) == text
+
+
+def test_compact_frame_round_trip():
+    payload = pack_compact(MESSAGE)
+    data = encode_frame("polar.ecg.preview", "", ENCODING_COMPACT, payload)
+
+    [(topic, key, encoding, read)] = read_all([data])
+    assert (topic, key, encoding) == ("polar.ecg.preview", "", ENCODING_COMPACT)
+    assert json.loads(frame_to_json(encoding, read)) == MESSAGE
+
+
+def test_compact_picks_smallest_array_type():
+    small = pack_compact({"v": [1, -2, 3]})
+    large = pack_compact({"v": [1, -2, 2**40]})
+
+    assert unpack_compact(small) == {"v": [1, -2, 3]}
+    assert unpack_compact(large) == {"v": [1, -2, 2**40]}
+    assert len(large) - len(small) == 3 * 7
+
+
+def test_binary_waveform_frame():
+    ecg = np.array([-5, 0, 1200, -131072], dtype=np.int32)
+    block = pack_waveform("SIM:01", "ecg", 1_000_000, 130.0, [ecg])
+    data = encode_frame("polar.ecg.waveform", "SIM:01", ENCODING_BINARY, block)
+
+    [(topic, key, encoding, payload)] = read_all([data])
+    assert (topic, key, encoding) == ("polar.ecg.waveform", "SIM:01", ENCODING_BINARY)
+    assert payload == block
+
+    length, code, count, device_len, name_len, t0, rate, samples = (
+        WAVEFORM_HEADER.unpack_from(payload)
+    )
+    assert length == len(payload) - 4
+    assert (count, t0, rate, samples) == (1, 1_000_000, 130.0, 4)
+    offset = WAVEFORM_HEADER.size
+    assert payload[offset : offset + device_len] == b"SIM:01"
+    offset += device_len
+    assert payload[offset : offset + name_len] == b"ecg"
+    offset += name_len
+    assert np.frombuffer(payload[offset:], dtype="<i4").tolist() == ecg.tolist()
+    assert code == 2
+
+
+def test_binary_waveform_channels_follow_each_other():
+    axes = [np.arange(3, dtype=np.int16) + 10 * i for i in range(3)]
+    block = pack_waveform("A", "acc", 0, 25.0, axes)
+
+    assert WAVEFORM_HEADER.unpack_from(block)[1:3] == (1, 3)
+    data = block[WAVEFORM_HEADER.size + 1 + 3 :]
+    assert np.frombuffer(data, dtype="<i2").tolist() == [0, 1, 2, 10, 11, 12, 20, 21, 22]
+
+
+def test_partial_reads():
+    frames = [
+        encode_frame("polar.log", "SIM:01", ENCODING_JSON, b'{"a":1}'),
+        encode_frame("polar.stats", "", ENCODING_COMPACT, pack_compact({"v": [1, 2]})),
+        encode_frame("buttons.press", "", ENCODING_JSON, b'{"b":2}'),
+    ]
+    data = b"".join(frames)
+
+    # One byte at a time, and split right after a header
+    expected = read_all([data])
+    assert len(expected) == 3
+    assert read_all([data[i : i + 1] for i in range(len(data))]) == expected
+    split = FRAME_HEADER.size
+    assert read_all([data[:split], data[split:]]) == expected
+
+
+def test_truncated_stream_drops_the_partial_frame():
+    first = encode_frame("polar.log", "", ENCODING_JSON, b'{"a":1}')
+    second = encode_frame("polar.log", "", ENCODING_JSON, b'{"b":2}')
+
+    assert len(read_all([first + second[:-1]])) == 1
+    assert len(read_all([first + second[: FRAME_HEADER.size - 1]])) == 1
+
+
+def test_oversized_frame():
+    header = FRAME_HEADER.pack(MAX_FRAME + 1, ENCODING_JSON, 0, 0)
+
+    with pytest.raises(ValueError):
+        read_all([header])
+
+
+def test_topic_longer_than_frame():
+    header = FRAME_HEADER.pack(5, ENCODING_JSON, 4, 0)
+
+    with pytest.raises(ValueError):
+        read_all([header + b"polar"])
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        frame_to_json(7, b"{}")
+
+
+@pytest.mark.parametrize("cut", [2, 9, -1, -5])
+def test_truncated_compact_payload(cut):
+    payload = pack_compact({"v": [1, 2, 3], "w": [70000]})
+
+    with pytest.raises(ValueError):
+        unpack_compact(payload[:cut])
+
+
+def test_corrupt_compact_array_type():
+    payload = bytearray(pack_compact({"v": [1, 2, 3]}))
+    # The array header follows the JSON part
+    payload[4 + int.from_bytes(payload[:4], "little")] = 9
+
+    with pytest.raises(ValueError):
+        unpack_compact(bytes(payload))
@@ -0,0 +1,36 @@
+from polar_iface import hr_writer_fmt, parse_heart_rate_measurement
+
+# 2026-01-01 00:00:00.5 UTC
+HOST_NS = 1767225600_500_000_000
+
+
+def test_measurement_with_rr_intervals():
+    # 8 bit HR 72, contact detected, two RR intervals of 1024 and 512 / 1024 s
+    data = bytes([0x16, 72, 0x00, 0x04, 0x00, 0x02])
+
+    measurement = parse_heart_rate_measurement(data)
+    assert measurement.heart_rate == 72
+    assert measurement.contact is True
+    assert measurement.rr == [1000.0, 500.0]
+
+
+def test_measurement_with_16_bit_hr_and_energy():
+    data = bytes([0x09, 0x2C, 0x01, 0x10, 0x00])
+
+    measurement = parse_heart_rate_measurement(data)
+    assert measurement.heart_rate == 300
+    assert measurement.contact is None
+    assert measurement.energy_expended == 16
+    assert measurement.rr == []
+
+
+def test_too_short():
+    assert parse_heart_rate_measurement(bytes([0x00])) is None
+
+
+def test_rows_follow_the_time_format():
+    measurement = parse_heart_rate_measurement(bytes([0x10, 60, 0x00, 0x04]))
+    empty = parse_heart_rate_measurement(bytes([0x00, 61]))
+
+    assert hr_writer_fmt(HOST_NS, measurement) == "2026-01-01T00:00:00.500000+00:00,60,1000.0\n"
+    assert hr_writer_fmt(HOST_NS, empty, "ns") == f"{HOST_NS},61,\n"
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from hrv import LEARNING_SECONDS, RollingHRV, RPeakDetector
+from polar_sim import synthetic_ecg
+
+RATE = 130
+
+
+def detect(ecg: np.ndarray, frame: int) -> np.ndarray:
+    """
+    Peak times in ns of an ECG fed in frames of the given size.
+    """
+    timestamps = (np.arange(len(ecg)) * 1e9 / RATE).astype(np.int64)
+    detector = RPeakDetector(RATE)
+    peaks = []
+    for start in range(0, len(ecg), frame):
+        peaks += detector.process(
+            ecg[start : start + frame], timestamps[start : start + frame]
+        )
+    return np.array([peak.timestamp for peak in peaks])
+
+
+@pytest.mark.parametrize("heart_rate", [45, 60, 72, 150])
+def test_rr_within_a_sample(heart_rate):
+    np.random.seed(heart_rate)
+    seconds = 60
+    ecg = synthetic_ecg(np.arange(seconds * RATE), RATE, heart_rate)
+    period_ns = 60e9 / heart_rate
+
+    peaks = detect(ecg, 74)
+    # Every beat after the learning period, on its R apex (phase 0.2 s) and nothing else
+    expected = np.arange(0.2e9, seconds * 1e9, period_ns)
+    expected = expected[expected >= LEARNING_SECONDS * 1e9]
+    assert len(peaks) == len(expected)
+    assert np.abs(peaks - expected).max() <= 0.5e9 / RATE
+    assert np.abs(np.diff(peaks) - period_ns).max() <= 1e9 / RATE
+
+
+def test_frame_size_does_not_matter():
+    np.random.seed(1)
+    ecg = synthetic_ecg(np.arange(20 * RATE), RATE, 80)
+
+    # Once learned, which only happens in whatever frame crosses the learning period
+    def settled(frame: int) -> list:
+        peaks = detect(ecg, frame)
+        return peaks[peaks > (LEARNING_SECONDS + 1) * 1e9].tolist()
+
+    assert settled(74) == settled(5) == settled(300)
+
+
+def test_rolling_metrics():
+    rr = [800.0, 810.0, 790.0, 820.0, 805.0]
+    hrv = RollingHRV(window=4)
+    for value in rr:
+        assert hrv.add_rr(value) == value
+
+    window = np.array(rr[-4:])
+    assert hrv.hr() == pytest.approx(60000 / window.mean())
+    assert hrv.sdnn() == pytest.approx(window.std(ddof=1))
+    assert hrv.rmssd() == pytest.approx(np.sqrt(np.mean(np.diff(window) ** 2)))
+
+
+def test_implausible_intervals_are_ignored():
+    hrv = RollingHRV()
+    assert hrv.add_peak(0) is None
+    assert hrv.add_peak(100_000_000) is None
+    assert hrv.add_peak(1_100_000_000) == pytest.approx(1000.0)
+    assert hrv.rmssd() is None
+    assert hrv.sdnn() is None
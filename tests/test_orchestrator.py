@@ -0,0 +1,269 @@
+import asyncio
+import json
+
+import orchestrator
+from collector_ipc import ENCODING_JSON, encode_frame, heartbeat_message
+from orchestrator import (
+    MAX_APPENDED,
+    ClientConnection,
+    CollectorDef,
+    CollectorHealth,
+    OrchestratorContext,
+    batch_message,
+    forward_frames,
+    watch_heartbeats,
+)
+
+
+class FakeWebSocket:
+    remote_address = ("127.0.0.1", 1234)
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def close(self):
+        self.closed = True
+
+
+def update(value: int, device: str = "A") -> str:
+    return json.dumps({"component": "polar", "data": {"device": device, "value": value}})
+
+
+def pending(send) -> list:
+    """
+    What a client queued for one tick after send(client), taken before its sender runs.
+    """
+
+    async def run():
+        client = ClientConnection(FakeWebSocket())
+        send(client)
+        messages, _ = client.take_pending()
+        await client.close()
+        return messages
+
+    return asyncio.run(run())
+
+
+def test_state_channels_keep_the_latest_per_topic_and_key():
+    def send(client):
+        for value in range(5):
+            client.send_nowait(update(value, "A"), "polar.stats", "A")
+            client.send_nowait(update(value + 10, "B"), "polar.stats", "B")
+        client.send_nowait(update(7), "polar.heart_rate", "A")
+
+    assert pending(send) == [update(4, "A"), update(14, "B"), update(7)]
+
+
+def test_events_all_arrive_in_order():
+    def send(client):
+        for value in range(5):
+            client.send_nowait(update(value), "polar.log", "A")
+        # Stdout messages without a topic are events too
+        client.send_nowait(update(5))
+
+    assert pending(send) == [update(value) for value in range(6)]
+
+
+def test_preview_buckets_are_appended_up_to_a_limit():
+    def send(client):
+        for value in range(MAX_APPENDED + 5):
+            client.send_nowait(update(value), "polar.preview", "A")
+
+    assert pending(send) == [update(value) for value in range(5, MAX_APPENDED + 5)]
+
+
+def test_one_message_per_tick(monkeypatch):
+    monkeypatch.setattr(orchestrator, "UI_TICK", 0.05)
+    websocket = FakeWebSocket()
+
+    async def run():
+        client = ClientConnection(websocket)
+        client.send_nowait(update(1), "polar.log")
+        client.send_nowait(update(2), "polar.stats")
+        client.send_nowait(update(3), "polar.stats")
+        await asyncio.sleep(0.01)
+        # Arrives within the tick, so goes out with the next message
+        client.send_nowait(update(4), "polar.log")
+        await asyncio.sleep(0.1)
+        await client.close()
+
+    asyncio.run(run())
+    assert websocket.sent == [
+        batch_message([update(1), update(3)]),
+        batch_message([update(4)]),
+    ]
+    assert json.loads(websocket.sent[0])["batch"][1]["data"]["value"] == 3
+
+
+def test_client_that_falls_behind_is_disconnected(monkeypatch):
+    monkeypatch.setattr(orchestrator, "MAX_PENDING_EVENTS", 10)
+    websocket = FakeWebSocket()
+
+    async def run():
+        client = ClientConnection(websocket)
+        for value in range(11):
+            client.send_nowait(update(value), "polar.log")
+        await asyncio.sleep(0.01)
+        await client.close()
+
+    asyncio.run(run())
+    assert websocket.sent == []
+    assert websocket.closed
+
+
+def orchestrator_context() -> OrchestratorContext:
+    ctx = OrchestratorContext()
+    # The class keeps them for the one orchestrator of a run, every test gets its own
+    ctx._connections = {}
+    ctx._topic_index = {}
+    return ctx
+
+
+def test_subscriptions():
+    ui, recorder = FakeWebSocket(), FakeWebSocket()
+
+    async def run():
+        ctx = orchestrator_context()
+        await ctx.on_connect(ui)
+        await ctx.on_connect(recorder)
+        clients = ctx._connections
+        # Everything but binary until told otherwise
+        assert ctx.clients_for("polar.stats") == [clients[ui], clients[recorder]]
+        assert ctx.clients_for("polar.waveform") == []
+
+        await ctx.unsubscribe(recorder, ["*"])
+        assert await ctx.subscribe(recorder, ["polar.*", "*.log"]) == ["*.log", "polar.*"]
+        assert ctx.clients_for("buttons.press") == [clients[ui]]
+        assert ctx.clients_for("buttons.log") == [clients[ui], clients[recorder]]
+        # "polar.*" isn't a waveform pattern, binary has to be asked for by name
+        assert ctx.clients_for("polar.waveform") == []
+        await ctx.subscribe(recorder, ["polar.waveform"])
+        assert ctx.clients_for("polar.waveform") == [clients[recorder]]
+
+        await ctx.forward(update(1), "buttons.press", "")
+        await ctx.forward(update(2), "polar.stats", "A")
+        assert clients[ui].take_pending()[0] == [update(1), update(2)]
+        assert clients[recorder].take_pending()[0] == [update(2)]
+
+        await ctx.on_disconnect(ui)
+        assert ctx.clients_for("buttons.press") == []
+        await ctx.on_disconnect(recorder)
+
+    asyncio.run(run())
+
+
+def test_binary_rate_limit():
+    websocket = FakeWebSocket()
+
+    async def run():
+        ctx = orchestrator_context()
+        await ctx.on_connect(websocket)
+        await ctx.subscribe(websocket, ["*.waveform"], binary_rate=1000)
+        for _ in range(5):
+            await ctx.forward_binary(bytes(400), "polar.waveform")
+        _, blocks = ctx._connections[websocket].take_pending()
+        await ctx.on_disconnect(websocket)
+        return blocks
+
+    # A second's worth of bytes at most
+    assert asyncio.run(run()) == [bytes(400)] * 2
+
+
+COLLECTOR = CollectorDef("polar", "polar", "", "polar_iface.py")
+
+
+def supervised_runs(monkeypatch, runs: list) -> tuple:
+    """
+    Supervises a collector whose runs end in the given (state, exit code) until it exits
+    or the runs are used up. Returns the --project of every run and the health.
+    """
+    monkeypatch.setattr(orchestrator, "RESTART_BACKOFF", 0.001)
+    projects = []
+
+    async def process_handler(collector, params, ctx, health, stop_timeout):
+        projects.append(params[-1])
+        if not runs:
+            await asyncio.sleep(10)
+        health.state, returncode = runs.pop(0)
+        return returncode
+
+    monkeypatch.setattr(orchestrator, "process_handler", process_handler)
+
+    async def run():
+        ctx = orchestrator_context()
+        ctx._health = {}
+        task = asyncio.create_task(ctx.supervise(COLLECTOR, ["--mode=raw"], "/tmp/p/"))
+        await asyncio.sleep(0.1)
+        # Stopped, if it is still running
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return ctx.health_report()["polar"]
+
+    return projects, asyncio.run(run())
+
+
+def test_failed_collector_restarts_into_its_own_files(monkeypatch):
+    projects, health = supervised_runs(
+        monkeypatch, [("running", 1), ("unresponsive", 0), ("running", 0)]
+    )
+
+    assert projects == [
+        "--project=/tmp/p/",
+        "--project=/tmp/p/restart1_",
+        "--project=/tmp/p/restart2_",
+    ]
+    # Finished on its own after two restarts, a stop doesn't change that
+    assert health["state"] == "exited"
+    assert health["restarts"] == 2
+    assert health["last_exit"] == 0
+
+
+def test_stopped_while_running(monkeypatch):
+    projects, health = supervised_runs(monkeypatch, [("running", -15)])
+
+    assert projects == ["--project=/tmp/p/", "--project=/tmp/p/restart1_"]
+    assert health["state"] == "stopped"
+    assert health["restarts"] == 1
+    assert health["last_exit"] == -15
+
+
+def test_heartbeats_reach_the_health_not_the_clients():
+    health = CollectorHealth()
+    status = {"samples": 10}
+    heartbeat = heartbeat_message("polar", status)
+    log = json.dumps({"component": "polar", "data": {"log": "hi"}})
+    websocket = FakeWebSocket()
+
+    async def run():
+        ctx = orchestrator_context()
+        await ctx.on_connect(websocket)
+        stream = asyncio.StreamReader()
+        stream.feed_data(
+            encode_frame("polar.heartbeat", "", ENCODING_JSON, heartbeat.message.encode())
+            + encode_frame("polar.log", "", ENCODING_JSON, log.encode())
+        )
+        stream.feed_eof()
+        await forward_frames(stream, ctx, health)
+        messages, _ = ctx._connections[websocket].take_pending()
+        await ctx.on_disconnect(websocket)
+        return messages
+
+    assert asyncio.run(run()) == [log]
+    assert health.status == status
+    assert health.report()["heartbeat_age"] == 0.0
+
+
+def test_silent_collector_is_noticed(monkeypatch):
+    monkeypatch.setattr(orchestrator, "HEARTBEAT_TIMEOUT", 0.05)
+    monkeypatch.setattr(orchestrator, "HEARTBEAT_INTERVAL", 0.01)
+    health = CollectorHealth(state="running", started=orchestrator.time.monotonic())
+
+    async def run():
+        await asyncio.wait_for(watch_heartbeats(health), 1)
+
+    asyncio.run(run())
+    assert health.silent_for() >= 0.05
@@ -0,0 +1,161 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from polar_iface import (
+    ECG_SAMPLE_RATE,
+    DevicePipeline,
+    PMDACCData,
+    PMDCommands,
+    PMDConfiguration,
+    PMDControlPoint,
+    PMDControlPointError,
+    PMDError,
+    PMDFrame,
+    PMDMeasurmentTypes,
+    PMDSetting,
+    PolarOptions,
+    choose_pmd_configuration,
+    default_pmd_configuration,
+    parse_pmd_settings,
+)
+from polar_sim import serialize_settings
+from session_store import ColumnarChannel
+from threaded_writer import ThreadedWriter
+
+ECG = PMDMeasurmentTypes.ECG
+ACC = PMDMeasurmentTypes.ACC
+
+
+def test_settings_round_trip():
+    settings = {
+        PMDSetting.samplerate: [25, 50, 100, 200],
+        PMDSetting.resolution: [16],
+        PMDSetting.range: [2, 4, 8],
+        PMDSetting.rangeMU: [1000],
+        PMDSetting.channels: [3],
+        PMDSetting.factor: [1052770304],
+    }
+
+    assert parse_pmd_settings(serialize_settings(settings)) == settings
+
+
+def test_settings_stop_at_unknown_id():
+    known = serialize_settings({PMDSetting.samplerate: [130]})
+    later = serialize_settings({PMDSetting.resolution: [14]})
+
+    assert parse_pmd_settings(known + bytes([0x20, 1, 9, 9]) + later) == {
+        PMDSetting.samplerate: [130]
+    }
+
+
+def test_truncated_settings():
+    data = serialize_settings({PMDSetting.samplerate: [25, 50]})
+
+    with pytest.raises(ValueError):
+        parse_pmd_settings(data[:-1])
+
+
+def test_configuration_takes_the_nearest_offered_value():
+    requested = default_pmd_configuration(ACC, acc_rate=200, acc_range=8)
+    offered = {PMDSetting.samplerate: [25, 50, 100], PMDSetting.range: [2, 4, 8]}
+
+    chosen, warnings = choose_pmd_configuration(requested, offered)
+    assert chosen.get(PMDSetting.samplerate) == 100
+    assert chosen.get(PMDSetting.range) == 8
+    # Not offered at all: sent as requested
+    assert chosen.get(PMDSetting.resolution) == 16
+    assert len(warnings) == 1
+
+
+def test_serialized_start_settings():
+    configuration = PMDConfiguration({PMDSetting.resolution: 14, PMDSetting.samplerate: 130})
+
+    assert configuration.serialize() == bytes([0x00, 0x01, 0x82, 0x00, 0x01, 0x01, 0x0E, 0x00])
+
+
+class FakeClient:
+    """
+    Answers every control point write with the replies queued for it.
+    """
+
+    def __init__(self, control: PMDControlPoint | None = None):
+        self.control = control
+        self.replies = []
+
+    async def write_gatt_char(self, _, message: bytes, response: bool):
+        for reply in self.replies.pop(0):
+            asyncio.get_running_loop().call_soon(
+                asyncio.ensure_future, self.control.on_reply(None, reply)
+            )
+
+
+def control_point(*replies: list) -> PMDControlPoint:
+    client = FakeClient()
+    control = PMDControlPoint(client)
+    client.control = control
+    client.replies = list(replies)
+    return control
+
+
+def test_reply_for_another_measurement_is_skipped():
+    settings = serialize_settings({PMDSetting.samplerate: [130]})
+
+    async def run():
+        control = control_point(
+            [
+                # Late reply to an earlier GET_SETTINGS for ACC
+                bytes([0xF0, PMDCommands.GET_SETTINGS, ACC, 0, 0]) + bytes([0, 1, 25, 0]),
+                bytes([0xF0, PMDCommands.GET_SETTINGS, ECG, 0, 0]) + settings,
+            ]
+        )
+        return await control.get_settings(ECG)
+
+    assert asyncio.run(run()) == {PMDSetting.samplerate: [130]}
+
+
+def test_refusal_raises():
+    async def run():
+        control = control_point(
+            [bytes([0xF0, PMDCommands.START_MEASUREMENT, ACC, PMDError.invalid_state])]
+        )
+        await control.start(ACC, default_pmd_configuration(ACC))
+
+    with pytest.raises(PMDControlPointError, match="invalid_state"):
+        asyncio.run(run())
+
+
+def test_unknown_error_code_raises_instead_of_timing_out():
+    async def run():
+        control = control_point([bytes([0xF0, PMDCommands.START_MEASUREMENT, ECG, 0x7E])])
+        control.REPLY_TIMEOUT = 1
+        await control.start(ECG, default_pmd_configuration(ECG))
+
+    with pytest.raises(PMDControlPointError, match="126"):
+        asyncio.run(run())
+
+
+def test_pipeline_follows_the_negotiated_rate(tmp_path):
+    writer = ThreadedWriter("test")
+    pipeline = DevicePipeline(
+        "SIM:01",
+        f"{tmp_path}/",
+        {ECG: ECG_SAMPLE_RATE, ACC: 200},
+        PolarOptions(output_format="columnar"),
+        writer,
+    )
+
+    pipeline.configure(ACC, PMDConfiguration({PMDSetting.samplerate: 100}))
+
+    # Frames of 10 ACC samples 10 ms apart, the rate the strap actually runs at
+    def frame(timestamp: int) -> PMDFrame:
+        values = np.zeros(10, dtype=np.int16)
+        return PMDFrame(ACC, timestamp, 1, False, PMDACCData(values, values, values))
+
+    assert pipeline.quality.check(frame(10**9)) is None
+    assert pipeline.quality.check(frame(10**9 + 10**8)) is None
+    stamped = pipeline.timestamper.stamp(frame(10**9 + 2 * 10**8))
+    assert np.diff(stamped.content.timestamps).tolist() == [10**7] * 9
+    writer.close()
+    assert ColumnarChannel(f"{tmp_path}/acc").meta == {"sample_rate": 100}
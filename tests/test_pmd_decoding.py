@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from polar_iface import (
+    DELTA_FRAME_FORMATS,
+    PMDACCData,
+    PMDCECGData,
+    PMDMeasurmentTypes,
+    decode_delta_frames,
+    parse_pmd_acc,
+    parse_pmd_ecg,
+    parse_pmd_frame,
+)
+from polar_sim import encode_delta_frames, encode_signed
+
+ECG = PMDMeasurmentTypes.ECG
+ACC = PMDMeasurmentTypes.ACC
+
+
+def pmd_frame(
+    measurement: PMDMeasurmentTypes,
+    timestamp: int,
+    frame_type: int,
+    content: bytes,
+    compressed: bool = False,
+) -> bytes:
+    return (
+        bytes([measurement])
+        + timestamp.to_bytes(8, byteorder="little")
+        + bytes([frame_type | (0x80 if compressed else 0)])
+        + content
+    )
+
+
+def test_ecg_int24():
+    content = bytes([0x01, 0x00, 0x00, 0xFF, 0xFF, 0xFF, 0x00, 0x00, 0x80, 0xFF, 0xFF, 0x7F])
+
+    ecg = parse_pmd_ecg(content)
+    assert isinstance(ecg, PMDCECGData)
+    assert ecg.mv.tolist() == [1, -1, -(2**23), 2**23 - 1]
+
+
+@pytest.mark.parametrize("frame_type,width", [(0, 1), (1, 2), (2, 3)])
+def test_acc_sample_widths(frame_type, width):
+    xyz = np.array([[1, -2, 3], [-100, 100, 0], [-120, 127, -128]])
+    content = encode_signed(xyz.ravel(), width)
+
+    acc = parse_pmd_acc(content, frame_type)
+    assert isinstance(acc, PMDACCData)
+    assert acc.x.tolist() == xyz[:, 0].tolist()
+    assert acc.y.tolist() == xyz[:, 1].tolist()
+    assert acc.z.tolist() == xyz[:, 2].tolist()
+
+
+def test_uncompressed_frame():
+    content = encode_signed(np.array([-1000, 0, 999]), 3)
+
+    frame = parse_pmd_frame(pmd_frame(ECG, 123456789, 0, content))
+    assert frame.measurment_type == ECG
+    assert frame.timestamp == 123456789
+    assert not frame.is_compressed
+    assert frame.content.mv.tolist() == [-1000, 0, 999]
+
+
+def test_malformed_frames():
+    # Shorter than a header and one byte of content
+    assert parse_pmd_frame(pmd_frame(ECG, 0, 0, b"")) is None
+    # Not a measurement type
+    assert parse_pmd_frame(pmd_frame(4, 0, 0, bytes(3))) is None
+    # Content that isn't a whole number of samples stays raw
+    assert parse_pmd_frame(pmd_frame(ECG, 0, 0, bytes(4))).content == bytes(4)
+    assert parse_pmd_frame(pmd_frame(ACC, 0, 1, bytes(7))).content == bytes(7)
+    assert parse_pmd_frame(pmd_frame(ACC, 0, 3, bytes(6))).content == bytes(6)
+
+
+@pytest.mark.parametrize("measurement,frame_type", list(DELTA_FRAME_FORMATS))
+def test_delta_frame_round_trip(measurement, frame_type):
+    channels, resolution = DELTA_FRAME_FORMATS[(measurement, frame_type)]
+    rng = np.random.default_rng(frame_type)
+    limit = 2 ** (resolution - 1)
+    # Small steps, a flat run (zero bit deltas) and jumps across the whole range
+    samples = np.concatenate(
+        [
+            np.cumsum(rng.integers(-40, 40, (300, channels)), axis=0),
+            np.full((20, channels), 7),
+            rng.integers(-limit, limit, (30, channels)),
+        ]
+    )
+
+    content = encode_delta_frames(samples, resolution)
+    assert decode_delta_frames(content, channels, resolution).tolist() == samples.tolist()
+
+    frame = parse_pmd_frame(pmd_frame(measurement, 5, frame_type, content, True))
+    assert frame.is_compressed
+    if measurement == ECG:
+        assert frame.content.mv.tolist() == samples[:, 0].tolist()
+    else:
+        decoded = np.stack([frame.content.x, frame.content.y, frame.content.z], axis=1)
+        assert decoded.tolist() == samples.tolist()
+
+
+def test_delta_frame_single_sample():
+    content = encode_delta_frames(np.array([[-3, 4, 5]]), 16)
+
+    assert decode_delta_frames(content, 3, 16).tolist() == [[-3, 4, 5]]
+
+
+def test_truncated_delta_frame():
+    samples = np.cumsum(np.arange(60).reshape(-1, 3), axis=0)
+    content = encode_delta_frames(samples, 16)
+
+    for cut in [1, 5, 7, len(content) - 1]:
+        assert decode_delta_frames(content[:cut], 3, 16) is None
+    # Left undecoded rather than guessed at
+    frame = parse_pmd_frame(pmd_frame(ACC, 0, 1, content[:-1], True))
+    assert frame.content == content[:-1]
+
+
+def test_delta_frame_with_trailing_bytes():
+    content = encode_delta_frames(np.array([[1], [2], [4]]), 24)
+
+    assert decode_delta_frames(content + bytes([0]), 1, 24) is None
+
+
+def test_compressed_frame_of_unknown_format():
+    assert parse_pmd_frame(pmd_frame(ECG, 0, 3, bytes(6), True)).content == bytes(6)
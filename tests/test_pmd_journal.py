@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from pmd_journal import (
+    JOURNAL_NAME,
+    JournalWriter,
+    decode_journal,
+    iter_journal,
+    iter_journal_samples,
+)
+from polar_iface import PMDMeasurmentTypes, PolarOptions
+from polar_sim import SimulatedH10
+from session_store import ColumnarChannel
+
+ECG = PMDMeasurmentTypes.ECG
+ACC = PMDMeasurmentTypes.ACC
+META = {"sample_rates": {"ECG": 130, "ACC": 200}}
+
+
+def write_journal(path, records):
+    journal = JournalWriter(path, META)
+    for monotonic_ns, data in records:
+        journal.append(monotonic_ns, data)
+    journal.close()
+
+
+def strap_frames():
+    """
+    Two ECG frames of 10 samples, one ACC frame of 4, and a notification that isn't a frame.
+    """
+    h10 = SimulatedH10("SIM:01", PolarOptions())
+    return [
+        (1_000, h10.frame(ECG, 0, 10, 10**9, 130)),
+        (2_000, h10.frame(ACC, 0, 4, 10**9, 200)),
+        (3_000, bytes([ECG])),
+        (4_000, h10.frame(ECG, 10, 10, 10**9 + 10 * 10**9 // 130, 130)),
+    ]
+
+
+def test_records_round_trip(tmp_path):
+    records = [(5, b"abc"), (-1, b""), (2**40, bytes(range(256)))]
+    write_journal(tmp_path / JOURNAL_NAME, records)
+
+    assert list(iter_journal(tmp_path / JOURNAL_NAME)) == records
+
+
+def test_cut_record_ends_the_journal(tmp_path):
+    write_journal(tmp_path / JOURNAL_NAME, [(5, b"abc"), (6, b"defg")])
+    data = (tmp_path / JOURNAL_NAME).read_bytes()
+    (tmp_path / JOURNAL_NAME).write_bytes(data[:-1])
+
+    assert list(iter_journal(tmp_path / JOURNAL_NAME)) == [(5, b"abc")]
+
+
+def test_not_a_journal(tmp_path):
+    (tmp_path / JOURNAL_NAME).write_bytes(b"ECG,1,2\n")
+
+    with pytest.raises(ValueError):
+        list(iter_journal(tmp_path / JOURNAL_NAME))
+
+
+def test_decoded_like_a_live_recording(tmp_path):
+    write_journal(tmp_path / JOURNAL_NAME, strap_frames())
+
+    samples = list(iter_journal_samples(tmp_path / JOURNAL_NAME))
+    assert [sample.sample.measurment_type for sample in samples] == [ECG, ACC, ECG]
+    assert [sample.time for sample in samples] == [1_000, 2_000, 4_000]
+    ecg = np.concatenate([samples[i].sample.content.timestamps for i in (0, 2)])
+    # One sample every 1/130 s, across both frames
+    assert np.all(np.abs(np.diff(ecg) - 1e9 / 130) <= 1)
+
+
+@pytest.mark.parametrize("output_format", ["csv", "columnar"])
+def test_decode_journal(tmp_path, output_format):
+    write_journal(tmp_path / JOURNAL_NAME, strap_frames())
+
+    decode_journal(f"{tmp_path}/", output_format)
+    if output_format == "csv":
+        assert len((tmp_path / "ecg.csv").read_text().splitlines()) == 20
+        assert len((tmp_path / "acc.csv").read_text().splitlines()) == 4
+    else:
+        assert len(ColumnarChannel(tmp_path / "ecg")) == 20
+        assert ColumnarChannel(tmp_path / "acc").meta == {"sample_rate": 200}
@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from polar_iface import PMDCommands, PMDError, PMDMeasurmentTypes, PolarContext, PolarOptions
+from polar_offline import (
+    OFFLINE_ROOT,
+    RecordingDecoder,
+    RecordingFormatError,
+    download_recordings,
+    encode_recording,
+    recording_start_ns,
+    start_recording,
+)
+from polar_sim import SimulatedTransport, encode_signed
+
+ECG = PMDMeasurmentTypes.ECG
+ACC = PMDMeasurmentTypes.ACC
+ADDRESS = "SIM:01"
+
+
+def recording_frame(timestamp: int, measurement: PMDMeasurmentTypes = ECG) -> bytes:
+    return (
+        bytes([measurement])
+        + timestamp.to_bytes(8, byteorder="little")
+        + bytes([0])
+        + encode_signed(np.arange(4), 3)
+    )
+
+
+def logs(ctx: PolarContext) -> list:
+    async def drain():
+        messages = []
+        while not ctx._print_queue.empty():
+            messages += await ctx.get_next_prints(100)
+        return [message.message for message in messages]
+
+    return asyncio.run(drain())
+
+
+def test_recording_in_pieces():
+    frames = [recording_frame(t) for t in (10, 20, 30)]
+    data = encode_recording(frames)
+    decoder = RecordingDecoder(ECG, "ECG.REC")
+
+    decoded = []
+    for i in range(0, len(data), 7):
+        decoded += decoder.feed(data[i : i + 7])
+    assert decoded == frames
+    assert decoder.pending() == 0
+
+
+def test_recording_ends_in_partial_frame():
+    data = encode_recording([recording_frame(10), recording_frame(20)])
+    decoder = RecordingDecoder(ECG)
+
+    assert len(decoder.feed(data[:-3])) == 1
+    assert decoder.pending() > 0
+
+
+@pytest.mark.parametrize(
+    "frames",
+    [
+        # Another measurement
+        [recording_frame(10, ACC)],
+        # Time going back
+        [recording_frame(20), recording_frame(10)],
+        # Nothing past the header
+        [recording_frame(10)[:10]],
+    ],
+)
+def test_corrupt_recording(frames):
+    decoder = RecordingDecoder(ECG, "ECG.REC")
+
+    with pytest.raises(RecordingFormatError):
+        decoder.feed(encode_recording(frames))
+
+
+def test_recording_start_from_directory():
+    assert recording_start_ns(f"{OFFLINE_ROOT}20240229/R/235901/ECG.REC") == (
+        1709251141 * 10**9
+    )
+    assert recording_start_ns(f"{OFFLINE_ROOT}20240229/E/235901/ECG.REC") is None
+    assert recording_start_ns(f"{OFFLINE_ROOT}ECG.REC") is None
+    assert recording_start_ns("/SYS/20240229/R/235901/ECG.REC") is None
+
+
+def test_refused_measurement_is_skipped():
+    options = PolarOptions(mode="offline", transport="sim")
+    transport = SimulatedTransport(options)
+    ctx = PolarContext("")
+    configured = []
+
+    async def run():
+        h10 = await transport.find_device(ADDRESS, 0)
+        control = h10.control
+
+        def refuse_acc(message: bytes) -> bytes:
+            if message[0] == PMDCommands.START_MEASUREMENT and message[1] & 0x3F == ACC:
+                return bytes([0xF0, message[0], ACC, PMDError.not_supported, 0])
+            return control(message)
+
+        h10.control = refuse_acc
+        started = await start_recording(
+            ctx, ADDRESS, options, transport, lambda m, _: configured.append(m)
+        )
+        return started, h10
+
+    started, h10 = asyncio.run(run())
+    assert started == configured == [ECG]
+    assert list(h10.recordings) == [ECG]
+    assert any("ACC refused" in message for message in logs(ctx))
+
+
+def test_only_this_sessions_recording_is_downloaded_and_removed():
+    options = PolarOptions(mode="offline", transport="sim")
+    transport = SimulatedTransport(options)
+    ctx = PolarContext("")
+    earlier = f"{OFFLINE_ROOT}20210101/R/120000/ECG.REC"
+    frames = []
+
+    async def on_frame(data: bytes, arrived: int):
+        frames.append(data)
+
+    async def run():
+        h10 = await transport.find_device(ADDRESS, 0)
+        h10.files[earlier] = encode_recording([recording_frame(10)])
+        since_ns = time.time_ns()
+        started = await start_recording(ctx, ADDRESS, options, transport)
+        # A few ECG frames
+        await asyncio.sleep(1.5)
+        await download_recordings(ctx, ADDRESS, transport, started, since_ns, 0, on_frame)
+        return h10
+
+    h10 = asyncio.run(run())
+    assert len(frames) >= 2
+    assert {frame[0] for frame in frames} == {ECG, ACC}
+    # The other session's is neither downloaded nor removed, this one's is gone
+    assert list(h10.files) == [earlier]
+
+
+def test_undecoded_recording_is_kept():
+    options = PolarOptions(mode="offline", transport="sim")
+    transport = SimulatedTransport(options)
+    ctx = PolarContext("")
+    now = time.time_ns()
+    directory = time.strftime("%Y%m%d/R/%H%M%S/", time.gmtime(now // 10**9))
+    corrupt = f"{OFFLINE_ROOT}{directory}ECG.REC"
+
+    async def on_frame(data: bytes, arrived: int):
+        pass
+
+    async def run():
+        h10 = await transport.find_device(ADDRESS, 0)
+        h10.files[corrupt] = encode_recording([recording_frame(10, ACC)])
+        await download_recordings(ctx, ADDRESS, transport, [], now, 0, on_frame)
+        return h10
+
+    h10 = asyncio.run(run())
+    assert list(h10.files) == [corrupt]
+    assert any("Not decoded" in message for message in logs(ctx))
@@ -0,0 +1,77 @@
+import numpy as np
+
+from polar_iface import (
+    PMDACCData,
+    PMDCECGData,
+    PMDFrame,
+    PMDMeasurmentTypes,
+    SampleTimestamper,
+)
+
+ECG = PMDMeasurmentTypes.ECG
+ACC = PMDMeasurmentTypes.ACC
+RATES = {ECG: 100, ACC: 200}
+# 10 ms at 100 Hz
+INTERVAL = 10**7
+
+
+def ecg_frame(timestamp: int, count: int = 10) -> PMDFrame:
+    return PMDFrame(ECG, timestamp, 0, False, PMDCECGData(timestamp, np.zeros(count)))
+
+
+def spacing(frame: PMDFrame) -> list:
+    return np.diff(frame.content.timestamps).tolist()
+
+
+def test_first_frame_runs_at_the_configured_rate():
+    stamped = SampleTimestamper(RATES).stamp(ecg_frame(10**9))
+
+    # The frame timestamp is its last sample's
+    assert stamped.content.timestamps[-1] == 10**9
+    assert spacing(stamped) == [INTERVAL] * 9
+
+
+def test_samples_spread_between_frames():
+    timestamper = SampleTimestamper(RATES)
+    timestamper.stamp(ecg_frame(10**9))
+
+    # The strap's clock runs 1 % fast
+    stamped = timestamper.stamp(ecg_frame(10**9 + 10 * 10_100_000))
+    assert stamped.content.timestamps[-1] == 10**9 + 10 * 10_100_000
+    assert spacing(stamped) == [10_100_000] * 9
+
+
+def test_gap_falls_back_to_the_configured_rate():
+    timestamper = SampleTimestamper(RATES)
+    timestamper.stamp(ecg_frame(10**9))
+
+    # Three frames lost, the samples aren't stretched over the gap
+    stamped = timestamper.stamp(ecg_frame(10**9 + 40 * INTERVAL))
+    assert spacing(stamped) == [INTERVAL] * 9
+    # and the next frame carries on as usual
+    assert spacing(timestamper.stamp(ecg_frame(10**9 + 50 * INTERVAL))) == [INTERVAL] * 9
+
+
+def test_overlap_falls_back_to_the_configured_rate():
+    timestamper = SampleTimestamper(RATES)
+    timestamper.stamp(ecg_frame(10**9))
+
+    stamped = timestamper.stamp(ecg_frame(10**9 - 5 * INTERVAL))
+    assert stamped.content.timestamps[-1] == 10**9 - 5 * INTERVAL
+    assert spacing(stamped) == [INTERVAL] * 9
+
+
+def test_measurements_are_stamped_separately():
+    timestamper = SampleTimestamper(RATES)
+    timestamper.stamp(ecg_frame(10**9))
+    values = np.zeros(4, dtype=np.int16)
+    frame = PMDFrame(ACC, 10**9 + 1, 1, False, PMDACCData(values, values, values))
+
+    acc = timestamper.stamp(frame)
+    assert spacing(acc) == [INTERVAL // 2] * 3
+
+
+def test_undecoded_frames_pass_through():
+    frame = PMDFrame(ECG, 10**9, 0, False, bytes(5))
+
+    assert SampleTimestamper(RATES).stamp(frame) is frame
@@ -0,0 +1,94 @@
+import json
+
+import numpy as np
+import pytest
+
+from session_store import (
+    CHANNEL_COLUMNS,
+    HEADER_NAME,
+    ColumnarChannel,
+    ColumnarChannelWriter,
+    export_channel_csv,
+    open_session,
+)
+
+ROWS = {
+    "host_time": np.array([1_700_000_000_000_000_000, 1_700_000_000_007_692_307]),
+    "sensor_time": np.array([5, 7_692_312]),
+    "mv": np.array([-120, 2**20]),
+}
+
+
+def test_round_trip(tmp_path):
+    writer = ColumnarChannelWriter(
+        tmp_path / "ecg", CHANNEL_COLUMNS["ecg"], {"sample_rate": 130}
+    )
+    for i in range(3):
+        writer.append(**{name: values + i for name, values in ROWS.items()})
+    writer.close()
+
+    channel = ColumnarChannel(tmp_path / "ecg")
+    assert len(channel) == 6
+    assert channel.meta == {"sample_rate": 130}
+    assert channel.column_names() == ["host_time", "sensor_time", "mv"]
+    assert channel["mv"].dtype == np.int32
+    assert channel["mv"].tolist() == [-120, 2**20, -119, 2**20 + 1, -118, 2**20 + 2]
+    assert channel["sensor_time"][-1] == 7_692_314
+
+
+def test_rows_written_so_far_are_readable_after_flush(tmp_path):
+    writer = ColumnarChannelWriter(tmp_path / "ecg", CHANNEL_COLUMNS["ecg"])
+    writer.append(**ROWS)
+    assert len(ColumnarChannel(tmp_path / "ecg")) == 0
+
+    writer.flush()
+    assert len(ColumnarChannel(tmp_path / "ecg")) == 2
+    writer.close()
+
+
+def test_partial_row_is_trimmed(tmp_path):
+    writer = ColumnarChannelWriter(tmp_path / "ecg", CHANNEL_COLUMNS["ecg"])
+    writer.append(**ROWS)
+    writer.close()
+    # As if the writer died after the first column of a row
+    with open(tmp_path / "ecg" / "host_time.bin", "ab") as fd:
+        fd.write(np.int64(1).tobytes())
+
+    channel = ColumnarChannel(tmp_path / "ecg")
+    assert len(channel) == 2
+    assert len(channel["host_time"]) == 2
+
+
+def test_meta_update(tmp_path):
+    writer = ColumnarChannelWriter(
+        tmp_path / "acc", CHANNEL_COLUMNS["acc"], {"sample_rate": 200}
+    )
+    writer.update_meta({"sample_rate": 100})
+    writer.close()
+
+    assert ColumnarChannel(tmp_path / "acc").meta == {"sample_rate": 100}
+
+
+def test_unknown_version(tmp_path):
+    ColumnarChannelWriter(tmp_path / "ecg", CHANNEL_COLUMNS["ecg"]).close()
+    header = json.loads((tmp_path / "ecg" / HEADER_NAME).read_text())
+    header["version"] += 1
+    (tmp_path / "ecg" / HEADER_NAME).write_text(json.dumps(header))
+
+    with pytest.raises(ValueError):
+        ColumnarChannel(tmp_path / "ecg")
+
+
+def test_export_matches_the_live_csv(tmp_path):
+    writer = ColumnarChannelWriter(tmp_path / "ecg", CHANNEL_COLUMNS["ecg"])
+    writer.append(**ROWS)
+    writer.close()
+    (tmp_path / "notes").mkdir()
+
+    session = open_session(tmp_path)
+    assert list(session) == ["ecg"]
+    export_channel_csv(session["ecg"], tmp_path / "ecg.csv")
+    assert (tmp_path / "ecg.csv").read_text().splitlines() == [
+        "2023-11-14T22:13:20.000000+00:00,5,-120",
+        "2023-11-14T22:13:20.007692+00:00,7692312,1048576",
+    ]
@@ -0,0 +1,73 @@
+import numpy as np
+
+from polar_iface import (
+    PMDCECGData,
+    PMDFrame,
+    PMDMeasurmentTypes,
+    StreamEvent,
+    StreamQualityMonitor,
+    gap_writer_fmt,
+)
+
+ECG = PMDMeasurmentTypes.ECG
+ACC = PMDMeasurmentTypes.ACC
+RATES = {ECG: 100, ACC: 200}
+# 10 samples at 100 Hz
+FRAME_NS = 10**8
+
+
+def ecg_frame(timestamp: int, count: int = 10) -> PMDFrame:
+    return PMDFrame(ECG, timestamp, 0, False, PMDCECGData(timestamp, np.zeros(count)))
+
+
+def test_continuous_stream():
+    monitor = StreamQualityMonitor(RATES)
+
+    # Up to half a frame of jitter either way
+    for timestamp in [0, FRAME_NS, 2 * FRAME_NS + FRAME_NS // 2, 3 * FRAME_NS]:
+        assert monitor.check(ecg_frame(10**9 + timestamp)) is None
+    assert monitor.stats()["ECG"] == {
+        "samples": 40,
+        "missing": 0,
+        "gaps": 0,
+        "overlaps": 0,
+        "duplicates": 0,
+        "loss_pct": 0.0,
+    }
+
+
+def test_gap_counts_the_missing_samples():
+    monitor = StreamQualityMonitor(RATES)
+    monitor.check(ecg_frame(10**9))
+
+    event = monitor.check(ecg_frame(10**9 + 4 * FRAME_NS))
+    assert event == StreamEvent(ECG, "gap", 10**9, 10**9 + 4 * FRAME_NS, 30)
+    assert gap_writer_fmt(event) == "ECG,gap,1000000000,1400000000,400000000,30\n"
+    stats = monitor.stats()["ECG"]
+    assert stats["gaps"] == 1
+    assert stats["missing"] == 30
+    assert stats["loss_pct"] == 60.0
+
+
+def test_overlap_and_duplicate():
+    monitor = StreamQualityMonitor(RATES)
+    monitor.check(ecg_frame(10**9))
+    monitor.check(ecg_frame(10**9 + FRAME_NS))
+
+    assert monitor.check(ecg_frame(10**9 + FRAME_NS)).kind == "duplicate"
+    assert monitor.check(ecg_frame(10**9 + FRAME_NS // 2)).kind == "overlap"
+    # Still measured from the latest frame, so the next one in order isn't a gap
+    assert monitor.check(ecg_frame(10**9 + 2 * FRAME_NS)) is None
+
+    stats = monitor.stats()["ECG"]
+    assert (stats["duplicates"], stats["overlaps"], stats["samples"]) == (1, 1, 40)
+
+
+def test_measurements_are_checked_separately():
+    monitor = StreamQualityMonitor(RATES)
+    monitor.check(ecg_frame(10**9))
+
+    acc = PMDFrame(ACC, 10**9 + 10 * FRAME_NS, 1, False, bytes(60))
+    assert monitor.check(acc) is None
+    assert monitor.check(ecg_frame(10**9 + FRAME_NS)) is None
+    assert set(monitor.stats()) == {"ECG", "ACC"}
@@ -0,0 +1,84 @@
+import asyncio
+import threading
+
+from threaded_writer import ThreadedWriter
+
+
+def test_writes_run_in_order_and_close_outputs():
+    written = []
+
+    class Output:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    writer = ThreadedWriter("test", max_pending=4)
+    output = writer.register(Output())
+    for i in range(10):
+        writer.submit(written.append, i)
+    writer.close()
+
+    assert written == list(range(10))
+    assert output.closed
+    assert writer.pop_stats()["writes"] == 10
+    assert writer.pop_stats()["writes"] == 0
+
+
+def test_errors_are_counted_not_raised():
+    def fail():
+        raise OSError("disk full")
+
+    writer = ThreadedWriter("test")
+    writer.submit(fail)
+    writer.close()
+
+    stats = writer.pop_stats()
+    assert stats["errors"] == 1
+    assert "disk full" in stats["last_error"]
+
+
+def test_backlog_is_bounded():
+    release = threading.Event()
+
+    async def run():
+        writer = ThreadedWriter("test", max_pending=4)
+        # Holds up the thread, everything after it stays queued
+        writer.submit(release.wait)
+        while writer.pending():
+            await asyncio.sleep(0.001)
+        accepted = [writer.try_submit(lambda: None) for _ in range(6)]
+
+        waiting = asyncio.create_task(writer.wait_for_room())
+        await asyncio.sleep(0.01)
+        stalled = not waiting.done()
+        release.set()
+        await asyncio.wait_for(waiting, 1)
+
+        backlog = writer.backlog()
+        writer.close()
+        stats = writer.pop_stats()
+        return accepted, stalled, backlog, stats
+
+    accepted, stalled, backlog, stats = asyncio.run(run())
+    assert accepted == [True] * 4 + [False] * 2
+    assert stalled
+    assert backlog["stalls"] == 1 and backlog["dropped"] == 2
+    assert backlog["pending"] <= 2
+    assert stats["high_water"] == 4 and stats["writes"] == 5
+
+
+def test_close_wakes_waiting_producers():
+    release = threading.Event()
+
+    async def run():
+        writer = ThreadedWriter("test", max_pending=1)
+        writer.submit(release.wait)
+        writer.submit(lambda: None)
+        waiting = asyncio.create_task(writer.wait_for_room())
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.get_running_loop().run_in_executor(None, writer.close)
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(run())
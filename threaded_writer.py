@@ -0,0 +1,159 @@
+# Runs blocking file I/O on a dedicated thread. Collectors hand writes over through a queue,
+# so an SD card stall never holds up the asyncio loop that handles BLE notifications and stdout.
+# The queue is bounded: producers that can wait do so in wait_for_room, the others have their
+# writes refused by try_submit, and both are counted.
+
+import asyncio
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Mapping
+
+# Writes queued for the thread before producers have to wait
+DEFAULT_MAX_PENDING = 256
+
+
+class ThreadedWriter:
+    """
+    Executes submitted write calls in order on a single writer thread and keeps latency stats.
+    Outputs registered with the writer are flushed and closed by the thread on close().
+    """
+
+    def __init__(self, name: str = "writer", max_pending: int = DEFAULT_MAX_PENDING):
+        self._queue = queue.SimpleQueue()
+        self._outputs: List[Any] = []
+        self._stats_lock = threading.Lock()
+        self._max_pending = max_pending
+        # Loops and futures of producers in wait_for_room, resolved by the thread
+        self._waiting: List[tuple] = []
+        # Totals, not reset by pop_stats
+        self._stalls = 0
+        self._dropped = 0
+        self._reset_stats()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _reset_stats(self):
+        self._writes = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._errors = 0
+        self._last_error = None
+        self._high_water = self.pending()
+
+    def register(self, output: Any) -> Any:
+        self._outputs.append(output)
+        return output
+
+    def submit(self, func: Callable, *args):
+        """
+        Queues a write whatever the backlog, for producers that await wait_for_room first.
+        """
+        self._queue.put((func, args))
+        self._high_water = max(self._high_water, self._queue.qsize())
+
+    def try_submit(self, func: Callable, *args) -> bool:
+        """
+        Queues a write unless the backlog is full, for producers that can't wait.
+        """
+        if self._queue.qsize() >= self._max_pending:
+            self._dropped += 1
+            return False
+        self.submit(func, *args)
+        return True
+
+    async def wait_for_room(self):
+        """
+        Waits while the backlog is full, until the thread has worked it down to half.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._stats_lock:
+                if self._queue.qsize() < self._max_pending:
+                    return
+                self._stalls += 1
+                future = loop.create_future()
+                self._waiting.append((loop, future))
+            await future
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def backlog(self) -> Mapping[str, int]:
+        """
+        Current backlog and overflow totals, unlike pop_stats nothing is reset.
+        """
+        return {
+            "pending": self.pending(),
+            "max_pending": self._max_pending,
+            "stalls": self._stalls,
+            "dropped": self._dropped,
+        }
+
+    def pop_stats(self) -> Mapping[str, Any]:
+        """
+        Returns write latency stats gathered since the previous call.
+        """
+        with self._stats_lock:
+            stats = {
+                "writes": self._writes,
+                "mean_ms": round(self._total_latency / self._writes * 1000, 3)
+                if self._writes
+                else 0.0,
+                "max_ms": round(self._max_latency * 1000, 3),
+                "pending": self.pending(),
+                "high_water": self._high_water,
+                "stalls": self._stalls,
+                "dropped": self._dropped,
+                "errors": self._errors,
+                "last_error": self._last_error,
+            }
+            self._reset_stats()
+        return stats
+
+    def _run(self):
+        while (item := self._queue.get()) is not None:
+            func, args = item
+            start = time.perf_counter()
+            error = None
+            try:
+                func(*args)
+            except Exception as e:
+                error = repr(e)
+            elapsed = time.perf_counter() - start
+
+            with self._stats_lock:
+                self._writes += 1
+                self._total_latency += elapsed
+                self._max_latency = max(self._max_latency, elapsed)
+                if error:
+                    self._errors += 1
+                    self._last_error = error
+                if self._waiting and self._queue.qsize() <= self._max_pending // 2:
+                    self._wake_waiting()
+
+        for output in self._outputs:
+            try:
+                output.close()
+            except Exception as e:
+                self._last_error = repr(e)
+
+        with self._stats_lock:
+            self._wake_waiting()
+
+    def _wake_waiting(self):
+        for loop, future in self._waiting:
+            loop.call_soon_threadsafe(wake, future)
+        self._waiting = []
+
+    def close(self):
+        """
+        Drains every queued write, closes the registered outputs and stops the thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+
+def wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)